@@ -1,5 +1,6 @@
 from pathlib import Path
 import shutil
+import sys
 
 import pandas as pd
 
@@ -8,6 +9,10 @@ import pandas as pd
 REPO_ROOT = Path(__file__).resolve().parents[2]
 SHARD_NUMBER = 4
 
+# Run as a script: make `pipeline` importable for the image store
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
 # -------------------
 
 def segregate_train_val(images_dir: Path, v1_meta_path: Path, move=False):
@@ -46,6 +51,23 @@ def segregate_train_val(images_dir: Path, v1_meta_path: Path, move=False):
 
     print(f"[Done] Labels moved={moved}, labels skipped={skipped}")
 
+def materialize_split_images(images_dir: Path, v1_meta_path: Path, store_root: Path | None = None):
+    """Extract each split's images from the packed image store into {split}/images (YOLO reads folders)."""
+    from pipeline.modules.image_store import ImageStore, extract_images
+
+    df = pd.read_csv(v1_meta_path)
+    norm = {"train":"train", "val":"val", "valid":"val", "validation":"val", "test":"test"}
+    df["id"] = df["id"].astype(str).str.strip()
+    df["split"] = df["split"].astype(str).str.strip().str.lower().map(norm)
+
+    with ImageStore(store_root) as store:
+        keys = store.keys()
+        key_ids = keys.str.split("_").str[0]
+        for split in ("train", "val", "test"):
+            ids = set(df.loc[df["split"] == split, "id"])
+            n = extract_images(store, keys[key_ids.isin(ids)], images_dir / split / "images")
+            print(f"[Done] {split}: {n} images extracted from {store.root}")
+
 def make_ls_csv(shard_local_csv, out_csv):
     df = pd.read_csv(shard_local_csv)
     split = df["split"].str.lower().map({"validation":"val"}).fillna(df["split"].str.lower())
@@ -73,6 +95,13 @@ if __name__ == "__main__":
     # To segregate train/val/test splits for CV model (YOLO)
     segregate_train_val(images_dir=v1_images_dir,
                         v1_meta_path=v1_meta_out_dir / "annotation_v1.csv")
+
+    # Images downloaded into the packed store are written out per split for YOLO
+    from pipeline.modules.image_store import _store_cfg
+
+    if _store_cfg()["enabled"]:
+        materialize_split_images(images_dir=v1_images_dir,
+                                 v1_meta_path=v1_meta_out_dir / "annotation_v1.csv")
     
     # To create a label studio manifest
     if not (v1_meta_out_dir / ls_file).exists():
@@ -1,4 +1,5 @@
 from pathlib import Path
+import sys
 
 from ultralytics import YOLO
 import yaml
@@ -9,6 +10,10 @@ REPO_ROOT = Path(__file__).resolve().parents[2]
 MODELS_DIR = REPO_ROOT / "models"
 CV_MODEL_DIR = MODELS_DIR / "cv-yolo-model"
 
+# Run as a script: make `pipeline` importable for the image store
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
 with open(MODELS_DIR / "cv-yolo-model" / "configs" / "yolo11s_v1_01.yaml", "r", encoding="utf-8") as f:
     cfg_all = yaml.safe_load(f)
 
@@ -57,6 +62,24 @@ def export_model(model_weights_path: Path):
 
     return result
 
+def predict_from_store(model_weights_path: Path, keys=None, store_root: Path | None = None, batch: int = 16, **predict_kwargs):
+    """
+    Inference straight from the packed image store: images are decoded from the shard maps
+    (no per-file opens) and fed to YOLO in batches. Yields (key, result) per image.
+    """
+    from pipeline.modules.image_store import ImageStore
+
+    model = YOLO(str(model_weights_path))
+    with ImageStore(store_root) as store:
+        pending = []
+        for item in store.iter_images(keys):
+            pending.append(item)
+            if len(pending) == batch:
+                yield from zip([k for k, _ in pending], model.predict([im for _, im in pending], verbose=False, **predict_kwargs))
+                pending = []
+        if pending:
+            yield from zip([k for k, _ in pending], model.predict([im for _, im in pending], verbose=False, **predict_kwargs))
+
 if __name__ == "__main__":
     #run_yolo_model()
     export_model(model_weights_path=BEST_MODEL_PATH)
\ No newline at end of file
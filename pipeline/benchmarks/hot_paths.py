@@ -0,0 +1,306 @@
+"""
+Wall-time / peak-RSS benchmarks for SBAFN pipeline hot paths on synthetic cities.
+
+Each (case, size) runs in a fresh interpreter: inputs are generated first, then the call runs once
+untimed (lazy imports, caches) and `--repeat` more times timed. Recorded per case:
+- wall_s:        best wall time over the timed repeats
+- peak_rss_mb:   process peak RSS after the case (the child process runs only this case)
+- rss_delta_mb:  peak RSS growth caused by the case itself, warm-up included (peak after − peak after setup)
+Both are None where the platform reports no peak RSS (Windows without psutil).
+
+Results are compared with `baselines.json`; a case regresses if wall_s or rss_delta_mb exceeds
+its baseline by more than `--threshold` (default 25%) plus an absolute noise floor (MIN_SLACK: 50 ms,
+8 MB), so millisecond cases do not trip on jitter. Baselines are machine-specific: re-record with
+`--update-baseline` (default --repeat or higher) on the box that runs the comparison. Fully offline (see synthetic.py).
+
+Cases
+    make_segments, make_corridors, join_elevation, elevation_profile, risk_scoring, route_od,
+    hydrology, segment_adjacency, export_lonlat, news_match                     sizes: 1k 10k 100k 1M edges
+    equirect_to_perspective                                                     sizes: pano width (2k, 4k)
+    dedup_search                                                                sizes: images (1k … 1M)
+    image_store_read                                                            sizes: images (1k, 10k)
+
+Usage
+    python -m pipeline.benchmarks.hot_paths                        # 1k edges, exit 1 on regression
+    python -m pipeline.benchmarks.hot_paths --sizes 1k 10k 100k --cases make_segments
+    python -m pipeline.benchmarks.hot_paths --update-baseline      # record current numbers
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from pipeline.config import REPO_ROOT
+from pipeline.metrics import _peak_rss_mb
+
+BASELINE_PATH = Path(__file__).with_name("baselines.json")
+DEFAULT_SIZES = ["1k"]
+PANO_SIZES = ["2k", "4k"]
+THRESHOLD = 0.25
+REPEAT = 3
+MIN_SLACK = {"wall_s": 0.05, "rss_delta_mb": 8.0}   # absolute noise floor on top of the threshold
+
+# ---------------------------------
+# Case setups: size → zero-arg callable timed by the runner. Heavy imports stay inside.
+
+def _network(size):
+    from pipeline.benchmarks.synthetic import parse_size, synthetic_network
+
+    return synthetic_network(parse_size(size))
+
+
+def _segments(size):
+    from pipeline.modules.street_define import make_segments
+
+    _, edges = _network(size)
+    return make_segments(edges, split_len_m=30)
+
+
+def setup_make_segments(size):
+    from pipeline.modules.street_define import make_segments
+
+    _, edges = _network(size)
+    return lambda: make_segments(edges, split_len_m=30)
+
+
+def setup_make_corridors(size):
+    from pipeline.modules.street_define import make_corridors
+
+    segments = _segments(size)
+    return lambda: make_corridors(segments, merge_dual=False)
+
+
+def setup_join_elevation(size):
+    from pipeline.benchmarks.synthetic import synthetic_dem
+    from pipeline.modules.segments_elevation import join_elevation_to_segments
+
+    segments = _segments(size)
+    dem = synthetic_dem(segments.total_bounds)
+    return lambda: join_elevation_to_segments(segments, dem, buf_m=15.0, max_nn_m=60.0)
+
+
+def setup_risk_scoring(size):
+    from pipeline.benchmarks.synthetic import synthetic_dem
+    from pipeline.modules.risk_scoring import score_segments
+    from pipeline.modules.segments_elevation import join_elevation_to_segments
+
+    segments = _segments(size)
+    features = join_elevation_to_segments(segments, synthetic_dem(segments.total_bounds), buf_m=15.0, max_nn_m=60.0)
+    return lambda: score_segments(features)
+
+
+def setup_route_od(size):
+    import numpy as np
+    from pipeline.modules.routing import RoadGraph
+
+    nodes, edges = _network(size)
+    graph = RoadGraph.from_edges(nodes, edges)
+    rng = np.random.default_rng(0)
+    o, d = rng.integers(0, graph.n_nodes, (2, 1000))
+    G = graph.matrix(graph.weights())
+    return lambda: graph.od_costs(o, d, graph=G)
+
+
+def setup_elevation_profile(size):
+    from affine import Affine
+    from pipeline.benchmarks.synthetic import synthetic_dem
+    from pipeline.modules.elevation_profile import profile_segments
+
+    segments = _segments(size)
+    dem = synthetic_dem(segments.total_bounds)
+    lons, lats = dem["lon"].unique(), dem["lat"].unique()
+    grid = dem["elevation_30m"].to_numpy(dtype="float64").reshape(len(lats), -1)[::-1]
+    dlon, dlat = lons[1] - lons[0], lats[1] - lats[0]
+    transform = Affine(dlon, 0.0, lons[0] - dlon / 2, 0.0, -dlat, lats[-1] + dlat / 2)
+    return lambda: profile_segments(segments, grid, transform=transform, crs="EPSG:4326", spacing_m=5.0)
+
+
+def setup_hydrology(size):
+    from pipeline.benchmarks.synthetic import synthetic_dem
+    from pipeline.modules.hydrology import condition_dem
+
+    dem = synthetic_dem(_segments(size).total_bounds)
+    grid = dem["elevation_30m"].to_numpy(dtype="float64").reshape(dem["lat"].nunique(), -1)[::-1]
+    return lambda: condition_dem(grid, cell_m=(30.0, 30.0))
+
+
+def setup_segment_adjacency(size):
+    import numpy as np
+    from pipeline.modules.segment_adjacency import adjacency_features, segment_adjacency
+    from pipeline.modules.street_define import make_segment_table
+
+    _, edges = _network(size)
+    table = make_segment_table(edges, split_len_m=30)
+    elev = np.random.default_rng(0).normal(5.0, 1.0, len(table))
+    return lambda: adjacency_features(segment_adjacency(table), elev, hops=(1, 2))
+
+
+def setup_export_lonlat(size):
+    from pipeline.modules.node_lonlat_export import export_segment_lonlat
+
+    segments = _segments(size)
+    return lambda: export_segment_lonlat(segments)
+
+
+def setup_news_match(size):
+    from pipeline.benchmarks.synthetic import synthetic_news
+    from pipeline.modules.news_match_pipeline import extract_reported_streets, mark_reported_segments
+
+    streets = _segments(size).drop(columns="geometry")
+    news = synthetic_news(streets["street_label"], n_articles=200)
+
+    def run():
+        reported = extract_reported_streets(news, verbose=False)
+        return mark_reported_segments(streets.copy(), reported)
+    return run
+
+
+def setup_dedup_search(size):
+    import numpy as np
+    from pipeline.benchmarks.synthetic import parse_size, synthetic_image_hashes
+    from pipeline.modules.image_dedup import find_duplicates
+
+    imgs = synthetic_image_hashes(parse_size(size))
+    args = (imgs["hash"].to_numpy(), imgs["lat"].to_numpy(), imgs["lon"].to_numpy(),
+            imgs["sequence"].to_numpy(), np.arange(len(imgs)))
+    return lambda: find_duplicates(*args, max_hamming=6, radius_m=15.0)
+
+
+def setup_image_store_read(size):
+    import atexit
+    import shutil
+    import tempfile
+
+    import cv2
+    import numpy as np
+    from pipeline.benchmarks.synthetic import parse_size
+    from pipeline.modules.image_store import ImageStore
+
+    rng = np.random.default_rng(0)
+    _, jpg = cv2.imencode(".jpg", rng.integers(0, 255, (128, 128, 3), dtype=np.uint8))
+    root = tempfile.mkdtemp(prefix="sbafn_store_")
+    atexit.register(shutil.rmtree, root, True)
+    store = ImageStore(root, shard_mb=64)
+    for k in range(parse_size(size)):
+        store.put(f"{k}_1024.jpg", jpg.data)
+    store.flush()
+    return lambda: sum(im.shape[0] for _, im in store.iter_images(flags=cv2.IMREAD_REDUCED_GRAYSCALE_4))
+
+
+def setup_equirect_to_perspective(size):
+    from pipeline.benchmarks.synthetic import parse_size, synthetic_pano
+    from pipeline.modules.mapillary_client import _equirect_to_perspective
+
+    pano = synthetic_pano(parse_size(size))
+    return lambda: [_equirect_to_perspective(pano, yaw_deg=yaw, hfov_deg=90.0) for yaw in (0, 90, 180, 270)]
+
+
+CASES = {
+    "make_segments": setup_make_segments,
+    "make_corridors": setup_make_corridors,
+    "join_elevation": setup_join_elevation,
+    "risk_scoring": setup_risk_scoring,
+    "route_od": setup_route_od,
+    "elevation_profile": setup_elevation_profile,
+    "hydrology": setup_hydrology,
+    "segment_adjacency": setup_segment_adjacency,
+    "export_lonlat": setup_export_lonlat,
+    "news_match": setup_news_match,
+    "equirect_to_perspective": setup_equirect_to_perspective,
+    "dedup_search": setup_dedup_search,
+    "image_store_read": setup_image_store_read,
+}
+
+#  ------------- MEASUREMENT -------------
+
+def run_case_inprocess(case: str, size: str, repeat: int = REPEAT) -> dict:
+    fn = CASES[case](size)
+    rss_setup = _peak_rss_mb()
+    fn()                                    # warm-up, not timed
+    walls = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        walls.append(time.perf_counter() - t0)
+    peak = _peak_rss_mb()
+    delta = None if peak is None or rss_setup is None else max(0.0, peak - rss_setup)
+    return {"wall_s": min(walls), "peak_rss_mb": peak, "rss_delta_mb": delta}
+
+
+def run_case(case: str, size: str, repeat: int = REPEAT) -> dict:
+    """Run one case in a fresh interpreter so peak RSS belongs to that case only."""
+    out = subprocess.run(
+        [sys.executable, "-m", "pipeline.benchmarks.hot_paths", "--child", case, size, str(repeat)],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        tail = out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"
+        return {"error": tail}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def compare(result: dict, baseline: dict | None, threshold: float) -> list[str]:
+    if baseline is None:
+        return []
+    problems = []
+    for key in ("wall_s", "rss_delta_mb"):
+        base = baseline.get(key)
+        if base is not None and result.get(key) is not None and result[key] > base * (1 + threshold) + MIN_SLACK[key]:
+            problems.append(f"{key} {result[key]:.3g} > {base:.3g} (+{threshold:.0%})")
+    return problems
+
+
+def load_baselines(path: Path = BASELINE_PATH) -> dict:
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+
+#  ------------- ENTRY POINT -------------
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser()
+    p.add_argument("--cases", nargs="*", default=list(CASES))
+    p.add_argument("--sizes", nargs="*", default=DEFAULT_SIZES, help="edge counts, e.g. 1k 10k 100k 1M")
+    p.add_argument("--repeat", type=int, default=REPEAT)
+    p.add_argument("--threshold", type=float, default=THRESHOLD)
+    p.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    p.add_argument("--update-baseline", action="store_true")
+    p.add_argument("--child", nargs=3, metavar=("CASE", "SIZE", "REPEAT"), help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.child:
+        case, size, repeat = args.child
+        print(json.dumps(run_case_inprocess(case, size, int(repeat))))
+        return 0
+
+    baselines = load_baselines(args.baseline)
+    failures = 0
+    for case in args.cases:
+        sizes = PANO_SIZES if case == "equirect_to_perspective" else args.sizes
+        for size in sizes:
+            key = f"{case}@{size}"
+            res = run_case(case, size, args.repeat)
+            if "error" in res:
+                problems = [res["error"]]
+            else:
+                problems = [] if args.update_baseline else compare(res, baselines.get(key), args.threshold)
+                if args.update_baseline:
+                    baselines[key] = {k: round(v, 4) for k, v in res.items() if v is not None}
+
+            status = "FAIL" if problems else "ok"
+            mem = (f"  peak {res['peak_rss_mb']:8.1f} MB  Δ {res['rss_delta_mb']:7.1f} MB"
+                   if res.get("rss_delta_mb") is not None else "")
+            stats = f"{res['wall_s']:9.3f} s{mem}" if "wall_s" in res else ""
+            print(f"[{status:>4}] {key:<32} {stats}  {'; '.join(problems)}")
+            failures += bool(problems)
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"Baselines written → {args.baseline}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
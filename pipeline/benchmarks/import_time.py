@@ -0,0 +1,116 @@
+"""
+Import-time regression guard for the SBAFN pipeline modules.
+
+Each module is imported in a fresh interpreter and checked for:
+- no heavy stage dependency (osmnx, folium, cv2, rasterio, selenium, earthaccess, ...)
+  pulled in at import time
+- no config parse at import time (`pipeline.config.load_config` cache stays empty)
+- cumulative import time under a per-module budget (ms, from `python -X importtime`)
+
+Usage
+    python -m pipeline.benchmarks.import_time            # exit code 1 on regression
+    python -m pipeline.benchmarks.import_time --budget-scale 2.0
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+
+from pipeline.config import REPO_ROOT
+
+HEAVY_MODULES = [
+    "osmnx", "folium", "cv2", "rasterio", "selenium", "earthaccess",
+    "boto3", "xarray", "geopandas", "networkx", "ultralytics",
+]
+
+# module → (import-time budget in ms, heavy modules it is allowed to import eagerly)
+MODULE_BUDGETS: dict[str, tuple[float, list[str]]] = {
+    "pipeline.core": (150, []),
+    "pipeline.metrics": (150, []),
+    "pipeline.http_client": (150, []),
+    "pipeline.modules.mapillary_client": (600, []),
+    "pipeline.modules.fetch_elevation": (900, []),
+    "pipeline.modules.imerg_flood": (900, []),
+    "pipeline.modules.news_scraper_inquirer": (900, []),
+    "pipeline.modules.news_match_pipeline": (900, []),
+    "pipeline.modules.rainfall_pipeline": (1500, []),
+    "pipeline.modules.aoi_batch": (900, []),
+    "pipeline.modules.boundary_store": (900, []),
+    "pipeline.modules.map_export": (900, []),
+    "pipeline.modules.osm_extract": (900, []),
+    "pipeline.modules.segment_table": (900, []),
+    "pipeline.modules.risk_scoring": (900, []),
+    "pipeline.modules.query_service": (900, []),
+    "pipeline.modules.threshold_index": (900, []),
+    "pipeline.modules.routing": (900, []),
+    "pipeline.modules.hydrology": (900, []),
+    "pipeline.modules.elevation_profile": (900, []),
+    "pipeline.modules.segment_adjacency": (900, []),
+    "pipeline.modules.image_dedup": (900, []),
+    "pipeline.modules.image_store": (900, []),
+    "pipeline.modules.table_io": (900, []),
+    "pipeline.modules.tile_export": (900, []),
+    "pipeline.modules.street_define": (2500, ["geopandas"]),
+    "pipeline.modules.segments_elevation": (2500, ["geopandas"]),
+    "pipeline.modules.node_lonlat_export": (2500, ["geopandas"]),
+}
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed_ms = (time.perf_counter() - t0) * 1000.0
+from pipeline.config import load_config
+print(json.dumps({{
+    "elapsed_ms": elapsed_ms,
+    "heavy": sorted(m for m in {heavy!r} if m in sys.modules),
+    "config_loaded": load_config.cache_info().currsize > 0,
+}}))
+"""
+
+
+def probe(module: str) -> dict:
+    code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if out.returncode != 0:
+        return {"error": out.stderr.strip().splitlines()[-1] if out.stderr else "import failed"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser()
+    p.add_argument("--budget-scale", type=float, default=1.0, help="multiply every budget (slow CI boxes)")
+    p.add_argument("--modules", nargs="*", default=list(MODULE_BUDGETS))
+    args = p.parse_args(argv)
+
+    failures = 0
+    for module in args.modules:
+        budget_ms, allowed = MODULE_BUDGETS.get(module, (1000, []))
+        budget_ms *= args.budget_scale
+        res = probe(module)
+        problems = []
+        if "error" in res:
+            problems.append(res["error"])
+        else:
+            eager = [m for m in res["heavy"] if m not in allowed]
+            if eager:
+                problems.append(f"eager heavy imports: {', '.join(eager)}")
+            if res["config_loaded"]:
+                problems.append("config.yaml parsed at import time")
+            if res["elapsed_ms"] > budget_ms:
+                problems.append(f"{res['elapsed_ms']:.0f} ms > budget {budget_ms:.0f} ms")
+
+        status = "FAIL" if problems else "ok"
+        took = f"{res['elapsed_ms']:7.0f} ms" if "elapsed_ms" in res else "      — ms"
+        print(f"[{status:>4}] {module:<45} {took}  {'; '.join(problems)}")
+        failures += bool(problems)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Offline synthetic inputs for SBAFN benchmarks: street networks, DEM grids, news and panoramas.
+
+Everything is generated from a seed; no OSM, Mapillary, Nominatim or S3 access.
+
+- synthetic_network(n_edges): jittered street grid shaped like `osmnx.graph_to_gdfs(G)`
+  (nodes indexed by osmid, edges by (u, v, key), both directions, list-valued tags on some edges)
+- synthetic_dem(bounds): 30 m lat/lon/elevation_30m grid (smooth terrain + noise) covering bounds
+- synthetic_news(street_labels, n_articles): Inquirer-style rows with `affected_areas` text
+- synthetic_pano(width): equirectangular BGR uint8 image (2:1)
+- synthetic_image_hashes(n_images): 64-bit image hashes along capture sequences, with re-captures
+  (a few flipped bits) of earlier frames at nearly the same spot
+
+Usage
+    from pipeline.benchmarks.synthetic import synthetic_network, synthetic_dem
+    nodes, edges = synthetic_network(10_000)
+    dem = synthetic_dem(edges.total_bounds)
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import pandas as pd
+
+ORIGIN = (120.98, 14.59)          # lon, lat (Manila)
+SPACING_M = 120.0                 # block length
+M_PER_DEG_LAT = 111_320.0
+HIGHWAYS = np.array(["residential", "residential", "residential", "tertiary", "secondary", "primary", "unclassified"])
+SUFFIXES = np.array(["Street", "Avenue", "Road", "Boulevard", "Drive"])
+
+# ---------------------------------
+
+def parse_size(size: str | int) -> int:
+    """'1k' → 1000, '1M' → 1_000_000."""
+    if isinstance(size, int):
+        return size
+    s = size.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1], 1)
+    return int(float(s[:-1] if s[-1] in "km" else s) * mult)
+
+
+def _deg_per_m(lat: float) -> tuple[float, float]:
+    return 1.0 / (M_PER_DEG_LAT * math.cos(math.radians(lat))), 1.0 / M_PER_DEG_LAT
+
+
+def synthetic_network(n_edges: int, seed: int = 0, spacing_m: float = SPACING_M):
+    """
+    Street grid with ~n_edges directed edges (two-way streets → 2 edges per block).
+    Returns (nodes, edges) GeoDataFrames in EPSG:4326 with osmnx column names.
+    """
+    import geopandas as gpd
+    import shapely
+
+    rng = np.random.default_rng(seed)
+    # blocks ≈ 2·side·(side-1); directed edges ≈ 2·blocks
+    side = max(2, int(math.ceil(math.sqrt(n_edges / 4.0))) + 1)
+    dlon, dlat = _deg_per_m(ORIGIN[1])
+
+    ii, jj = np.meshgrid(np.arange(side), np.arange(side), indexing="ij")
+    jitter = rng.normal(0, spacing_m * 0.08, size=(2, side, side))
+    x = ORIGIN[0] + (jj * spacing_m + jitter[0]) * dlon
+    y = ORIGIN[1] + (ii * spacing_m + jitter[1]) * dlat
+    osmid = (1_000_000 + ii * side + jj).ravel()
+    x, y = x.ravel(), y.ravel()
+
+    # undirected blocks: east-west (row streets) then north-south (column streets)
+    idx = np.arange(side * side).reshape(side, side)
+    ew = np.column_stack([idx[:, :-1].ravel(), idx[:, 1:].ravel(), np.repeat(np.arange(side), side - 1)])
+    ns = np.column_stack([idx[:-1, :].ravel(), idx[1:, :].ravel(), np.tile(np.arange(side), side - 1) + side])
+    blocks = np.vstack([ew, ns])
+    blocks = blocks[rng.permutation(len(blocks))[: max(1, n_edges // 2)]]
+    a, b, street = blocks[:, 0], blocks[:, 1], blocks[:, 2]
+    n_blocks = len(blocks)
+
+    # 1-3 interior vertices per block so splitting / simplification has work to do
+    n_mid = rng.integers(1, 4, size=n_blocks)
+    t = [np.linspace(0, 1, k + 2) for k in n_mid]
+    counts = n_mid + 2
+    tt = np.concatenate(t)
+    rep = np.repeat(np.arange(n_blocks), counts)
+    px = x[a][rep] + (x[b][rep] - x[a][rep]) * tt + rng.normal(0, 2.0 * dlon, tt.size) * (tt % 1 > 0)
+    py = y[a][rep] + (y[b][rep] - y[a][rep]) * tt + rng.normal(0, 2.0 * dlat, tt.size) * (tt % 1 > 0)
+    geom_fwd = shapely.linestrings(np.column_stack([px, py]), indices=rep)
+    geom_rev = shapely.reverse(geom_fwd)
+
+    names = np.array([f"Calle {s:04d} {SUFFIXES[s % len(SUFFIXES)]}" for s in range(2 * side)], dtype=object)
+    name = names[street]
+    highway = HIGHWAYS[street % len(HIGHWAYS)].astype(object)
+    lanes = np.where(street % 3 == 0, "2", None).astype(object)
+    # osmnx leaves list-valued tags on merged edges; keep a few so flattening paths are exercised
+    for i in np.flatnonzero(rng.random(n_blocks) < 0.03):
+        name[i] = [name[i], "Service Road"]
+    length = np.full(n_blocks, spacing_m) + rng.normal(0, 5, n_blocks)
+
+    fwd = pd.DataFrame({"u": osmid[a], "v": osmid[b], "osmid": np.arange(n_blocks) + 5_000_000,
+                        "name": name, "highway": highway, "lanes": lanes, "oneway": False,
+                        "reversed": False, "length": length})
+    rev = fwd.assign(u=fwd["v"], v=fwd["u"], reversed=True)
+    edges = gpd.GeoDataFrame(
+        pd.concat([fwd, rev], ignore_index=True).assign(key=0),
+        geometry=np.concatenate([geom_fwd, geom_rev]),
+        crs=4326,
+    ).set_index(["u", "v", "key"])
+
+    used = np.unique(np.concatenate([a, b]))
+    street_count = np.bincount(np.concatenate([a, b]), minlength=side * side)[used]
+    nodes = gpd.GeoDataFrame(
+        {"y": y[used], "x": x[used], "street_count": street_count},
+        index=pd.Index(osmid[used], name="osmid"),
+        geometry=shapely.points(x[used], y[used]),
+        crs=4326,
+    )
+    return nodes, edges
+
+
+def synthetic_dem(bounds, res_m: float = 30.0, pad_m: float = 200.0, seed: int = 0) -> pd.DataFrame:
+    """lat/lon/elevation_30m points on a res_m grid covering (west, south, east, north) + pad."""
+    rng = np.random.default_rng(seed)
+    west, south, east, north = bounds
+    dlon, dlat = _deg_per_m((south + north) / 2)
+    lons = np.arange(west - pad_m * dlon, east + pad_m * dlon, res_m * dlon)
+    lats = np.arange(south - pad_m * dlat, north + pad_m * dlat, res_m * dlat)
+    LON, LAT = np.meshgrid(lons, lats)
+    kx, ky = 2 * np.pi / (3000 * dlon), 2 * np.pi / (4000 * dlat)
+    elev = 8 + 5 * np.sin(LON * kx) * np.cos(LAT * ky) + rng.normal(0, 0.5, LON.shape)
+    return pd.DataFrame({"lat": LAT.ravel(), "lon": LON.ravel(), "elevation_30m": elev.ravel().astype("float32")})
+
+
+def synthetic_news(street_labels, n_articles: int = 200, streets_per_article: int = 6, seed: int = 0) -> pd.DataFrame:
+    """Inquirer-like article rows whose `affected_areas` mix real labels with flood-report noise."""
+    rng = np.random.default_rng(seed)
+    labels = pd.Series(street_labels).dropna().astype(str).unique()
+    noise = ["knee deep", "gutter deep", "not passable to light vehicles", "NB", "SB", "half tire"]
+    rows = []
+    for k in range(n_articles):
+        picks = rng.choice(labels, size=min(streets_per_article, len(labels)), replace=False)
+        parts = [f"{p} ({rng.choice(noise)})" for p in picks]
+        rows.append({
+            "id": k,
+            "title": f"LIST: Flooded areas {k}",
+            "link": f"https://newsinfo.inquirer.net/{k}",
+            "date": "01 Jul 2025",
+            "affected_areas": ", ".join(parts),
+        })
+    return pd.DataFrame(rows)
+
+
+def synthetic_pano(width: int = 2048, seed: int = 0) -> np.ndarray:
+    """Equirectangular BGR panorama (height = width / 2) with smooth gradients + noise."""
+    rng = np.random.default_rng(seed)
+    h = width // 2
+    u = np.linspace(0, 255, width, dtype=np.float32)
+    v = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    base = np.stack([np.broadcast_to(u, (h, width)), np.broadcast_to(v, (h, width)), (u + v) % 256], axis=-1)
+    return np.clip(base + rng.normal(0, 8, base.shape), 0, 255).astype(np.uint8)
+
+
+def synthetic_image_hashes(n_images: int, seq_len: int = 200, step_m: float = 4.0, dup_frac: float = 0.2,
+                           seed: int = 0) -> pd.DataFrame:
+    """hash (uint64), lat, lon, sequence rows: random-walk sequences; `dup_frac` are near-repeats."""
+    rng = np.random.default_rng(seed)
+    n_seq = max(1, -(-n_images // seq_len))
+    dlon, dlat = _deg_per_m(ORIGIN[1])
+    side = math.sqrt(n_images) * step_m * 2
+    start = rng.random((n_seq, 2)) * side
+    heading = rng.random(n_seq) * 2 * math.pi
+    k = np.arange(n_images) % seq_len
+    seq = np.arange(n_images) // seq_len
+    x = start[seq, 0] + np.cos(heading[seq]) * k * step_m
+    y = start[seq, 1] + np.sin(heading[seq]) * k * step_m
+    h = rng.integers(0, 2**63, size=n_images, dtype=np.int64).view(np.uint64) ^ \
+        (rng.integers(0, 2, size=n_images, dtype=np.uint64) << np.uint64(63))
+
+    dup = np.flatnonzero(rng.random(n_images) < dup_frac)
+    src = rng.integers(0, n_images, size=len(dup))
+    x[dup], y[dup] = x[src] + rng.normal(0, 2, len(dup)), y[src] + rng.normal(0, 2, len(dup))
+    flips = rng.integers(0, 64, size=(len(dup), 3)).astype(np.uint64)
+    h[dup] = h[src] ^ (np.uint64(1) << flips[:, 0]) ^ (np.uint64(1) << flips[:, 1]) ^ (np.uint64(1) << flips[:, 2])
+    return pd.DataFrame({
+        "hash": h,
+        "lat": ORIGIN[1] + y * dlat,
+        "lon": ORIGIN[0] + x * dlon,
+        "sequence": seq.astype(str),
+    })
@@ -0,0 +1,40 @@
+"""
+Lazily-loaded, cached pipeline configuration for SBAFN.
+
+`pipeline/configs/config.yaml` is parsed on first use, not at import time, and the
+parsed dict is shared by every module for the life of the process.
+
+Usage
+    from pipeline.config import cfg_get, REPO_ROOT
+
+    bbox = cfg_get("aoi", "bbox", default={})
+    out_dir = REPO_ROOT / cfg_get("elevation", "out_dir", default="data/dem")
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+PIPELINE_DIR = REPO_ROOT / "pipeline"
+CONFIG_PATH = PIPELINE_DIR / "configs" / "config.yaml"
+OUTPUT_DIR = PIPELINE_DIR / "outputs"
+
+
+@lru_cache(maxsize=None)
+def load_config(path: str | Path = CONFIG_PATH) -> dict:
+    import yaml
+
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def cfg_get(*keys: str, default: Any = None) -> Any:
+    """Nested lookup, e.g. cfg_get("aoi", "bbox", "west", default=0)."""
+    node: Any = load_config()
+    for k in keys:
+        if not isinstance(node, dict) or k not in node or node[k] is None:
+            return default
+        node = node[k]
+    return node
@@ -1,84 +1,153 @@
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-import csv
+import argparse
 
-import osmnx as ox
-import folium
-import yaml
-
-from pipeline.modules.street_define import make_segments, make_corridors
-from pipeline.modules.node_lonlat_export import export_segment_lonlat
-from pipeline.modules.segments_elevation import join_elevation_to_segments
-from pipeline.modules.fetch_elevation import fetch_elevation
+from pipeline.config import REPO_ROOT, OUTPUT_DIR, cfg_get
+from pipeline import metrics
 
 # -----------------------
 
-REPO_ROOT = Path(__file__).resolve().parents[1]
-PIPELINE_DIR = REPO_ROOT / "pipeline"
-
-with open(PIPELINE_DIR / "configs" / "config.yaml", "r", encoding="utf-8") as f:
-    cfg = yaml.safe_load(f)
-
-# CONFIGS: FOLIUM
-TARGET_PLACE_NAME = cfg["aoi"].get("name", "Manila, Philippines")
-TARGET_AREA_NAME = cfg["aoi"].get("name", "Manila")
-TARGET_ABBR = cfg["aoi"].get("abbr", "mnl")
-STARTING_LAT = cfg["folium"].get("starting_lat", 0)
-STARTING_LONG = cfg["folium"].get("starting_long", 0)
-ZOOM_START = cfg["folium"].get("zoom_start", 12)
-
-# CONFIGS: MAPILLARY
-MANIFEST_OUT_DIR = cfg.get("mapillary_api", {}).get("manifest", {}).get("out_dir", "data/meta/")
-MANIFEST_NAME = cfg.get("mapillary_api", {}).get("manifest", {}).get("repo_manifest_name", "mapillary_manifest.csv")
-
-# CONFIGS: OUTPUT PATHS
 DATA_DIR = REPO_ROOT / "data"
-OUTPUT_DIR = PIPELINE_DIR / "outputs"
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-
-print(f"Starting Position: ({STARTING_LAT}, {STARTING_LONG}) | Zoom Start: {ZOOM_START}")
 
 # -----------------------
 
-def main():
+def main(profile=(), profiler: str = "cprofile"):
     '''
         Target Place: Manila, Philippines
         Data: Street Network (Driving)
         Source: OpenStreetMap
+
+        profile: stage names (or "all") to run under cProfile / pyinstrument
     '''
 
-    G = ox.graph_from_place(TARGET_PLACE_NAME, network_type="drive", simplify=True)
+    # CONFIGS: AOI
+    target_place_name = cfg_get("aoi", "place_name", default="Manila, Philippines")
+    target_abbr = cfg_get("aoi", "abbr", default="mnl")
+
+    formats = cfg_get("outputs", "formats", default=["parquet"])
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    with metrics.stage("pipeline", aoi=target_abbr):
+        with _stage("network", profile, profiler) as st:
+            nodes, edges = build_street_network(target_place_name)
+            st.count(nodes=len(nodes), edges=len(edges))
+
+        #SEGMENTS AND CORRIDORDS CREATION FOR INDIV STREETS
+        with _stage("segments", profile, profiler) as st:
+            segments, corridors = build_segments(edges, outdir=OUTPUT_DIR, target_abbr=target_abbr, formats=formats)
+            st.count(segments=len(segments), corridors=len(corridors))
+
+        # [DATA] Fetch elevation data | Load existing elevation data
+        with _stage("elevation", profile, profiler) as st:
+            X_df = build_elevation_features(segments, target_abbr=target_abbr)
+            st.count(segments=len(X_df))
+
+        # [PROFILE] 5 m bilinear elevation profiles: low point, dip, robust grade
+        with _stage("profile", profile, profiler) as st:
+            X_df = build_profile_features(segments, X_df)
+            st.count(segments=len(X_df))
+
+        # [HYDROLOGY] Depression depth / upstream area from the filled DEM, merged into the features
+        with _stage("hydrology", profile, profiler) as st:
+            X_df = build_hydrology_features(segments, X_df, target_abbr=target_abbr)
+            st.count(segments=len(X_df))
+
+        # [ADJACENCY] Elevation relative to neighbouring segments (sparse k-hop adjacency)
+        with _stage("adjacency", profile, profiler) as st:
+            X_df = build_adjacency_features(segments, X_df)
+            st.count(segments=len(X_df))
+
+        # [DATA EXPORT] Export final feature dataset (Parquet + opt-in CSV)
+        _export_features(X_df, outdir=OUTPUT_DIR, target_abbr=target_abbr, formats=formats)
+
+        # [RISK] risk_score / risk_band / drivers per segment under the rainfall scenarios
+        with _stage("risk", profile, profiler) as st:
+            risk_df = build_risk_scores(X_df, outdir=OUTPUT_DIR, target_abbr=target_abbr, segments=segments)
+            st.count(segments=len(risk_df))
+
+        # [ROUTING] CSR drive graph with per-edge flood thresholds, for detour queries
+        with _stage("routing_graph", profile, profiler) as st:
+            graph = build_routing_graph(nodes, edges, X_df, risk_df, outdir=OUTPUT_DIR, target_abbr=target_abbr)
+            st.count(nodes=graph.n_nodes, edges=graph.n_edges)
+
+        # [TILES] Zoom-pyramided vector tiles of the segment layer for the app map
+        with _stage("tiles", profile, profiler) as st:
+            build_segment_tiles(segments, X_df.merge(risk_df, on="segment_id", how="left"), outdir=OUTPUT_DIR, target_abbr=target_abbr)
+            st.count(segments=len(segments))
+
+        nodes_wgs = nodes.to_crs(4326).reset_index() # CRS = WGS84
+        edges_wgs = edges.to_crs(4326)
+
+        with _stage("map", profile, profiler) as st:
+            build_street_map(nodes_wgs, edges_wgs, outdir=OUTPUT_DIR, target_abbr=target_abbr)
+            st.count(edges=len(edges_wgs))
+
+        with _stage("save_nodes_edges", profile, profiler) as st:
+            _save_nodes_edges(nodes=nodes_wgs, edges=edges_wgs, outdir=OUTPUT_DIR, target_name=target_abbr, formats=formats)
+            st.count(nodes=len(nodes_wgs), edges=len(edges_wgs))
+
+
+@contextmanager
+def _stage(name: str, profile=(), profiler: str = "cprofile"):
+    """metrics.stage(name), additionally profiled when `name` (or "all") is in `profile`."""
+    wanted = name in profile or "all" in profile
+    with metrics.stage(name) as st, (metrics.profiled(name, profiler=profiler) if wanted else nullcontext()):
+        yield st
+
+#  ------------- PIPELINE STAGES -------------
+# Heavy dependencies are imported inside each stage so importing this module stays cheap
+
+def build_street_network(place_name: str, polygon=None):
+    # Offline path: local .osm.pbf extract (config `osm.pbf_path`), cached as GeoParquet
+    pbf_path = cfg_get("osm", "pbf_path", default=None)
+    if pbf_path and (REPO_ROOT / pbf_path).exists():
+        from pipeline.modules.boundary_store import aoi_polygon
+        from pipeline.modules.osm_extract import graph_gdfs_from_pbf
+
+        return graph_gdfs_from_pbf(REPO_ROOT / pbf_path, polygon if polygon is not None else aoi_polygon())
+
+    import osmnx as ox
+    from pipeline.modules.boundary_store import aoi_polygon
+
+    # Stored AOI boundary instead of re-geocoding `place_name` through Nominatim every run
+    polygon = polygon if polygon is not None else aoi_polygon()
+    G = ox.graph_from_polygon(polygon, network_type="drive", simplify=True, truncate_by_edge=True)
     nodes, edges = ox.graph_to_gdfs(G)
+    return nodes, edges
+
 
-    #SEGMENTS AND CORRIDORDS CREATION FOR INDIV STREETS
+def build_segments(edges, outdir: Path, target_abbr: str, formats=("parquet",)):
+    from pipeline.modules.street_define import make_segment_table, make_corridors
+    from pipeline.modules.node_lonlat_export import export_segment_lonlat
+    from pipeline.modules.table_io import export_table, typed_columns
 
-    segments = make_segments(edges, split_len_m=30)
+    # Compact SegmentTable (int64 keys, categoricals, projected vertices); string ids only on export
+    segments = make_segment_table(edges, split_len_m=30)
     corridors, segments = make_corridors(segments, merge_dual=False)
 
     # SAVE LONGITUDE/LATITUDE FOR EACH NODE
     seg_ll = export_segment_lonlat(
         segments_gdf=segments,
-        out_csv=OUTPUT_DIR / f"{TARGET_ABBR}_segments_lonlat.csv",
+        out_csv=outdir / f"{target_abbr}_segments_lonlat.csv" if "csv" in formats else None,
+        also_parquet=outdir / f"{target_abbr}_segments_lonlat.parquet",
     )
 
-    # segments / corridors are GeoDataFrames or DataFrames
-    segments = segments.to_crs(4326)
-    corridors = corridors.to_crs(4326)
-    (OUTPUT_DIR / f"{TARGET_ABBR}_segments.geojson").write_text(segments.to_json())
-    (OUTPUT_DIR / f"{TARGET_ABBR}_corridors.geojson").write_text(corridors.to_json())
-    
-    # [FILE EXPORT] Segments | Corridors
-    segments.drop(columns=["geometry"], errors="ignore").to_csv(OUTPUT_DIR / f"{TARGET_ABBR}_segments.csv", index=False)
-    corridors.drop(columns=["geometry"], errors="ignore").to_csv(OUTPUT_DIR / f"{TARGET_ABBR}_corridors.csv", index=False)
-
-    seg_geojson = OUTPUT_DIR / f"{TARGET_ABBR}_segments.geojson"
-    seg_geojson.write_text(segments.to_json(), encoding="utf-8")
-
-    # [DATA] Fetch elevation data | Load existing elevation data
-    elev_path = DATA_DIR / "dem" / "mnl_30m_grid.csv"
-    out_csv  = OUTPUT_DIR / f"{TARGET_ABBR}_pu_features.csv"
-    out_csv.parent.mkdir(parents=True, exist_ok=True)
-
-    if elev_path.exists():
+    # [FILE EXPORT] Segments | Corridors → GeoParquet (+ opt-in CSV / GeoJSON sinks)
+    export_table(typed_columns(segments.to_geodataframe()), outdir / f"{target_abbr}_segments", formats=formats)
+    export_table(typed_columns(corridors), outdir / f"{target_abbr}_corridors", formats=formats)
+    return segments, corridors
+
+
+def build_elevation_features(segments, target_abbr: str):
+    from pipeline.modules.segments_elevation import join_elevation_to_segments
+    from pipeline.modules.fetch_elevation import fetch_elevation
+    from pipeline.modules.table_io import resolve_table
+
+    elev_dir = REPO_ROOT / cfg_get("elevation", "out_dir", default="data/dem")
+    elev_path = resolve_table(elev_dir / f"{target_abbr}_30m_grid", suffixes=(".parquet", ".csv"))
+
+    if elev_path is not None:
         X_df = join_elevation_to_segments(
             segments_gpd=segments,
             elev_data=elev_path,
@@ -92,66 +161,136 @@ def main():
             buf_m=15.0,
             max_nn_m=60.0,
         )
-    print(f"[elevation] wrote {out_csv}")
+    return X_df
+
+
+def build_profile_features(segments, features):
+    from pipeline.modules.elevation_profile import _profile_cfg, add_profile_features
+    from pipeline.modules.fetch_elevation import ensure_dem_geotiff
+
+    if not _profile_cfg()["enabled"]:
+        return features
+    # {abbr}_30m_dem.tif is written by fetch_elevation; rebuilt from the tiles when the grid was cached
+    return add_profile_features(features, segments, ensure_dem_geotiff())
+
+
+def build_hydrology_features(segments, features, target_abbr: str):
+    from pipeline.modules.fetch_elevation import ensure_dem_geotiff
+    from pipeline.modules.hydrology import _hydro_cfg, add_hydrology_features
+
+    if not _hydro_cfg()["enabled"]:
+        return features
+    return add_hydrology_features(features, segments, ensure_dem_geotiff(), abbr=target_abbr)
+
+
+def build_adjacency_features(segments, features):
+    from pipeline.modules.segment_adjacency import _adjacency_cfg, add_adjacency_features
 
-    # [DATA EXPORT] Export final feature dataset as csv
-    X_df.to_csv(out_csv, index=False)
+    if not _adjacency_cfg()["enabled"]:
+        return features
+    return add_adjacency_features(features, segments)
 
-    nodes_wgs = nodes.to_crs(4326).reset_index() # CRS = WGS84
-    edges_wgs = edges.to_crs(4326)
 
-    # FOLIUM MAP
-    m = folium.Map(location=(STARTING_LAT, STARTING_LONG), zoom_start=ZOOM_START, tiles="CartoDB positron")
+def build_risk_scores(features, outdir: Path, target_abbr: str, segments=None):
+    from pipeline.modules.risk_scoring import run_risk_scoring
+    from pipeline.modules.threshold_index import build_threshold_index
 
-    folium.GeoJson(
-        edges_wgs.to_json(),
-        name=f"{TARGET_AREA_NAME} Streets",
-        tooltip=folium.features.GeoJsonTooltip(fields=["name", "highway", "length"])
-    ).add_to(m)
+    risk = run_risk_scoring(features, outdir / f"{target_abbr}_risk")
+    # "What floods at X mm/hr" index for the app / query service
+    build_threshold_index(risk, features, outdir / f"{target_abbr}_threshold_index.bin", name=target_abbr,
+                          segments=segments)
+    return risk
 
-    # Render only nodes with 3 or more connecting streets (intersections)
-    intersections = nodes_wgs[nodes_wgs["street_count"] >= 3]
-    for y,x in zip(intersections.geometry.y, intersections.geometry.x):
-        folium.CircleMarker([y,x], radius=2, color="red", fill=True, fill_opacity=0.8).add_to(m)
 
-    folium.LayerControl().add_to(m)
+def build_routing_graph(nodes, edges, features, risk, outdir: Path, target_abbr: str):
+    from pipeline.modules.routing import build_routing_graph as _build_graph
 
-    # [MAPILLARY MANIFEST] Visualize retrieved Mapillary images
-    with open(REPO_ROOT / MANIFEST_OUT_DIR / MANIFEST_NAME, "r", encoding="utf-8") as f:
-        csv_reader = csv.DictReader(f)
-        for row in csv_reader:
-            try:
-                lat = float(row["lat"])
-                lon = float(row["lon"])
-                folium.CircleMarker(location=(lat, lon), radius=2, color="green", fill=True, fill_opacity=0.8).add_to(m)
-            except:
-                pass
+    return _build_graph(nodes, edges, outdir / f"{target_abbr}_graph_csr.npz", risk=risk, segments=features)
 
-    # DATA EXPORT
-    m_outdir = OUTPUT_DIR / "maps"
-    m_outdir.mkdir(parents=True, exist_ok=True)
-    m.save(m_outdir / f"{TARGET_ABBR}_street_network.html")
 
-    _save_nodes_edges_to_csv(nodes=nodes_wgs, edges=edges_wgs, outdir=OUTPUT_DIR, target_name=TARGET_ABBR)
+def build_segment_tiles(segments, features, outdir: Path, target_abbr: str):
+    from pipeline.modules.segment_table import SegmentTable
+    from pipeline.modules.tile_export import _tiles_cfg, export_segment_tiles
+
+    cfg = _tiles_cfg()
+    if not cfg["enabled"]:
+        return None
+    if isinstance(segments, SegmentTable):
+        segments = segments.to_geodataframe(columns=["segment_id"])
+    return export_segment_tiles(
+        segments,
+        outdir / "tiles" / f"{target_abbr}_segments.mbtiles",
+        features=features,
+        min_zoom=cfg["min_zoom"],
+        max_zoom=cfg["max_zoom"],
+        attributes=cfg["attributes"],
+        pmtiles=cfg["pmtiles"],
+    )
+
+
+def build_street_map(nodes_wgs, edges_wgs, outdir: Path, target_abbr: str):
+    from pipeline.modules.map_export import build_street_map as _build_map
+
+    # CONFIGS: FOLIUM
+    target_area_name = cfg_get("aoi", "area_name", default="Manila")
+    starting_lat = cfg_get("folium", "starting_lat", default=0)
+    starting_long = cfg_get("folium", "starting_long", default=0)
+    zoom_start = cfg_get("folium", "zoom_start", default=12)
+    external_layers = cfg_get("folium", "external_layers", default=True)
+    edge_simplify_m = cfg_get("folium", "edge_simplify_m", default=2.0)
+
+    # CONFIGS: MAPILLARY
+    manifest_out_dir = cfg_get("mapillary_api", "manifest", "out_dir", default="data/meta/")
+    manifest_name = cfg_get("mapillary_api", "manifest", "repo_manifest_name", default="mapillary_manifest.csv")
+
+    print(f"Starting Position: ({starting_lat}, {starting_long}) | Zoom Start: {zoom_start}")
+
+    # FOLIUM MAP → maps/{abbr}_street_network.html (+ lazily loaded layer files)
+    return _build_map(
+        nodes_wgs,
+        edges_wgs,
+        out_html=outdir / "maps" / f"{target_abbr}_street_network.html",
+        manifest_path=REPO_ROOT / manifest_out_dir / manifest_name,
+        area_name=target_area_name,
+        location=(starting_lat, starting_long),
+        zoom_start=zoom_start,
+        external_layers=external_layers,
+        simplify_m=edge_simplify_m,
+    )
 
 #  ------------- UTILITY FUNCTIONS -------------
 
-def _save_nodes_edges_to_csv(nodes, edges, outdir: Path, target_name: str):
+def _export_features(features, outdir: Path, target_abbr: str, formats=("parquet",)):
+    from pipeline.modules.table_io import export_table
+
+    outdir.mkdir(parents=True, exist_ok=True)
+    written = export_table(features, outdir / f"{target_abbr}_pu_features", formats=formats)
+    print(f"[features] wrote {', '.join(str(p) for p in written.values())}")
+    return written
+
+
+def _save_nodes_edges(nodes, edges, outdir: Path, target_name: str, formats=("parquet",)):
+    from pipeline.modules.table_io import flatten_list_columns, write_table
+
     target = outdir / f"{target_name}_nodes_edges"
-    target.mkdir(parents=True, exist_ok=True)    
+    target.mkdir(parents=True, exist_ok=True)
+
+    nodes_out = flatten_list_columns(nodes.reset_index())
+    edges_out = flatten_list_columns(edges.reset_index())
+
+    # NODES / EDGES → GeoParquet
+    write_table(nodes_out, target / f"{target_name}_nodes.parquet")
+    write_table(edges_out, target / f"{target_name}_edges.parquet")
+
+    if "csv" not in formats:
+        return
 
     # NODES → CSV
-    nodes_out = nodes.reset_index()
     nodes_out["geometry_wkt"] = nodes_out.geometry.to_wkt()
     nodes_out = nodes_out.drop(columns=["geometry"])
     nodes_out.to_csv(target / f"{target_name}_nodes.csv", index=False)
 
     #EDGES → CSV
-    edges_out = edges.reset_index()
-    for col in ("highway", "name", "osmid"):
-        if col in edges_out.columns:
-            edges_out[col] = edges_out[col].apply(lambda x: ", ".join(map(str, x)) if isinstance(x, list) else x)
-
     edges_out["geometry_wkt"] = edges_out.geometry.to_wkt()
     edges_out = edges_out.drop(columns=["geometry"])
     edges_out.to_csv(target / f"{target_name}_edges.csv", index=False)
@@ -159,4 +298,18 @@ def _save_nodes_edges_to_csv(nodes, edges, outdir: Path, target_name: str):
 # -----------------------
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    p = argparse.ArgumentParser()
+    p.add_argument("--batch", action="store_true", help="run every AOI / region tile in config `batch`")
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--profile", nargs="*", default=None, metavar="STAGE",
+                   help="profile these stages (network segments elevation profile hydrology adjacency risk routing_graph tiles map save_nodes_edges); bare flag = all")
+    p.add_argument("--profiler", choices=("cprofile", "pyinstrument"), default="cprofile")
+    args = p.parse_args()
+    profile = () if args.profile is None else (args.profile or ["all"])
+
+    if args.batch:
+        from pipeline.modules.aoi_batch import run_batch
+        with metrics.stage("batch"), (metrics.profiled("batch", profiler=args.profiler) if profile else nullcontext()):
+            run_batch(workers=args.workers)
+    else:
+        main(profile=profile, profiler=args.profiler)
@@ -0,0 +1,263 @@
+"""
+Shared HTTP client layer for SBAFN: per-host adaptive rate limits over pooled keep-alive sessions.
+
+- HostLimiter: token bucket per host (thread- and asyncio-safe). The rate adapts AIMD-style:
+  it grows additively while requests succeed and is cut multiplicatively on 429/503. The bucket
+  is paused for `Retry-After` when the server sends one.
+- RateLimitedSession: a requests.Session whose adapters are sized to the caller's concurrency
+  (pool_maxsize = workers, pool_block=True), so connections are reused instead of dropped.
+  Every request waits on its host's bucket. Throttled, 5xx and connection-error responses are
+  retried by the session itself rather than urllib3, so the limiter sees each retry.
+- Metrics are recorded on the active metrics stage: requests, http_retries, http_429 and
+  http_wait_s (seconds spent waiting for a token).
+
+Host limits come from config `http.hosts`, keyed by host suffix. The longest matching suffix
+wins, and all hosts matching one entry share its bucket (e.g. every `*.fbcdn.net` thumbnail host):
+
+    http:
+      default: {qps: 4, burst: 4}
+      hosts:
+        graph.mapillary.com: {qps: 3, max_qps: 8}
+        nominatim.openstreetmap.org: {qps: 1, burst: 1, max_qps: 1}
+
+Usage
+    from pipeline import http_client
+
+    s = http_client.make_session(headers={"Authorization": f"OAuth {token}"}, pool_size=8)
+    r = s.get(url, params=params)                  # waits on the host bucket, adapts on 429
+    http_client.download(url, out_path)            # streamed to .part, then renamed
+
+    await http_client.limiter_for(url).acquire_async()   # asyncio clients share the same buckets
+"""
+from __future__ import annotations
+
+import functools
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
+from pipeline.config import cfg_get
+from pipeline import metrics
+
+USER_AGENT = "sbafn/0.1 (contact@example.com)"
+THROTTLE_STATUS = {429, 503}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+DEFAULT_LIMIT = {"qps": 4.0, "burst": 4.0, "min_qps": 0.2, "max_qps": None,
+                 "increase_qps": 0.5, "decrease": 0.5}
+
+# ---------------------------------
+
+def _http_cfg() -> dict:
+    return {
+        "default": {**DEFAULT_LIMIT, **(cfg_get("http", "default", default={}) or {})},
+        "hosts": cfg_get("http", "hosts", default={}) or {},
+        "retries": cfg_get("http", "retries", default=5),
+        "backoff": cfg_get("http", "backoff", default=0.5),
+        "timeout": tuple(cfg_get("http", "timeout", default=[5, 30])),
+    }
+
+
+def retry_after_s(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """
+    Token bucket with AIMD rate control.
+
+    Slots are reserved under a lock and the caller sleeps outside it. Concurrent callers get
+    distinct slots, so threads and coroutines can share one limiter without racing.
+    """
+
+    def __init__(self, qps: float, burst: float = 1.0, min_qps: float = 0.2, max_qps: Optional[float] = None,
+                 increase_qps: float = 0.5, decrease: float = 0.5, name: str = ""):
+        self.name = name
+        self.rate = float(qps)
+        self.burst = max(1.0, float(burst))
+        self.min_rate = float(min_qps)
+        self.max_rate = float(max_qps) if max_qps else float(qps) * 4
+        self.increase = float(increase_qps)
+        self.decrease = float(decrease)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._last_cut = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take one token (possibly going into debt); return how long the caller must wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def acquire(self) -> float:
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        import asyncio
+
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_success(self) -> None:
+        # Additive increase: about +increase_qps per second of successful traffic
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1e-6))
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        """Multiplicative decrease, at most once per current interval so in-flight 429s don't collapse the rate."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_cut >= 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_cut = now
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+                self._tokens = min(self._tokens, 0.0)
+
+
+_limiters: dict[str, HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _host_key(host: str, hosts: dict) -> str:
+    matches = [k for k in hosts if host == k or host.endswith("." + k)]
+    return max(matches, key=len) if matches else host
+
+
+def limiter_for(url_or_host: str) -> HostLimiter:
+    """Process-wide limiter for the host of `url_or_host` (shared across sessions and threads)."""
+    host = urlsplit(url_or_host).hostname if "://" in url_or_host else url_or_host
+    cfg = _http_cfg()
+    key = _host_key(host or "", cfg["hosts"])
+    with _limiters_lock:
+        lim = _limiters.get(key)
+        if lim is None:
+            opts = {**cfg["default"], **(cfg["hosts"].get(key) or {})}
+            lim = _limiters[key] = HostLimiter(name=key, **{k: opts[k] for k in DEFAULT_LIMIT})
+        return lim
+
+#  ------------- SESSION -------------
+
+@functools.lru_cache(maxsize=None)
+def _session_class():
+    import requests
+
+    class RateLimitedSession(requests.Session):
+        """requests.Session that waits on per-host buckets and retries throttled requests itself."""
+
+        retries = 5
+        backoff = 0.5
+        request_timeout = (5, 30)
+
+        def request(self, method, url, **kwargs):
+            kwargs.setdefault("timeout", self.request_timeout)
+            limiter = limiter_for(url)
+            attempt = 0
+            while True:
+                metrics.incr("http_wait_s", limiter.acquire())
+                metrics.incr("requests")
+                try:
+                    resp = super().request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt >= self.retries:
+                        raise
+                    resp = None
+
+                if resp is not None and resp.status_code not in RETRY_STATUS:
+                    limiter.on_success()
+                    return resp
+
+                retry_after = None
+                if resp is not None and resp.status_code in THROTTLE_STATUS:
+                    retry_after = retry_after_s(resp.headers.get("Retry-After"))
+                    limiter.on_throttle(retry_after)
+                    if resp.status_code == 429:
+                        metrics.incr("http_429")
+                if attempt >= self.retries:
+                    return resp
+                if resp is not None:
+                    resp.close()
+                attempt += 1
+                metrics.incr("http_retries")
+                # The bucket already honours Retry-After; plain 5xx / connection errors back off exponentially
+                if retry_after is None:
+                    time.sleep(self.backoff * (2 ** (attempt - 1)))
+
+    return RateLimitedSession
+
+
+def make_session(headers: Optional[dict] = None,
+                 pool_size: int = 10,
+                 retries: Optional[int] = None,
+                 backoff: Optional[float] = None,
+                 timeout: Optional[tuple] = None):
+    """
+    Keep-alive session with `pool_size` connections per host (match it to the worker count)
+    and per-host adaptive rate limiting. Returns a requests.Session subclass.
+    """
+    from requests.adapters import HTTPAdapter
+
+    cfg = _http_cfg()
+    s = _session_class()()
+    s.headers.update({"User-Agent": USER_AGENT, **(headers or {})})
+    s.retries = cfg["retries"] if retries is None else retries
+    s.backoff = cfg["backoff"] if backoff is None else backoff
+    s.request_timeout = tuple(timeout) if timeout else cfg["timeout"]
+    adapter = HTTPAdapter(pool_connections=max(10, pool_size), pool_maxsize=pool_size, pool_block=True, max_retries=0)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_session():
+    """Process-wide session for one-off calls (Nominatim, DEM tiles, ...)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = make_session()
+        return _shared
+
+
+def get(url: str, **kwargs):
+    return shared_session().get(url, **kwargs)
+
+
+def download(url: str, out: Path, session=None, chunk_size: int = 1 << 20) -> Path:
+    """Stream `url` to `out` via a .part file (atomic rename on success)."""
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(out.suffix + ".part")
+    with (session or shared_session()).get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(tmp, "wb") as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    tmp.replace(out)
+    return out
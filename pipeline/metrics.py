@@ -0,0 +1,271 @@
+"""
+Lightweight stage instrumentation for the SBAFN pipeline.
+
+`stage()` wraps a pipeline stage or hot loop and records, on exit:
+- wall_s / cpu_s (process CPU time)
+- process_peak_rss_mb (process-lifetime high-water mark at stage end, not a per-stage value) and
+  rss_growth_mb (how much the stage raised that mark); None when the platform cannot report it
+- counts (segments, images, requests, http_retries, http_429, ...) and per-second rates
+
+Records go to JSON lines (`metrics.jsonl_path`) and, at exit, to a Prometheus textfile
+(`metrics.prometheus_path`, for node_exporter's textfile collector). `profiled()` wraps a block in
+cProfile (or pyinstrument when installed) and dumps the report under `metrics.profile_dir`.
+
+Usage
+    from pipeline import metrics
+
+    with metrics.stage("segments") as st:
+        segments = make_segments(edges)
+        st.count(segments=len(segments))
+
+    @metrics.timed("download")
+    def download(...): ...
+
+    metrics.incr("http_429")          # attributed to the innermost active stage
+"""
+from __future__ import annotations
+
+import atexit
+import functools
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from pipeline.config import REPO_ROOT, cfg_get
+
+try:
+    import resource
+except ImportError:             # Windows: psutil (when installed) reports the peak working set
+    resource = None
+
+PROM_PREFIX = "sbafn"
+
+_current: ContextVar[Optional["Stage"]] = ContextVar("sbafn_stage", default=None)
+
+# ---------------------------------
+
+def _peak_rss_mb() -> Optional[float]:
+    """Process-lifetime peak RSS in MB; None when neither `resource` nor psutil is available."""
+    if resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+
+class MetricsSink:
+    """Collects stage records; appends JSON lines and renders a Prometheus textfile on flush."""
+
+    def __init__(self, jsonl_path: Optional[Path] = None, prometheus_path: Optional[Path] = None, echo: bool = True):
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else None
+        self.prometheus_path = Path(prometheus_path) if prometheus_path else None
+        self.echo = echo
+        self.records: list[dict] = []
+        self.unscoped = defaultdict(float)      # incr() outside any stage
+        self._lock = threading.Lock()
+
+    def emit(self, record: dict) -> None:
+        with self._lock:
+            self.records.append(record)
+            if self.jsonl_path is not None:
+                self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+        if self.echo:
+            counts = " | ".join(
+                f"{v:,.0f} {k} ({record['rates'][k]:,.1f}/s)" for k, v in record["counts"].items()
+            )
+            mem = (f" | +{record['rss_growth_mb']:.0f} MB (peak {record['process_peak_rss_mb']:.0f} MB)"
+                   if record["process_peak_rss_mb"] is not None else "")
+            print(f"⏱ [{record['stage']}] {record['wall_s']:.2f} s wall | {record['cpu_s']:.2f} s cpu{mem}"
+                  + (f" | {counts}" if counts else ""))
+
+    def prometheus_text(self) -> str:
+        """Latest record per (stage, labels) as Prometheus exposition text."""
+        latest = {}
+        for rec in self.records:
+            latest[(rec["stage"], tuple(sorted(rec.get("labels", {}).items())))] = rec
+        lines = []
+
+        def metric(name, help_, type_, samples):
+            lines.append(f"# HELP {PROM_PREFIX}_{name} {help_}")
+            lines.append(f"# TYPE {PROM_PREFIX}_{name} {type_}")
+            lines.extend(f"{PROM_PREFIX}_{name}{{{labels}}} {value:.10g}" if labels else f"{PROM_PREFIX}_{name} {value:.10g}"
+                         for labels, value in samples)
+
+        def lbl(rec, **extra):
+            pairs = {"stage": rec["stage"], **rec.get("labels", {}), **extra}
+            return ",".join(f'{k}="{v}"' for k, v in pairs.items())
+
+        recs = list(latest.values())
+        metric("stage_wall_seconds", "Stage wall time.", "gauge", [(lbl(r), r["wall_s"]) for r in recs])
+        metric("stage_cpu_seconds", "Stage process CPU time.", "gauge", [(lbl(r), r["cpu_s"]) for r in recs])
+        metric("stage_process_peak_rss_megabytes", "Process-lifetime peak RSS at stage end.", "gauge",
+               [(lbl(r), r["process_peak_rss_mb"]) for r in recs if r["process_peak_rss_mb"] is not None])
+        metric("stage_rss_growth_megabytes", "Peak RSS growth during the stage.", "gauge",
+               [(lbl(r), r["rss_growth_mb"]) for r in recs if r["rss_growth_mb"] is not None])
+        metric("stage_success", "1 if the stage finished without raising.", "gauge",
+               [(lbl(r), 1.0 if r["status"] == "ok" else 0.0) for r in recs])
+        metric("stage_items", "Items processed by the stage.", "gauge",
+               [(lbl(r, item=k), v) for r in recs for k, v in r["counts"].items()])
+        metric("stage_items_per_second", "Stage throughput.", "gauge",
+               [(lbl(r, item=k), v) for r in recs for k, v in r["rates"].items()])
+        metric("last_run_timestamp_seconds", "Unix time the metrics were written.", "gauge", [("", time.time())])
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> Optional[Path]:
+        if self.prometheus_path is None or not self.records:
+            return None
+        self.prometheus_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.prometheus_path.with_suffix(self.prometheus_path.suffix + ".part")
+        tmp.write_text(self.prometheus_text(), encoding="utf-8")
+        tmp.replace(self.prometheus_path)   # atomic for the textfile collector
+        return self.prometheus_path
+
+
+_sink: Optional[MetricsSink] = None
+
+
+def sink() -> MetricsSink:
+    """Process-wide sink, configured from config `metrics` on first use."""
+    global _sink
+    if _sink is None:
+        jsonl = cfg_get("metrics", "jsonl_path", default=None)
+        prom = cfg_get("metrics", "prometheus_path", default=None)
+        _sink = MetricsSink(
+            jsonl_path=REPO_ROOT / jsonl if jsonl else None,
+            prometheus_path=REPO_ROOT / prom if prom else None,
+            echo=cfg_get("metrics", "echo", default=True),
+        )
+        atexit.register(_sink.flush)
+    return _sink
+
+
+class Stage:
+    def __init__(self, name: str, sink_: Optional[MetricsSink] = None, **labels):
+        self.name = name
+        self.labels = {k: str(v) for k, v in labels.items()}
+        self.counts = defaultdict(float)
+        self._sink = sink_
+        self._lock = threading.Lock()
+
+    def count(self, **items: float) -> None:
+        """Add to item counters, e.g. st.count(images=1, bytes=len(buf)). Thread-safe."""
+        with self._lock:
+            for k, v in items.items():
+                self.counts[k] += v
+
+    def __enter__(self) -> "Stage":
+        self.parent = _current.get()
+        self._token = _current.set(self)
+        self._rss0 = _peak_rss_mb()
+        self._cpu0 = time.process_time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        wall = time.perf_counter() - self._t0
+        cpu = time.process_time() - self._cpu0
+        peak = _peak_rss_mb()
+        _current.reset(self._token)
+        counts = {k: v for k, v in self.counts.items()}
+        record = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "stage": self.name,
+            "parent": self.parent.name if self.parent else None,
+            "labels": self.labels,
+            "status": "ok" if exc_type is None else f"error:{exc_type.__name__}",
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "process_peak_rss_mb": None if peak is None else round(peak, 1),
+            "rss_growth_mb": None if peak is None or self._rss0 is None else round(max(0.0, peak - self._rss0), 1),
+            "counts": counts,
+            "rates": {k: round(v / wall, 3) if wall > 0 else 0.0 for k, v in counts.items()},
+        }
+        (self._sink or sink()).emit(record)
+        return False
+
+
+def stage(name: str, **labels) -> Stage:
+    return Stage(name, **labels)
+
+
+def timed(name: Optional[str] = None, **labels):
+    """Decorator form of stage(); defaults to the function name."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name or fn.__name__, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def incr(key: str, n: float = 1) -> None:
+    """Count `key` on the innermost active stage (worker threads: pass the Stage and use st.count)."""
+    st = _current.get()
+    if st is not None:
+        st.count(**{key: n})
+    else:
+        s = sink()
+        with s._lock:
+            s.unscoped[key] += n
+
+
+def current_stage() -> Optional[Stage]:
+    return _current.get()
+
+#  ------------- PROFILING -------------
+
+@contextmanager
+def profiled(name: str, profiler: str = "cprofile", out_dir: Optional[Path] = None, top: int = 40):
+    """Profile the block; writes {name}.prof + {name}.txt (cProfile) or {name}.html (pyinstrument)."""
+    out_dir = Path(out_dir or REPO_ROOT / cfg_get("metrics", "profile_dir", default="pipeline/outputs/profiles"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("[profile] pyinstrument not installed; using cProfile")
+        else:
+            prof = Profiler()
+            prof.start()
+            try:
+                yield
+            finally:
+                prof.stop()
+                out = out_dir / f"{name}-{stamp}.html"
+                out.write_text(prof.output_html(), encoding="utf-8")
+                print(f"[profile] {name} → {out}")
+            return
+
+    import cProfile
+    import io
+    import pstats
+
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        base = out_dir / f"{name}-{stamp}"
+        prof.dump_stats(base.with_suffix(".prof"))
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(top)
+        base.with_suffix(".txt").write_text(buf.getvalue(), encoding="utf-8")
+        print(f"[profile] {name} → {base.with_suffix('.prof')} (+ .txt top {top})")
@@ -0,0 +1,310 @@
+"""
+Multi-AOI / tiled batch mode for the SBAFN pipeline.
+
+Inputs (config: `batch`)
+- aois:   list of named AOIs, e.g. the 17 Metro Manila LGUs {place_name, area_name, abbr}
+- region: or one large bbox {west, south, east, north} tiled into `tile_m` square chunks
+- overlap_m: each chunk's street network / elevation is fetched `overlap_m` beyond its core area
+
+Outputs (prefix `batch.abbr`, same layout as the single-AOI run)
+- {abbr}_segments / {abbr}_corridors / {abbr}_pu_features / {abbr}_segments_lonlat (Parquet + opt-in sinks)
+- {abbr}_risk.parquet + {abbr}_risk_scenarios.npz + {abbr}_threshold_index.bin (scored after stitching)
+- tiles/{abbr}_segments.mbtiles
+- batch/{abbr}/chunks/{chunk}_segments.parquet, {chunk}_pu_features.parquet (per-chunk parts, reused on rerun)
+- batch/{abbr}/dem/{chunk}_30m_grid.parquet (per-chunk elevation, masked to the chunk's fetch area),
+  {abbr}_30m_dem.tif (region mosaic); kept apart from the single-AOI files in `elevation.out_dir`
+
+Method
+1) Each chunk runs network (local .osm.pbf when configured, else Overpass) → segments → elevation join in its own worker process, so peak memory
+   is bounded by the largest chunk rather than the whole region.
+2) A chunk keeps only the segments it owns: segment midpoint inside its core area (AOI polygon or
+   tile bbox). The overlap only supplies context so edges crossing the seam are complete.
+3) segment_id is built from OSM ids (u_v_key_pN), so the same street piece gets the same id in
+   every chunk; stitching drops duplicates by segment_id (shared LGU boundaries, tile edges).
+4) Corridors are rebuilt once on the stitched segments so streets are not split at seams.
+5) Elevation profiles and hydrology run once on the region's DEM mosaic, batch/{abbr}/dem/{abbr}_30m_dem.tif, and
+   segment adjacency once on the stitched network, before scoring.
+
+Usage
+    python -m pipeline.core --batch
+    python -m pipeline.modules.aoi_batch --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from pipeline.config import OUTPUT_DIR, cfg_get
+from pipeline import metrics
+
+SPLIT_LEN_M = 30
+OVERLAP_M = 500
+TILE_M = 5000
+
+# ---------------------------------
+
+@dataclass
+class AOIChunk:
+    abbr: str
+    core: object                 # shapely (Multi)Polygon, WGS84: ownership area
+    fetch: object                # core buffered by overlap_m: network / elevation extent
+    place_name: Optional[str] = None
+    area_name: Optional[str] = None
+
+    @property
+    def bounds(self) -> tuple[float, float, float, float]:
+        return tuple(self.fetch.bounds)
+
+
+def _batch_cfg() -> dict:
+    return {
+        "abbr": cfg_get("batch", "abbr", default="batch"),
+        "aois": cfg_get("batch", "aois", default=[]),
+        "region": cfg_get("batch", "region", default={}),
+        "tile_m": float(cfg_get("batch", "region", "tile_m", default=TILE_M)),
+        "overlap_m": float(cfg_get("batch", "overlap_m", default=OVERLAP_M)),
+        "split_len_m": cfg_get("batch", "split_len_m", default=SPLIT_LEN_M),
+        "workers": cfg_get("batch", "workers", default=None),
+    }
+
+
+def _buffer_m(geom, meters: float):
+    """Buffer a WGS84 geometry by `meters` in its local UTM zone."""
+    import geopandas as gpd
+
+    gs = gpd.GeoSeries([geom], crs=4326)
+    utm = gs.estimate_utm_crs()
+    return gs.to_crs(utm).buffer(meters).to_crs(4326).iloc[0]
+
+
+def chunks_from_aois(aois: list[dict], overlap_m: float = OVERLAP_M) -> list[AOIChunk]:
+    """Named AOIs (stored admin boundary, see boundary_store) or explicit bboxes."""
+    from pipeline.modules.boundary_store import BoundaryStore
+
+    boundaries = BoundaryStore()
+    chunks = []
+    for a in aois:
+        core = boundaries.resolve(a)
+        chunks.append(AOIChunk(
+            abbr=a["abbr"], core=core, fetch=_buffer_m(core, overlap_m),
+            place_name=a.get("place_name"), area_name=a.get("area_name"),
+        ))
+    return chunks
+
+
+def tile_region(bbox: dict, abbr: str, tile_m: float = TILE_M, overlap_m: float = OVERLAP_M) -> list[AOIChunk]:
+    """Split one bbox into ~tile_m square core tiles (row-major), each fetched with overlap."""
+    from shapely.geometry import box
+
+    west, south, east, north = bbox["west"], bbox["south"], bbox["east"], bbox["north"]
+    lat_mid = (south + north) / 2
+    m_per_deg_lat = 111_320.0
+    m_per_deg_lon = 111_320.0 * math.cos(math.radians(lat_mid))
+
+    n_rows = max(1, math.ceil((north - south) * m_per_deg_lat / tile_m))
+    n_cols = max(1, math.ceil((east - west) * m_per_deg_lon / tile_m))
+    dy, dx = (north - south) / n_rows, (east - west) / n_cols
+    pad_y, pad_x = overlap_m / m_per_deg_lat, overlap_m / m_per_deg_lon
+
+    chunks = []
+    for r in range(n_rows):
+        for c in range(n_cols):
+            w, s = west + c * dx, south + r * dy
+            e, n = w + dx, s + dy
+            chunks.append(AOIChunk(
+                abbr=f"{abbr}_r{r:02d}c{c:02d}",
+                core=box(w, s, e, n),
+                fetch=box(w - pad_x, s - pad_y, e + pad_x, n + pad_y),
+            ))
+    return chunks
+
+
+def owned_segments(segments, core):
+    """Keep segments whose midpoint lies in the chunk's core area (boundary counts as inside)."""
+    import shapely
+
+    mid = shapely.line_interpolate_point(segments.geometry.to_numpy(), 0.5, normalized=True)
+    shapely.prepare(core)
+    return segments[shapely.covers(core, mid)]
+
+#  ------------- CHUNK WORKER -------------
+
+def _chunk_elevation(chunk: AOIChunk, formats, dem_dir: Path):
+    """Elevation grid of the chunk's fetch area, cached in the batch's own dem_dir."""
+    from pipeline.modules.fetch_elevation import fetch_elevation
+    from pipeline.modules.table_io import resolve_table
+
+    cached = resolve_table(dem_dir / f"{chunk.abbr}_30m_grid", suffixes=(".parquet", ".csv"))
+    if cached is not None:
+        return cached
+    aoi = {"place_name": chunk.place_name or chunk.abbr, "area_name": chunk.area_name,
+           "abbr": chunk.abbr, "bounds": chunk.bounds}
+    return fetch_elevation(formats=formats, aoi=aoi, polygon=chunk.fetch, out_dir=dem_dir)
+
+
+def run_chunk(chunk: AOIChunk, work_dir: Path, split_len_m=SPLIT_LEN_M, formats=("parquet",), reuse=True) -> dict:
+    """Network → owned segments → elevation features for one chunk; results go to Parquet parts."""
+    from pipeline.modules.table_io import typed_columns, write_table
+
+    seg_path = work_dir / f"{chunk.abbr}_segments.parquet"
+    feat_path = work_dir / f"{chunk.abbr}_pu_features.parquet"
+    if reuse and seg_path.exists() and feat_path.exists():
+        return {"abbr": chunk.abbr, "segments": seg_path, "features": feat_path, "reused": True}
+
+    from pipeline.core import build_street_network
+    from pipeline.modules.street_define import make_segments
+    from pipeline.modules.segments_elevation import join_elevation_to_segments
+
+    with metrics.stage("chunk", chunk=chunk.abbr) as st:
+        try:
+            _, edges = build_street_network(chunk.place_name, polygon=chunk.fetch)
+        except ValueError:  # no drivable streets inside the polygon
+            return {"abbr": chunk.abbr, "segments": None, "features": None, "n_segments": 0}
+        st.count(edges=len(edges))
+
+        segments = owned_segments(make_segments(edges, split_len_m=split_len_m), chunk.core)
+        del edges
+        if segments.empty:
+            return {"abbr": chunk.abbr, "segments": None, "features": None, "n_segments": 0}
+        features = join_elevation_to_segments(
+            segments_gpd=segments,
+            elev_data=_chunk_elevation(chunk, formats, work_dir.parent / "dem"),
+            buf_m=15.0,
+            max_nn_m=60.0,
+        )
+        st.count(segments=len(segments))
+
+        write_table(typed_columns(segments), seg_path)
+        write_table(typed_columns(features), feat_path)
+    return {"abbr": chunk.abbr, "segments": seg_path, "features": feat_path, "n_segments": len(segments)}
+
+#  ------------- STITCH -------------
+
+def stitch_chunks(results: list[dict], chunk_order: list[str]):
+    """Concatenate chunk parts in chunk order and drop seam duplicates by segment_id."""
+    import geopandas as gpd
+    from pipeline.modules.table_io import read_table
+
+    order = {abbr: i for i, abbr in enumerate(chunk_order)}
+    done = sorted((r for r in results if r.get("segments")), key=lambda r: order[r["abbr"]])
+
+    seg_parts = [read_table(r["segments"]).assign(chunk=r["abbr"]) for r in done]
+    segments = gpd.GeoDataFrame(pd.concat(seg_parts, ignore_index=True), geometry="geometry", crs=4326)
+    n_raw = len(segments)
+    segments = segments.drop_duplicates("segment_id", keep="first").reset_index(drop=True)
+
+    feat_parts = [read_table(r["features"]) for r in done]
+    features = pd.concat(feat_parts, ignore_index=True).drop_duplicates("segment_id", keep="first")
+    features = features[features["segment_id"].isin(segments["segment_id"])].reset_index(drop=True)
+
+    print(f"[batch] stitched {len(done)} chunks: {n_raw:,} → {len(segments):,} segments ({n_raw - len(segments):,} seam duplicates)")
+    return segments, features
+
+
+def _prefetch_dem():
+    """Download DEM tiles once in the parent so workers don't race on the shared cache."""
+    from pipeline.modules.fetch_elevation import _elevation_cfg, ensure_local
+
+    elev = _elevation_cfg()
+    if elev["cache_dir"]:
+        for uri in elev["tiles"]:
+            ensure_local(uri, elev["cache_dir"])
+
+#  ------------- ENTRY POINT -------------
+
+def run_batch(workers: Optional[int] = None, reuse: bool = True) -> dict:
+    from pipeline.modules.segment_table import SegmentTable
+    from pipeline.modules.street_define import make_corridors
+    from pipeline.modules.node_lonlat_export import export_segment_lonlat
+    from pipeline.modules.table_io import export_table, typed_columns
+
+    cfg = _batch_cfg()
+    formats = cfg_get("outputs", "formats", default=["parquet"])
+    abbr = cfg["abbr"]
+    workers = workers or cfg["workers"]
+
+    if cfg["aois"]:
+        chunks = chunks_from_aois(cfg["aois"], overlap_m=cfg["overlap_m"])
+    elif cfg["region"].get("bbox"):
+        chunks = tile_region(cfg["region"]["bbox"], abbr, tile_m=cfg["tile_m"], overlap_m=cfg["overlap_m"])
+    else:
+        raise ValueError("batch mode needs `batch.aois` or `batch.region.bbox` in config.yaml")
+
+    work_dir = OUTPUT_DIR / "batch" / abbr / "chunks"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    _prefetch_dem()
+
+    print(f"[batch] {len(chunks)} chunks | overlap {cfg['overlap_m']:.0f} m | workers {workers or 'auto'}")
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(run_chunk, ch, work_dir, cfg["split_len_m"], formats, reuse): ch.abbr
+            for ch in chunks
+        }
+        for fut in as_completed(futures):
+            res = fut.result()
+            results.append(res)
+            state = "reused" if res.get("reused") else f"{res.get('n_segments', 0):,} segments"
+            print(f"✅ [{len(results)}/{len(chunks)}] {futures[fut]}: {state}")
+
+    with metrics.stage("stitch") as st:
+        segments, features = stitch_chunks(results, [ch.abbr for ch in chunks])
+        st.count(chunks=len(results), segments=len(segments))
+
+    # Corridors over the stitched network so streets are not split at seams
+    segments = SegmentTable.from_geodataframe(segments.drop(columns=["chunk"]))
+    corridors, segments = make_corridors(segments, merge_dual=False)
+    segments_gdf = typed_columns(segments.to_geodataframe())
+    features = features.drop(columns=["corridor_id"], errors="ignore").merge(
+        segments_gdf[["segment_id", "corridor_id"]], on="segment_id", how="left"
+    )
+
+    export_segment_lonlat(
+        segments_gdf=segments,
+        out_csv=OUTPUT_DIR / f"{abbr}_segments_lonlat.csv" if "csv" in formats else None,
+        also_parquet=OUTPUT_DIR / f"{abbr}_segments_lonlat.parquet",
+    )
+    # Profiles / hydrology on the whole region's DEM and adjacency on the stitched network, not per chunk,
+    # so catchments and neighbourhoods are not cut at seams
+    from pipeline.modules.elevation_profile import _profile_cfg, add_profile_features
+    from pipeline.modules.fetch_elevation import ensure_dem_geotiff
+    from pipeline.modules.hydrology import _hydro_cfg, add_hydrology_features
+    from pipeline.modules.segment_adjacency import _adjacency_cfg, add_adjacency_features
+    region = {"abbr": abbr, "bounds": (min(ch.bounds[0] for ch in chunks), min(ch.bounds[1] for ch in chunks),
+                                       max(ch.bounds[2] for ch in chunks), max(ch.bounds[3] for ch in chunks))}
+    dem_dir = work_dir.parent / "dem"
+    if _profile_cfg()["enabled"]:
+        features = add_profile_features(features, segments, ensure_dem_geotiff(region, out_dir=dem_dir))
+    if _hydro_cfg()["enabled"]:
+        features = add_hydrology_features(features, segments, ensure_dem_geotiff(region, out_dir=dem_dir), abbr=abbr)
+    if _adjacency_cfg()["enabled"]:
+        features = add_adjacency_features(features, segments)
+
+    written = {
+        "segments": export_table(segments_gdf, OUTPUT_DIR / f"{abbr}_segments", formats=formats),
+        "corridors": export_table(typed_columns(corridors), OUTPUT_DIR / f"{abbr}_corridors", formats=formats),
+        "features": export_table(typed_columns(features), OUTPUT_DIR / f"{abbr}_pu_features", formats=formats),
+    }
+
+    from pipeline.core import build_risk_scores, build_segment_tiles
+    risk = build_risk_scores(features, outdir=OUTPUT_DIR, target_abbr=abbr, segments=segments)
+    written["risk"] = {"parquet": OUTPUT_DIR / f"{abbr}_risk.parquet"}
+    build_segment_tiles(segments_gdf, features.merge(risk, on="segment_id", how="left"),
+                        outdir=OUTPUT_DIR, target_abbr=abbr)
+
+    print(f"[batch] {len(segments):,} segments | {len(corridors):,} corridors → {OUTPUT_DIR}")
+    return written
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--no_reuse", action="store_true", help="recompute chunks even if their parts exist")
+    args = p.parse_args()
+    run_batch(workers=args.workers, reuse=not args.no_reuse)
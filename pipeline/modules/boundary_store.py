@@ -0,0 +1,176 @@
+"""
+Cached AOI boundary polygons (and rasterized masks) for SBAFN.
+
+Inputs
+- aoi: {abbr, area_name, place_name, bbox?, boundary_file?}; defaults to config `aoi`
+- boundary_file: optional local GeoJSON/GeoParquet/GeoPackage with the AOI polygon(s)
+- Nominatim: optional fallback fetcher (`boundaries.fetch: true`), country from `aoi.country`
+
+Outputs
+- {boundaries.dir}/{abbr}.parquet: one-row GeoParquet (WKB) {abbr, name, source, saved_at, geometry}
+- {boundaries.dir}/masks/{abbr}_{key}.npy: boolean inside-AOI mask per (polygon, DEM transform, shape)
+
+Resolution order: stored polygon → local boundary_file → Nominatim (then stored) → config bbox.
+
+Usage
+    from pipeline.modules.boundary_store import aoi_polygon, BoundaryStore
+
+    poly = aoi_polygon()                                  # config AOI, resolved once per machine
+    mask = BoundaryStore().mask("mnl", poly, transform, (H, W))
+"""
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from pipeline.config import REPO_ROOT, cfg_get
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+USER_AGENT = "sbafn-elev/0.1 (contact@example.com)"
+
+# ---------------------------------
+
+def _boundary_cfg() -> dict:
+    return {
+        "dir": REPO_ROOT / cfg_get("boundaries", "dir", default="data/boundaries"),
+        "fetch": cfg_get("boundaries", "fetch", default=True),
+        "country": cfg_get("aoi", "country", default="Philippines"),
+    }
+
+
+def _config_aoi() -> dict:
+    return {
+        "abbr": cfg_get("aoi", "abbr", default="mnl"),
+        "area_name": cfg_get("aoi", "area_name"),
+        "place_name": cfg_get("aoi", "place_name"),
+        "bbox": cfg_get("aoi", "bbox", default=None),
+        "boundary_file": cfg_get("aoi", "boundary_file", default=None),
+    }
+
+
+def fetch_city_polygon(city: str, country: str):
+    """Largest-importance Nominatim polygon for `city, country`."""
+    from shapely.geometry import shape
+    from pipeline import http_client
+
+    # Nominatim allows 1 req/s: config `http.hosts` pins its bucket
+    r = http_client.get(
+        NOMINATIM_URL,
+        params={"city": city, "country": country, "format": "jsonv2", "polygon_geojson": 1},
+        headers={"User-Agent": USER_AGENT},
+        timeout=30,
+    )
+    r.raise_for_status()
+    hits = [h for h in r.json() if h.get("geojson", {}).get("type") in ("Polygon", "MultiPolygon")]
+    if not hits:
+        raise LookupError(f"No boundary polygon on Nominatim for {city!r}, {country!r}")
+    return shape(max(hits, key=lambda h: h.get("importance", 0))["geojson"])
+
+
+def _read_boundary_file(path: Path):
+    """Union of all polygons in a local boundary file, in WGS84."""
+    from pipeline.modules.table_io import read_table
+
+    gdf = read_table(path)
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(4326)
+    return gdf.geometry.union_all()
+
+
+class BoundaryStore:
+    """AOI polygons persisted as one GeoParquet file per abbr."""
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root or _boundary_cfg()["dir"])
+
+    def path(self, abbr: str) -> Path:
+        return self.root / f"{abbr}.parquet"
+
+    def get(self, abbr: str):
+        path = self.path(abbr)
+        if not path.exists():
+            return None
+        from pipeline.modules.table_io import read_table
+
+        return read_table(path).geometry.iloc[0]
+
+    def put(self, abbr: str, polygon, source: str, name: Optional[str] = None) -> Path:
+        import geopandas as gpd
+        from pipeline.modules.table_io import write_table
+
+        gdf = gpd.GeoDataFrame(
+            {
+                "abbr": [abbr],
+                "name": [name or abbr],
+                "source": [source],
+                "saved_at": [datetime.now(timezone.utc).isoformat(timespec="seconds")],
+            },
+            geometry=[polygon],
+            crs=4326,
+        )
+        return write_table(gdf, self.path(abbr))
+
+    def resolve(self, aoi: dict, fetch: Optional[bool] = None):
+        """Polygon for `aoi`: stored → boundary_file → Nominatim → bbox. Newly resolved shapes are stored."""
+        from shapely.geometry import box
+
+        cfg = _boundary_cfg()
+        abbr = aoi["abbr"]
+        poly = self.get(abbr)
+        if poly is not None:
+            return poly
+
+        if aoi.get("boundary_file"):
+            poly = _read_boundary_file(REPO_ROOT / aoi["boundary_file"])
+            self.put(abbr, poly, source=str(aoi["boundary_file"]), name=aoi.get("area_name"))
+            return poly
+
+        fetch = cfg["fetch"] if fetch is None else fetch
+        if fetch and aoi.get("area_name"):
+            try:
+                poly = fetch_city_polygon(aoi["area_name"], cfg["country"])
+            except Exception as e:  # offline / not found → bbox below
+                print(f"[boundary] Nominatim lookup failed for {aoi['area_name']!r}: {e}")
+            else:
+                self.put(abbr, poly, source="nominatim", name=aoi.get("area_name"))
+                print(f"[boundary] stored {abbr} boundary → {self.path(abbr)}")
+                return poly
+
+        if aoi.get("bbox"):
+            b = aoi["bbox"]
+            return box(b["west"], b["south"], b["east"], b["north"])
+        raise LookupError(f"No boundary for AOI {abbr!r}: set aoi.boundary_file, aoi.bbox or enable boundaries.fetch")
+
+    # ----- rasterized masks -----
+
+    @staticmethod
+    def mask_key(polygon, transform, shape: tuple[int, int]) -> str:
+        h = hashlib.sha1(polygon.wkb)
+        h.update(np.array([transform.a, transform.b, transform.c, transform.d, transform.e, transform.f]).tobytes())
+        h.update(np.asarray(shape, dtype=np.int64).tobytes())
+        return h.hexdigest()[:16]
+
+    def mask(self, abbr: str, polygon, transform, shape: tuple[int, int]) -> np.ndarray:
+        """Boolean inside-polygon mask for a raster grid, cached per (polygon, transform, shape)."""
+        path = self.root / "masks" / f"{abbr}_{self.mask_key(polygon, transform, shape)}.npy"
+        if path.exists():
+            return np.load(path)
+
+        from rasterio.features import geometry_mask
+        from shapely.geometry import mapping
+
+        mask = geometry_mask([mapping(polygon)], out_shape=shape, transform=transform, invert=True)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".part.npy")
+        np.save(tmp, mask)
+        tmp.replace(path)
+        return mask
+
+
+def aoi_polygon(aoi: Optional[dict] = None, fetch: Optional[bool] = None):
+    """Resolved boundary polygon for `aoi` (default: config `aoi`)."""
+    return BoundaryStore().resolve(aoi or _config_aoi(), fetch=fetch)
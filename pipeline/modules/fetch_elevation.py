@@ -1,38 +1,34 @@
-from shapely.geometry import shape, mapping
 from pathlib import Path
 
-from botocore.config import Config
-from botocore import UNSIGNED
-from rasterio.features import geometry_mask
-from rasterio.merge import merge
 import pandas as pd
 import numpy as np
-import boto3
-import rasterio
-import requests
-import yaml
 
-# --------------------
-
-REPO_ROOT = Path(__file__).resolve().parents[2]
+from pipeline.config import REPO_ROOT, cfg_get
+from pipeline.modules.boundary_store import BoundaryStore
+from pipeline.modules.table_io import export_table
 
-with open(REPO_ROOT / "pipeline" / "configs" / "config.yaml", "r", encoding="utf-8") as f:
-    cfg = yaml.safe_load(f)
-
-# CONFIGS: Elevation
-CACHE_DIR = Path(cfg.get("elevation", {}).get("cache_dir", ""))
-TILES = cfg.get("elevation", {}).get("tiles", [])
-OUT_DIR = cfg.get("elevation", {}).get("out_dir", "")
+# --------------------
 
-# CONFIGS: AOI
-AOI_PLACE_NAME = cfg.get("aoi", {}).get("place_name")
-AOI_AREA_NAME = cfg.get("aoi", {}).get("area_name")
-AOI_ABBR = cfg.get("aoi", {}).get("abbr")
-MIN_LON = cfg.get("aoi", {}).get("bbox", {}).get("west", 0)
-MIN_LAT = cfg.get("aoi", {}).get("bbox", {}).get("south", 0)
-MAX_LON = cfg.get("aoi", {}).get("bbox", {}).get("east", 0)
-MAX_LAT = cfg.get("aoi", {}).get("bbox", {}).get("north", 0)
-bounds = (MIN_LON, MIN_LAT, MAX_LON, MAX_LAT)
+def _elevation_cfg() -> dict:
+    # CONFIGS: Elevation
+    cache_dir = cfg_get("elevation", "cache_dir", default="")
+    return {
+        "cache_dir": Path(cache_dir) if cache_dir else None,
+        "tiles": cfg_get("elevation", "tiles", default=[]),
+        "out_dir": cfg_get("elevation", "out_dir", default=""),
+    }
+
+def _aoi_cfg() -> dict:
+    # CONFIGS: AOI
+    bbox = cfg_get("aoi", "bbox", default={})
+    return {
+        "place_name": cfg_get("aoi", "place_name"),
+        "area_name": cfg_get("aoi", "area_name"),
+        "abbr": cfg_get("aoi", "abbr"),
+        "bbox": bbox,
+        "boundary_file": cfg_get("aoi", "boundary_file", default=None),
+        "bounds": (bbox.get("west", 0), bbox.get("south", 0), bbox.get("east", 0), bbox.get("north", 0)),
+    }
 
 # --------------------
 
@@ -40,28 +36,28 @@ def s3_to_https(s3_uri: str) -> str:
     return s3_uri.replace("s3://copernicus-dem-30m/",
                           "https://copernicus-dem-30m.s3.amazonaws.com/")
 
-def ensure_local(s3_uri: str) -> Path:
-    assert CACHE_DIR is not None, "CACHE_DIR must be set to download"
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+def ensure_local(s3_uri: str, cache_dir: Path | None = None) -> Path:
+    from pipeline import http_client
+
+    cache_dir = cache_dir or _elevation_cfg()["cache_dir"]
+    assert cache_dir is not None, "CACHE_DIR must be set to download"
+    cache_dir.mkdir(parents=True, exist_ok=True)
     fname = Path(s3_uri.split("/")[-1])
-    out = CACHE_DIR / fname
+    out = cache_dir / fname
     if out.exists():
         return out
     
-    # AWS S3: Unsigned client for data access
-    bucket = "copernicus-dem-30m"
-    key = s3_uri.split(bucket + "/")[1]
-    s3 = boto3.client("s3", config=Config(signature_version=UNSIGNED))
-    tmp = out.with_suffix(out.suffix + ".part")
-    s3.download_file(bucket, key, str(tmp))
-    tmp.replace(out)
-    return out
+    # Public bucket over HTTPS through the shared, rate-limited keep-alive session
+    return http_client.download(s3_to_https(s3_uri), out)
 
 def open_sources():
-    if CACHE_DIR:
-        paths = [str(ensure_local(u)) for u in TILES]
+    import rasterio
+
+    elev = _elevation_cfg()
+    if elev["cache_dir"]:
+        paths = [str(ensure_local(u, elev["cache_dir"])) for u in elev["tiles"]]
     else:
-        paths = [s3_to_https(u) for u in TILES]
+        paths = [s3_to_https(u) for u in elev["tiles"]]
     env = rasterio.Env(
         GDAL_DISABLE_READDIR_ON_OPEN="YES",
         GDAL_HTTP_MAX_RETRY="5",
@@ -79,24 +75,17 @@ def grid_lonlat(transform, H, W):
     LAT = np.tile(lats.reshape(-1,1), (1, W))
     return LAT, LON
 
-def fetch_city_polygon(city, country):
-    r = requests.get(
-        "https://nominatim.openstreetmap.org/search",
-        params={"city": city, "country": country, "format": "jsonv2", "polygon_geojson": 1},
-        headers={"User-Agent": "sbafn-elev/0.1 (contact@example.com)"},
-        timeout=30
-    ).json()
-    return shape(max(r, key=lambda x: x.get("importance", 0))["geojson"])
-
-# --------------------
+def merged_dem(bounds):
+    """Mosaic of the configured tiles cropped to `bounds` → (float32 array, NaN nodata), transform, crs."""
+    from rasterio.merge import merge
 
-def fetch_elevation():
     env, srcs = open_sources()
     try:
         with env:
             # Mosaic AND crop to bbox in one go
             mosaic, transform = merge(srcs, bounds=bounds)
             data = mosaic[0].astype("float32")
+            crs = srcs[0].crs
 
             for s in srcs:
                 if s.nodata is not None:
@@ -104,13 +93,55 @@ def fetch_elevation():
     finally:
         for s in srcs:
             s.close()
+    return data, transform, crs
+
+def dem_geotiff_path(abbr: str, out_dir: Path | None = None) -> Path:
+    out_dir = Path(out_dir) if out_dir is not None else REPO_ROOT / _elevation_cfg()["out_dir"]
+    return out_dir / f"{abbr}_30m_dem.tif"
+
+def save_dem_geotiff(data, transform, crs, path: Path) -> Path:
+    import rasterio
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    H, W = data.shape
+    profile = dict(driver="GTiff", height=H, width=W, count=1, dtype="float32", crs=crs,
+                   transform=transform, nodata=np.nan, tiled=True, blockxsize=256, blockysize=256,
+                   compress="deflate", predictor=3)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data.astype("float32"), 1)
+    return path
+
+def ensure_dem_geotiff(aoi: dict | None = None, out_dir: Path | None = None) -> Path:
+    """{abbr}_30m_dem.tif, merged from the source tiles if an earlier run did not write it."""
+    aoi = aoi or _aoi_cfg()
+    path = dem_geotiff_path(aoi["abbr"], out_dir)
+    if not path.exists():
+        save_dem_geotiff(*merged_dem(aoi["bounds"]), path)
+    return path
+
+# --------------------
+
+def fetch_elevation(formats=None, aoi: dict | None = None, polygon=None, out_dir: Path | None = None):
+    """
+    Crop the DEM mosaic to `aoi["bounds"]` and keep cells inside `polygon`
+    (default: the AOI's stored boundary, see boundary_store). `aoi` defaults to config `aoi`.
+    Writes {out_dir}/{abbr}_30m_grid and the unmasked bbox mosaic {out_dir}/{abbr}_30m_dem.tif;
+    `out_dir` defaults to config `elevation.out_dir`.
+    """
+    aoi = aoi or _aoi_cfg()
+    out_dir = Path(out_dir) if out_dir is not None else REPO_ROOT / _elevation_cfg()["out_dir"]
+    data, transform, crs = merged_dem(aoi["bounds"])
+
+    # Unmasked bbox mosaic for raster stages (hydrology)
+    save_dem_geotiff(data, transform, crs, dem_geotiff_path(aoi["abbr"], out_dir))
 
     H, W = data.shape
     LAT, LON = grid_lonlat(transform, H, W)
 
-    # City mask (vectorized)
-    city_poly = fetch_city_polygon(AOI_AREA_NAME, "Philippines")
-    mask = geometry_mask([mapping(city_poly)], out_shape=(H, W), transform=transform, invert=True)
+    # City mask (cached per AOI polygon + DEM transform)
+    boundaries = BoundaryStore()
+    city_poly = polygon if polygon is not None else boundaries.resolve(aoi)
+    mask = boundaries.mask(aoi["abbr"], city_poly, transform, (H, W))
     data_city = np.where(mask, data, np.nan)
 
     # [EXPORT] Output filtered elevation file (only AOI)
@@ -119,9 +150,10 @@ def fetch_elevation():
         "lon": LON.ravel(),
         "elevation_30m": data_city.ravel()
     }).dropna(subset=["elevation_30m"]).reset_index(drop=True)
-    df_city.to_csv(REPO_ROOT / OUT_DIR / f"{AOI_ABBR}_30m_grid.csv", index=False)
+    formats = formats or cfg_get("outputs", "formats", default=["parquet"])
+    export_table(df_city, out_dir / f"{aoi['abbr']}_30m_grid", formats=formats)
 
-    print(f"[DONE] Wrote {AOI_PLACE_NAME} elevation data")
+    print(f"[DONE] Wrote {aoi['place_name']} elevation data")
     print("[DONE] City-only rows:", len(df_city))
 
     return df_city
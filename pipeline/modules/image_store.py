@@ -0,0 +1,379 @@
+"""
+Sharded, append-only image store for Mapillary thumbnails and pano faces.
+
+Images are packed into large uncompressed tar shards (WebDataset layout: one member per image,
+member name = the file name `_download_one` would have written, e.g. `123_2048.jpg`):
+
+    data/image_store/shard-000000.tar
+    data/image_store/shard-000000.idx.parquet      key, offset, length (byte range of the member data)
+    data/image_store/shard-000001.tar.part         shard being written (invisible to readers)
+
+- Shards are never modified once closed; a writer always starts a new shard and rolls over at
+  `image_store.shard_mb`. The shard index is written before the `.part` is renamed, so a
+  visible shard always has its index.
+- A key stored again lands in a newer shard; the newest copy wins.
+- Reads mmap each shard once and return memoryview slices (zero-copy); images are decoded
+  straight from the slice with cv2.imdecode.
+- Manifest rows point into the store with a ref `{root}::{key}`; `read_image(ref)` accepts refs
+  and plain file paths, so readers work with either download sink.
+
+Usage
+    with ImageStore("data/image_store") as store:
+        ref = store.put("123_2048.jpg", jpeg_bytes)
+        img = store.read("123_2048.jpg")                 # BGR uint8
+    img = read_image(row["file_path"])                   # ref or file path
+
+    python -m pipeline.modules.image_store pack              # data/images/*.jpg → shards, manifests → refs
+    python -m pipeline.modules.image_store extract --out data/annotation_v1_images/temp --ids-from ids.csv
+    python -m pipeline.modules.image_store recover           # finish shards left as .part by a crash
+    python -m pipeline.modules.image_store stats
+
+Notes
+- One writer per store at a time; any number of readers (processes included).
+- Shards are plain tar files: `tar tf shard-000000.tar` lists them and WebDataset-style loaders
+  can stream them directly.
+- Ultralytics trains from image directories, so training data is materialised per split with
+  `extract_images` (see models/cv-yolo-model/data_splitter.py); inference can stream from the store.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import mmap
+import re
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import REPO_ROOT, cfg_get
+
+REF_SEP = "::"
+_SHARD_RE = re.compile(r"shard-(\d{6})\.tar(\.part)?$")
+_STORES: dict[str, "ImageStore"] = {}
+
+# ---------------------------------
+
+def _store_cfg() -> dict:
+    return {
+        "enabled": bool(cfg_get("image_store", "enabled", default=False)),
+        "root": cfg_get("image_store", "root", default="data/image_store/"),
+        "shard_mb": float(cfg_get("image_store", "shard_mb", default=1024)),
+    }
+
+
+def default_root() -> Path:
+    return REPO_ROOT / _store_cfg()["root"]
+
+
+def _idx_path(shard: Path) -> Path:
+    return shard.with_name(shard.name.split(".tar")[0] + ".idx.parquet")
+
+
+def scan_shard(path: Path) -> pd.DataFrame:
+    """(key, offset, length) of every complete member; stops at a truncated tail."""
+    rows = []
+    try:
+        with tarfile.open(path, "r:") as tf:
+            for info in tf:
+                if info.isfile() and info.offset_data + info.size <= path.stat().st_size:
+                    rows.append((info.name, info.offset_data, info.size))
+    except tarfile.ReadError:
+        pass
+    return pd.DataFrame(rows, columns=["key", "offset", "length"]).astype({"offset": "int64", "length": "int64"})
+
+
+class ImageStore:
+    def __init__(self, root: str | Path | None = None, shard_mb: Optional[float] = None):
+        self.root = Path(root) if root is not None else default_root()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.shard_bytes = int((shard_mb or _store_cfg()["shard_mb"]) * 2**20)
+        self._lock = threading.Lock()
+        self._index: Optional[pd.DataFrame] = None
+        self._cols: Optional[np.ndarray] = None
+        self._maps: dict[int, mmap.mmap] = {}
+        self._index_mtime: Optional[int] = None     # root dir mtime when the index was loaded
+        # Writer state (opened on the first put)
+        self._tar: Optional[tarfile.TarFile] = None
+        self._part: Optional[Path] = None
+        self._written: dict[str, tuple[int, int]] = {}
+
+    def close(self):
+        self.flush()
+        for m in self._maps.values():
+            try:
+                m.close()
+            except BufferError:               # a returned view is still alive; freed with it
+                pass
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ----- shards / index -----
+
+    def shards(self) -> list[Path]:
+        return sorted(p for p in self.root.glob("shard-*.tar") if _SHARD_RE.search(p.name))
+
+    def _shard_no(self, path: Path) -> int:
+        return int(_SHARD_RE.search(path.name).group(1))
+
+    @property
+    def index(self) -> pd.DataFrame:
+        """key → shard, offset, length over all closed shards (newest copy per key), indexed by key."""
+        if self._index is None:
+            self._index_mtime = self.root.stat().st_mtime_ns
+            frames = []
+            for shard in self.shards():
+                idx = _idx_path(shard)
+                part = pd.read_parquet(idx) if idx.exists() else scan_shard(shard)
+                frames.append(part.assign(shard=self._shard_no(shard)))
+            index = pd.concat(frames, ignore_index=True) if frames else \
+                pd.DataFrame({"key": pd.Series(dtype=str), "offset": pd.Series(dtype="int64"),
+                              "length": pd.Series(dtype="int64"), "shard": pd.Series(dtype="int64")})
+            self._index = index.drop_duplicates("key", keep="last").set_index("key")[["shard", "offset", "length"]]
+            self._cols = self._index.to_numpy(dtype=np.int64)
+        return self._index
+
+    def refresh(self) -> bool:
+        """Drop the cached index if shards were sealed since it was loaded. Returns True if dropped."""
+        if self._index is not None and self.root.stat().st_mtime_ns != self._index_mtime:
+            self._index = None
+            return True
+        return False
+
+    def keys(self) -> pd.Index:
+        return self.index.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._written or key in self.index.index
+
+    def ref(self, key: str) -> str:
+        return f"{self.root}{REF_SEP}{key}"
+
+    def entry(self, key: str) -> Optional[tuple[int, int, int]]:
+        """(shard, offset, length) of the stored copy, None if absent or not yet in a closed shard."""
+        index = self.index
+        try:
+            i = index.index.get_loc(key)
+        except KeyError:
+            return None
+        return tuple(int(v) for v in self._cols[i])
+
+    # ----- reads -----
+
+    def _map(self, shard: int) -> mmap.mmap:
+        m = self._maps.get(shard)
+        if m is None:
+            with open(self.root / f"shard-{shard:06d}.tar", "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = m
+        return m
+
+    def get(self, key: str) -> Optional[memoryview]:
+        """Raw bytes of `key` as a zero-copy view into the shard map (None if absent)."""
+        e = self.entry(key)
+        if e is None:
+            return None
+        shard, offset, length = e
+        return memoryview(self._map(shard))[offset:offset + length]
+
+    def read(self, key: str, flags: Optional[int] = None) -> Optional[np.ndarray]:
+        """Decoded image (cv2 flags, default IMREAD_COLOR), None if absent or undecodable."""
+        import cv2
+
+        buf = self.get(key)
+        if buf is None:
+            return None
+        return cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR if flags is None else flags)
+
+    def iter_images(self, keys: Optional[Iterable[str]] = None, flags: Optional[int] = None) -> Iterator[tuple[str, np.ndarray]]:
+        """(key, image) for `keys` (default all), visited in shard / offset order for sequential I/O."""
+        index = self.index if keys is None else self.index.reindex(pd.Index(list(keys))).dropna()
+        for key in index.sort_values(["shard", "offset"]).index:
+            img = self.read(key, flags)
+            if img is not None:
+                yield key, img
+
+    # ----- writes -----
+
+    def _next_part(self) -> Path:
+        nums = [self._shard_no(p) for p in self.root.glob("shard-*.tar*") if _SHARD_RE.search(p.name)]
+        return self.root / f"shard-{max(nums, default=-1) + 1:06d}.tar.part"
+
+    def put(self, key: str, data: bytes | memoryview) -> str:
+        """Append one image; thread-safe. Returns its ref (readable after flush / close)."""
+        data = bytes(data)
+        with self._lock:
+            if self._tar is None:
+                self._part = self._next_part()
+                self._tar = tarfile.open(self._part, "w", format=tarfile.PAX_FORMAT)
+            info = tarfile.TarInfo(key)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, io.BytesIO(data))
+            # After addfile the stream sits at the end of the member's 512-byte padded data
+            offset = self._tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            self._written[key] = (offset, len(data))
+            if self._tar.offset >= self.shard_bytes:
+                self._seal()
+        return self.ref(key)
+
+    def _seal(self):
+        """Close the shard being written: end-of-archive, index, then rename (caller holds the lock)."""
+        if self._tar is None:
+            return
+        self._tar.close()
+        rows = [(k, o, n) for k, (o, n) in self._written.items()]
+        idx = pd.DataFrame(rows, columns=["key", "offset", "length"]).astype({"offset": "int64", "length": "int64"})
+        final = self._part.with_suffix("")
+        idx.to_parquet(_idx_path(final), index=False)
+        self._part.replace(final)
+        self._tar, self._part, self._written, self._index = None, None, {}, None
+
+    def flush(self):
+        """Seal the current shard so everything put so far is visible to readers."""
+        with self._lock:
+            self._seal()
+
+    def recover(self) -> list[Path]:
+        """Seal `.part` shards left by a crashed writer (complete members only). Not while a writer runs."""
+        done = []
+        for part in sorted(self.root.glob("shard-*.tar.part")):
+            idx = scan_shard(part)
+            final = part.with_suffix("")
+            idx.to_parquet(_idx_path(final), index=False)
+            part.replace(final)
+            done.append(final)
+        self._index = None
+        return done
+
+
+def store_for(root: str | Path) -> ImageStore:
+    """
+    Per-process shared reader for `root` (workers open their own maps lazily). Sealing a shard
+    renames it into the root, so the cached index is reloaded whenever the root's mtime moves.
+    """
+    key = str(Path(root))
+    store = _STORES.get(key)
+    if store is None:
+        store = _STORES[key] = ImageStore(root)
+    else:
+        store.refresh()
+    return store
+
+
+def split_ref(ref: str) -> Optional[tuple[str, str]]:
+    """(root, key) for a store ref, None for a plain file path."""
+    if REF_SEP not in ref:
+        return None
+    root, key = ref.rsplit(REF_SEP, 1)
+    return root, key
+
+
+def ref_name(ref: str) -> str:
+    """Image file name for a ref or a path."""
+    parts = split_ref(ref)
+    return parts[1] if parts else Path(ref).name
+
+
+def ref_stat(ref: str) -> Optional[tuple[int, int]]:
+    """(size, version) of a ref or path; version changes when the image is rewritten. None if missing."""
+    parts = split_ref(ref)
+    if parts is None:
+        p = Path(ref)
+        if not p.exists():
+            return None
+        st = p.stat()
+        return st.st_size, st.st_mtime_ns
+    e = store_for(parts[0]).entry(parts[1])
+    return None if e is None else (e[2], e[0] << 40 | e[1])
+
+
+def read_image(ref: str, flags: Optional[int] = None) -> Optional[np.ndarray]:
+    """Decode a store ref or an image file path (cv2 flags, default IMREAD_COLOR)."""
+    import cv2
+
+    flags = cv2.IMREAD_COLOR if flags is None else flags
+    parts = split_ref(ref)
+    if parts is None:
+        return cv2.imread(ref, flags)
+    return store_for(parts[0]).read(parts[1], flags)
+
+#  ------------- MIGRATION / EXPORT -------------
+
+def pack_files(paths: Iterable[str | Path], store: ImageStore) -> dict[str, str]:
+    """Copy image files into the store (skips keys already stored). Returns {path: ref}."""
+    refs = {}
+    for p in map(Path, paths):
+        if p.name not in store:
+            store.put(p.name, p.read_bytes())
+        refs[str(p)] = store.ref(p.name)
+    store.flush()
+    return refs
+
+
+def extract_images(store: ImageStore, keys: Iterable[str], out_dir: str | Path) -> int:
+    """Write `keys` as files into out_dir (e.g. YOLO split folders). Returns the number written."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    n = 0
+    index = store.index.reindex(pd.Index(list(keys))).dropna()
+    for key in index.sort_values(["shard", "offset"]).index:
+        (out_dir / key).write_bytes(store.get(key))
+        n += 1
+    return n
+
+
+def _manifest_paths() -> tuple[Path, Path]:
+    manifest = cfg_get("mapillary_api", "manifest", default={})
+    out_dir = REPO_ROOT / manifest.get("out_dir", "data/meta/")
+    return out_dir / manifest.get("local_manifest_name", "mapillary_manifest_local.csv"), \
+        out_dir / manifest.get("repo_manifest_name", "mapillary_manifest.csv")
+
+#  ------------- ENTRY POINT -------------
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("command", choices=("pack", "extract", "recover", "stats"))
+    p.add_argument("--root", type=Path, default=None, help="default: image_store.root")
+    p.add_argument("--manifest", type=Path, default=None, help="pack: local manifest to repoint (default: config)")
+    p.add_argument("--out", type=Path, default=None, help="extract: output directory")
+    p.add_argument("--ids-from", type=Path, default=None, help="extract: CSV with an `id` column (default: all)")
+    args = p.parse_args()
+
+    store = ImageStore(args.root)
+    if args.command == "pack":
+        local_path = args.manifest or _manifest_paths()[0]
+        manifest = pd.read_csv(local_path, dtype={"id": str})
+        files = [f for f in manifest["file_path"].astype(str) if split_ref(f) is None and Path(f).exists()]
+        refs = pack_files(files, store)
+        manifest["file_path"] = manifest["file_path"].astype(str).map(lambda f: refs.get(f, f))
+        manifest.to_csv(local_path, index=False)
+        print(f"[image_store] packed {len(refs):,} images → {store.root} | {local_path} now points at the store")
+        print("[image_store] the original files are kept; delete them once the store is verified")
+    elif args.command == "extract":
+        keys = store.keys()
+        if args.ids_from is not None:
+            ids = set(pd.read_csv(args.ids_from, dtype={"id": str})["id"].str.strip())
+            keys = keys[keys.str.split("_").str[0].isin(ids)]
+        n = extract_images(store, keys, args.out)
+        print(f"[image_store] extracted {n:,} images → {args.out}")
+    elif args.command == "recover":
+        for shard in store.recover():
+            print(f"[image_store] sealed {shard}")
+    else:
+        index = store.index
+        size = sum(s.stat().st_size for s in store.shards())
+        print(f"[image_store] {store.root}: {len(index):,} images in {len(store.shards())} shards, {size / 2**30:.2f} GiB")
+    store.close()
@@ -0,0 +1,151 @@
+"""
+Lightweight folium street map for SBAFN.
+
+Inputs
+- nodes_wgs / edges_wgs: OSMnx node/edge GeoDataFrames in WGS84
+- Mapillary manifest CSV with lat/lon columns (optional)
+
+Outputs
+- HTML map + sidecar layer files:
+    maps/{abbr}_street_network.html
+    maps/{abbr}_street_network_layers/edges.geojson          (simplified, tooltip fields only)
+    maps/{abbr}_street_network_layers/intersections.geojson  (street_count >= 3, canvas circle markers)
+
+Method
+- Edges are simplified in a metric CRS and trimmed to name/highway/length before writing.
+- Large layers are written as external GeoJSON and fetched by the page on load instead of being
+  inlined (`external_layers: true`); coordinates are written at 6 decimals (~0.1 m).
+- Intersections render as one GeoJSON layer of CircleMarkers on a canvas renderer
+  (`prefer_canvas`), not one DOM element per node.
+- Mapillary image locations use FastMarkerCluster (points clustered client-side).
+
+Usage
+    from pipeline.modules.map_export import build_street_map
+    build_street_map(nodes_wgs, edges_wgs, out_html=OUTPUT_DIR / "maps" / "mnl_street_network.html")
+
+Notes
+- Browsers block fetch() on file:// URLs; serve the maps folder (python -m http.server) or set
+  `folium.external_layers: false` to inline the (already trimmed) layers.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+EDGE_FIELDS = ["name", "highway", "length"]
+EDGE_SIMPLIFY_M = 2.0
+MIN_STREET_COUNT = 3
+COORD_PRECISION = 6
+
+# ---------------------------------
+
+def _flatten(v):
+    if isinstance(v, (list, tuple, set)):
+        return ", ".join(map(str, v))
+    return v
+
+
+def edges_for_map(edges_wgs, fields: list[str] = EDGE_FIELDS, simplify_m: float = EDGE_SIMPLIFY_M):
+    """Simplified edge geometry with only the tooltip attributes."""
+    keep = [c for c in fields if c in edges_wgs.columns]
+    out = edges_wgs.reset_index(drop=True)[[*keep, "geometry"]].copy()
+    for col in keep:
+        if out[col].dtype == object:
+            out[col] = out[col].map(_flatten)
+    if "length" in out.columns:
+        out["length"] = out["length"].astype(float).round(1)
+
+    if simplify_m > 0:
+        metric = out.estimate_utm_crs()
+        out = out.to_crs(metric)
+        out["geometry"] = out.geometry.simplify(simplify_m, preserve_topology=False)
+        out = out.to_crs(4326)
+    return out[~out.geometry.is_empty]
+
+
+def intersections_for_map(nodes_wgs, min_street_count: int = MIN_STREET_COUNT):
+    """Nodes with `min_street_count` or more connecting streets, geometry only."""
+    nodes = nodes_wgs[nodes_wgs["street_count"] >= min_street_count]
+    return nodes[["geometry"]].reset_index(drop=True)
+
+
+def manifest_points(manifest_path: Path) -> list[list[float]]:
+    """[[lat, lon], ...] from the Mapillary manifest; rows with bad coordinates are skipped."""
+    if not Path(manifest_path).exists():
+        print(f"[map] manifest not found, skipping image layer: {manifest_path}")
+        return []
+    df = pd.read_csv(manifest_path, usecols=["lat", "lon"])
+    df = df.apply(pd.to_numeric, errors="coerce").dropna()
+    return df[["lat", "lon"]].round(COORD_PRECISION).to_numpy().tolist()
+
+
+def write_layer(gdf, path: Path) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    gdf.to_file(path, driver="GeoJSON", engine="pyogrio", COORDINATE_PRECISION=COORD_PRECISION)
+    return path
+
+
+def _geojson_layer(gdf, path: Path, html_dir: Path, external: bool, **kwargs):
+    """folium.GeoJson that either inlines `gdf` or fetches `path` (relative to the HTML) on load."""
+    import folium
+
+    write_layer(gdf, path)
+    if not external:
+        return folium.GeoJson(str(path), embed=True, **kwargs)
+    layer = folium.GeoJson(str(path), embed=False, **kwargs)
+    layer.embed_link = path.relative_to(html_dir).as_posix()
+    return layer
+
+#  ------------- ENTRY POINT -------------
+
+def build_street_map(
+    nodes_wgs,
+    edges_wgs,
+    out_html: Path,
+    manifest_path: Optional[Path] = None,
+    area_name: str = "Manila",
+    location: tuple[float, float] = (0.0, 0.0),
+    zoom_start: int = 12,
+    external_layers: bool = True,
+    simplify_m: float = EDGE_SIMPLIFY_M,
+):
+    import folium
+    from folium.plugins import FastMarkerCluster
+
+    out_html = Path(out_html)
+    html_dir = out_html.parent
+    layer_dir = html_dir / f"{out_html.stem}_layers"
+    html_dir.mkdir(parents=True, exist_ok=True)
+
+    m = folium.Map(location=location, zoom_start=zoom_start, tiles="CartoDB positron", prefer_canvas=True)
+
+    edges = edges_for_map(edges_wgs, simplify_m=simplify_m)
+    _geojson_layer(
+        edges, layer_dir / "edges.geojson", html_dir, external_layers,
+        name=f"{area_name} Streets",
+        tooltip=folium.GeoJsonTooltip(fields=[c for c in EDGE_FIELDS if c in edges.columns]),
+    ).add_to(m)
+
+    # Render only nodes with 3 or more connecting streets (intersections)
+    intersections = intersections_for_map(nodes_wgs)
+    _geojson_layer(
+        intersections, layer_dir / "intersections.geojson", html_dir, external_layers,
+        name="Intersections",
+        marker=folium.CircleMarker(radius=2, color="red", fill=True, fill_opacity=0.8),
+    ).add_to(m)
+
+    # [MAPILLARY MANIFEST] Clustered image locations
+    points = manifest_points(manifest_path) if manifest_path is not None else []
+    if points:
+        FastMarkerCluster(points, name="Mapillary images").add_to(m)
+
+    folium.LayerControl().add_to(m)
+    m.save(out_html)
+
+    size_mb = out_html.stat().st_size / 1e6
+    print(f"[map] {len(edges):,} edges | {len(intersections):,} intersections | {len(points):,} images → {out_html} ({size_mb:.1f} MB)")
+    return m
@@ -1,72 +1,55 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from dotenv import load_dotenv
 from pathlib import Path
-import random
+import contextvars
 import csv
 import math
 import time
 import os
 
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import requests
-import yaml
-import cv2
 import numpy as np
 
+from pipeline.config import REPO_ROOT, cfg_get
+from pipeline import http_client, metrics
+from pipeline.modules.boundary_store import aoi_polygon
+
 # -----------------------
 
-REPO_ROOT = Path(__file__).resolve().parents[2]
-PIPELINE_DIR = REPO_ROOT / "pipeline"
+URL = "https://graph.mapillary.com/images"
 
-load_dotenv()
-with open(PIPELINE_DIR / "configs" / "config.yaml", "r", encoding="utf-8") as f:
-    cfg = yaml.safe_load(f)
+def _mapillary_cfg() -> dict:
+    # CONFIGS: MAPILLARY API - IMAGE RETRIEVAL
+    # CONFIGS: MAPILLARY API - MANIFEST EXPORT
+    retrieval = cfg_get("mapillary_api", "image_retrieval", default={})
+    manifest = cfg_get("mapillary_api", "manifest", default={})
+    return {
+        "images_out_dir": retrieval.get("out_dir", "data/images/"),
+        "fields": retrieval.get("fields", []),
+        "fallback_fields": retrieval.get("fallback_fields", []),
+        "per_cell_limit": retrieval.get("per_cell_limit", 2000),
+        "cell_size_m": retrieval.get("cell_size_m", 3000),
+        "cell_overlap_m": retrieval.get("cell_overlap_m", 100),
+        "manifest_repo_fields": manifest.get("repo_fields", []),
+        "manifest_out_dir": manifest.get("out_dir", "data/meta/"),
+        "manifest_repo_name": manifest.get("repo_manifest_name", "mapillary_manifest.csv"),
+        "manifest_local_name": manifest.get("local_manifest_name", "mapillary_manifest_local.csv"),
+    }
 
-# -----------------------
+def _aoi_bbox(polygon=None) -> dict:
+    # CONFIGS: AOI (bounds of the stored AOI boundary; config bbox when none is resolved)
+    if polygon is not None:
+        return dict(zip(("west", "south", "east", "north"), polygon.bounds))
+    bbox = cfg_get("aoi", "bbox", default={})
+    return {k: bbox.get(k, 0) for k in ("west", "south", "east", "north")}
 
-URL = "https://graph.mapillary.com/images"
+def _get_token() -> str:
+    from dotenv import load_dotenv
 
-# CONFIGS: MAPILLARY API - IMAGE RETRIEVAL
-RETRIEVED_IMAGES_OUT_DIR = cfg.get("mapillary_api", {}).get("image_retrieval", {}).get("out_dir", "data/images/")
-FIELDS = cfg.get("mapillary_api", {}).get("image_retrieval", {}).get("fields", {})
-FALLBACK_FIELDS = cfg.get("mapillary_api", {}).get("image_retrieval", {}).get("fallback_fields", {})
-PER_CELL_LIMIT = cfg.get("mapillary_api", {}).get("image_retrieval", {}).get("per_cell_limit", 2000)
-CELL_SIZE_M = cfg.get("mapillary_api", {}).get("image_retrieval", {}).get("cell_size_m", 3000)
-CELL_OVERLAP_M = cfg.get("mapillary_api", {}).get("image_retrieval", {}).get("cell_overlap_m", 100)
-
-# CONFIGS: MAPILLARY API - MANIFEST EXPORT
-MANIFEST_REPO_FIELDS = cfg.get("mapillary_api", {}).get("manifest", {}).get("repo_fields", {})
-MANIFEST_OUT_DIR = cfg.get("mapillary_api", {}).get("manifest", {}).get("out_dir", "data/meta/")
-MANIFEST_REPO_NAME = cfg.get("mapillary_api", {}).get("manifest", {}).get("repo_manifest_name", "mapillary_manifest.csv")
-MANIFEST_LOCAL_NAME = cfg.get("mapillary_api", {}).get("manifest", {}).get("local_manifest_name", "mapillary_manifest_local.csv")
-
-# CONFIGS: AOI
-AOI_BBOX = {
-    "west": cfg.get("aoi", {}).get("bbox", {}).get("west", 0),
-    "south": cfg.get("aoi", {}).get("bbox", {}).get("south", 0),
-    "east": cfg.get("aoi", {}).get("bbox", {}).get("east", 0),
-    "north": cfg.get("aoi", {}).get("bbox", {}).get("north", 0)
-}
-
-TOKEN = os.getenv("MAPILLARY_TOKEN")
-if not TOKEN:
-    raise RuntimeError("Missing MAPILLARY_TOKEN. Set it in .env or the environment.")
-
-# ----- RATE LIMITER (to limit requests and not bombard the server) -----
-class QPSLimiter:
-    def __init__(self, qps: float):
-        self.period = 1.0 / max(qps, 1e-6)
-        self.next_t = 0.0
-    def wait(self, jitter: tuple[float,float]=(0.0, 0.0)):
-        now = time.monotonic()
-        self.next_t = max(self.next_t + self.period, now)
-        delay = self.next_t - now
-        if delay > 0:
-            time.sleep(delay + random.uniform(*jitter))
-
-cell_qps = QPSLimiter(qps=3.0)
-img_qps  = QPSLimiter(qps=8.0)
+    load_dotenv()
+    token = os.getenv("MAPILLARY_TOKEN")
+    if not token:
+        raise RuntimeError("Missing MAPILLARY_TOKEN. Set it in .env or the environment.")
+    return token
 
 # -----------------------
 
@@ -74,38 +57,34 @@ img_qps  = QPSLimiter(qps=8.0)
 def make_session(token: str,
                  timeout: tuple[int, int] = (5, 30),
                  retries: int = 5,
-                 backoff: float = 0.5) -> requests.Session:
+                 backoff: float = 0.5,
+                 pool_size: int = 8) -> requests.Session:
     """
-    Create a configured Session:
+    Create a configured Session (pipeline.http_client):
       - Authorization header once
-      - Retry on 429/5xx
+      - Per-host adaptive rate limits (config `http.hosts`), retry on 429/5xx honouring Retry-After
+      - `pool_size` keep-alive connections per host; match it to the download workers
       - Store a default timeout on the session object
     """
-    s = requests.Session()
-    s.headers.update({"Authorization": f"OAuth {token}"})
-    retry = Retry(
-        total=retries,
-        backoff_factor=backoff,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=frozenset({"GET"}),
-        raise_on_status=False,
-        respect_retry_after_header=True,
+    return http_client.make_session(
+        headers={"Authorization": f"OAuth {token}"},
+        pool_size=pool_size,
+        retries=retries,
+        backoff=backoff,
+        timeout=timeout,
     )
-    s.mount("https://", HTTPAdapter(max_retries=retry))
-
-    # DATA RETRIEVAL TIMEOUT
-    s.request_timeout = timeout
-    return s
 
 def get_mapillary_images(session: requests.Session,
                         bbox: dict,
                         fields: str,
                         per_cell_limit: int = 2000,
                         cell_size_m: int = 3000,
-                        cell_overlap_m: int = 100) -> list[dict]:
+                        cell_overlap_m: int = 100,
+                        aoi_polygon=None) -> list[dict]:
     """
     Iterate over the general bbox (Manila, Philippines) in smaller cells to fetch Mapillary images.
     Fetch `per_cell_limit` images for each cell (dict with west/south/east/north).
+    Cells that do not touch `aoi_polygon` (when given) are skipped.
     Returns: list[dict] of image metadata.
     """
     results = []
@@ -120,6 +99,11 @@ def get_mapillary_images(session: requests.Session,
     url = URL
     cells = _grid_bboxes_by_meters(bbox, cell_m=cell_size_m, overlap_m=cell_overlap_m)
     #cells = cells[:5]  # LIMIT TO FIRST N CELLS FOR TESTING
+    if aoi_polygon is not None:
+        import shapely
+
+        cell_boxes = shapely.box(*np.array([[c["west"], c["south"], c["east"], c["north"]] for c in cells]).T)
+        cells = [c for c, hit in zip(cells, shapely.intersects(aoi_polygon, cell_boxes)) if hit]
 
     # [DIAGNOSTIC INFO] Check if the grid splitting is as expected
     diag_results = _diag_grid(bbox, cell_size_m)
@@ -131,13 +115,12 @@ def get_mapillary_images(session: requests.Session,
         params = base_params.copy()
         params["bbox"] = f"{cell['west']},{cell['south']},{cell['east']},{cell['north']}"
 
-        cell_qps.wait(jitter=(0.02, 0.08))
         response = session.get(url, params=params, timeout=getattr(session, "request_timeout", (5, 30)))
 
         if response.status_code == 400 and "Unsupported get request" in response.text:
             
             # Fallback (if computed_geometry not supported): use geometry field instead
-            params["fields"] = ",".join(FALLBACK_FIELDS)
+            params["fields"] = ",".join(_mapillary_cfg()["fallback_fields"])
             response = session.get(url, params=params, timeout=getattr(session, "request_timeout", (5, 30)))
     
         response.raise_for_status()
@@ -166,11 +149,12 @@ def download_thumbnails(items: list[dict],
                         manifest_repo_name: str,
                         manifest_local_name: str,
                         max_workers: int = 8,
-                        sleep_between: float = 0.02,
+                        sleep_between: float = 0.0,
                         manifest_csv: str | Path | None = None,
+                        store=None,
                         ) -> list[dict]:
     """
-    Downloads thumbnails to `out_dir`.
+    Downloads thumbnails to `out_dir`, or into `store` (an image_store.ImageStore) when given.
     Returns list of manifest(metadata) per image record and export them to a csv file.
     """
     out_dir = Path(out_dir)
@@ -178,15 +162,16 @@ def download_thumbnails(items: list[dict],
 
     rows: list[dict] = []
 
+    # Pacing is done per host by the session's rate limiter
     def task(it):
-        img_qps.wait(jitter=(0.0, 0.03))
-        row = _download_one(session, it, out_dir)
+        row = _download_one(session, it, out_dir, store=store)
         if sleep_between:
             time.sleep(sleep_between)
         return row
 
     with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        futures = [ex.submit(task, it) for it in items]
+        # Run each task in a copy of the caller's context so HTTP metrics land on the active stage
+        futures = [ex.submit(contextvars.copy_context().run, task, it) for it in items]
         for fut in as_completed(futures):
             row = fut.result()
             if not row:
@@ -198,6 +183,10 @@ def download_thumbnails(items: list[dict],
             else:
                 rows.append(row)
 
+    # Make every image written to the store readable before the manifest points at it
+    if store is not None:
+        store.flush()
+
     # Write manifest csv file for Label Studio
     if manifest_csv:
         _write_manifest_csv(rows=rows, 
@@ -256,7 +245,10 @@ def _pick_ext(resp: requests.Response, url: str) -> str:
         return ext
     return ".jpg"
 
-def _download_one(session: requests.Session, img_data: dict, out_dir: Path, timeout=(5, 60)) -> dict | list[dict] | None:
+def _download_one(session: requests.Session, img_data: dict, out_dir: Path, timeout=(5, 60), store=None) -> dict | list[dict] | None:
+    """One image → file(s) in out_dir, or members of `store` (manifest file_path is then a store ref)."""
+    import cv2
+
     iid = img_data.get("id")
     if not iid:
         return None
@@ -266,7 +258,7 @@ def _download_one(session: requests.Session, img_data: dict, out_dir: Path, time
     is_spherical = is_pano or camera_type in {"spherical", "equirectangular"}
 
     # Common metadata helpers
-    def _row(file_path: Path, extra: dict) -> dict:
+    def _row(file_path: Path | str, extra: dict) -> dict:
         lat = (img_data.get("computed_geometry") or {}).get("coordinates", [None, None])[1] \
               if img_data.get("computed_geometry") \
               else (img_data.get("geometry") or {}).get("coordinates", [None, None])[1]
@@ -339,7 +331,13 @@ def _download_one(session: requests.Session, img_data: dict, out_dir: Path, time
             try:
                 view = _equirect_to_perspective(pano, yaw_deg=yaw, pitch_deg=pitch, hfov_deg=hfov, out_w=out_w, out_h=out_h)
                 out_path = out_dir / f"{iid}_{face_name}.jpg"
-                cv2.imwrite(str(out_path), view)
+                if store is not None:
+                    ok, buf = cv2.imencode(".jpg", view)
+                    if not ok:
+                        raise ValueError("JPEG encode failed")
+                    out_path = store.put(out_path.name, buf.data)
+                else:
+                    cv2.imwrite(str(out_path), view)
                 rows.append(_row(out_path, {
                     "thumb_kind": kind,
                     "face": face_name,
@@ -368,6 +366,12 @@ def _download_one(session: requests.Session, img_data: dict, out_dir: Path, time
             kind = "2048" if (url == thumb_2048) else "1024"
             out_path = out_dir / f"{iid}_{kind}{ext}"
 
+            if store is not None:
+                if out_path.name not in store:
+                    store.put(out_path.name, resp.content)
+                resp.close()
+                return _row(store.ref(out_path.name), {"thumb_kind": kind})
+
             if out_path.exists():
                 resp.close()
                 return _row(out_path, {"thumb_kind": kind})
@@ -392,7 +396,7 @@ def _write_manifest_csv(rows: list[dict], manifest_outdir: Path, manifest_repo_n
     manifest_outdir.parent.mkdir(parents=True, exist_ok=True)
 
     # Fields for the REPO copy (no file_path)
-    repo_fields = MANIFEST_REPO_FIELDS
+    repo_fields = _mapillary_cfg()["manifest_repo_fields"]
 
     # Fields for the LOCAL copy (with file_path for annotation tools)
     local_fields = repo_fields + ["file_path"]
@@ -440,6 +444,8 @@ def _equirect_to_perspective(pano_bgr, yaw_deg=0.0, pitch_deg=0.0, hfov_deg=90.0
     hfov_deg: horizontal field of view of virtual camera
     out_w, out_h: output size
     """
+    import cv2
+
     H, W = pano_bgr.shape[:2]
     hfov = math.radians(hfov_deg)
     f = 0.5 * out_w / math.tan(hfov * 0.5)
@@ -485,23 +491,44 @@ def _equirect_to_perspective(pano_bgr, yaw_deg=0.0, pitch_deg=0.0, hfov_deg=90.0
 if __name__ == "__main__":
 
     # [IMAGE METADATA FETCH] Get Mapillary image metadata within AOI
-    session = make_session(TOKEN, timeout=(5, 30))
-    imgs = get_mapillary_images(session=session, bbox=AOI_BBOX, fields=FIELDS, per_cell_limit=PER_CELL_LIMIT, cell_size_m=CELL_SIZE_M, cell_overlap_m=CELL_OVERLAP_M)
+    mcfg = _mapillary_cfg()
+    download_workers = 4
+    session = make_session(_get_token(), timeout=(5, 30), pool_size=download_workers)
+    aoi_poly = aoi_polygon()
+    with metrics.stage("mapillary_metadata") as st:
+        imgs = get_mapillary_images(session=session, bbox=_aoi_bbox(aoi_poly), fields=mcfg["fields"], per_cell_limit=mcfg["per_cell_limit"], cell_size_m=mcfg["cell_size_m"], cell_overlap_m=mcfg["cell_overlap_m"], aoi_polygon=aoi_poly)
+        st.count(images=len(imgs))
 
     # [IMAGE DOWNLOAD] Download Mapillary images locally
-    images_outdir = REPO_ROOT / RETRIEVED_IMAGES_OUT_DIR
-    manifest_outdir = REPO_ROOT / MANIFEST_OUT_DIR
-    manifest_repo_name = MANIFEST_REPO_NAME
-    manifest_local_name = MANIFEST_LOCAL_NAME
+    images_outdir = REPO_ROOT / mcfg["images_out_dir"]
+    manifest_outdir = REPO_ROOT / mcfg["manifest_out_dir"]
+    manifest_repo_name = mcfg["manifest_repo_name"]
+    manifest_local_name = mcfg["manifest_local_name"]
 
     images_outdir.mkdir(parents=True, exist_ok=True)
     manifest_outdir.mkdir(parents=True, exist_ok=True)
 
-    download_thumbnails(imgs, 
-                        session, 
-                        out_dir=images_outdir, 
-                        manifest_repo_name=manifest_repo_name, 
-                        manifest_local_name=manifest_local_name, 
-                        max_workers=4, 
-                        manifest_csv= manifest_outdir
-                        )
\ No newline at end of file
+    # Packed shards instead of one JPEG per image when the image store is enabled
+    from pipeline.modules.image_store import ImageStore, _store_cfg
+
+    store = ImageStore() if _store_cfg()["enabled"] else None
+
+    with metrics.stage("mapillary_download") as st:
+        rows = download_thumbnails(imgs, 
+                                   session, 
+                                   out_dir=images_outdir, 
+                                   manifest_repo_name=manifest_repo_name, 
+                                   manifest_local_name=manifest_local_name, 
+                                   max_workers=download_workers, 
+                                   manifest_csv= manifest_outdir,
+                                   store=store
+                                   )
+        st.count(images=len(rows))
+    if store is not None:
+        store.close()
+
+    # [IMAGE DEDUP] Mark / drop near-duplicate frames in the manifests
+    from pipeline.modules.image_dedup import _dedup_cfg, dedup_manifest
+
+    if _dedup_cfg()["enabled"] and rows:
+        dedup_manifest(manifest_outdir)
\ No newline at end of file
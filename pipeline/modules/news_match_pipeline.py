@@ -1,25 +1,32 @@
 # news_match_pipeline.py (robust + normalized matching)
+from pathlib import Path
 import pandas as pd
 import re
 import os
 
-# === File Paths ===
-DATA_DIR = "/outputs"
-os.makedirs(DATA_DIR, exist_ok=True)
-
-rain_path = os.path.join(DATA_DIR, "rainfall_daily_features.csv")
-news_path = os.path.join(DATA_DIR, "inquirer_flood_articles.csv")
-streets_path = os.path.join(DATA_DIR, "mnl_pu_features.csv")
-output_path = os.path.join(DATA_DIR, "matched_street_floods_full.csv")
-
-# === Load Data ===
-rain_df = pd.read_csv(rain_path, parse_dates=["date"])
-news_df = pd.read_csv(news_path)
-streets_df = pd.read_csv(streets_path)
+from pipeline.config import REPO_ROOT, OUTPUT_DIR, cfg_get
+from pipeline.modules.table_io import read_table, resolve_table
 
-print(f"🌧 Rainfall days: {len(rain_df)}")
-print(f"📰 News articles: {len(news_df)}")
-print(f"🛣️ Street segments: {len(streets_df)}")
+# === File Paths ===
+def _match_paths() -> dict:
+    abbr = cfg_get("aoi", "abbr", default="mnl")
+    return {
+        "rain": REPO_ROOT / cfg_get("rainfall", "imerg", "features_csv", default="data/rainfall_daily_features.csv"),
+        "rain_grid": REPO_ROOT / cfg_get("rainfall", "imerg", "grid_file", default="data/rainfall_grid.npz"),
+        "rain_index": REPO_ROOT / cfg_get("rainfall", "imerg", "segment_index_file", default="data/rainfall_segment_cells.npz"),
+        "news": REPO_ROOT / cfg_get("rainfall", "inquirer", "articles_csv", default="pipeline/outputs/inquirer_flood_articles.csv"),
+        "streets": resolve_table(OUTPUT_DIR / f"{abbr}_pu_features", suffixes=(".parquet", ".csv")),
+        "segments": resolve_table(OUTPUT_DIR / f"{abbr}_segments", suffixes=(".parquet", ".geojson")),
+        "output": OUTPUT_DIR / "matched_street_floods_full.csv",
+    }
+
+FINAL_COLS = [
+    "date", "rain_intensity_mmday", "r_1d", "r_3d", "r_7d", "r_14d", "r_30d",
+    "segment_id", "elev_mean", "elev_min", "elev_p10", "elev_p90", "elev_max",
+    "elev_range", "elev_start", "elev_end", "grade_pct", "n_elev_pts_used",
+    "attach_method", "corridor_id", "parent_u", "parent_v", "parent_key",
+    "street_label", "highway", "lanes", "length_m", "s"
+]
 
 # === Normalize street names ===
 def normalize_name(name):
@@ -31,8 +38,6 @@ def normalize_name(name):
     name = re.sub(r'\s+', ' ', name).strip()
     return name
 
-streets_df["street_label_clean"] = streets_df["street_label"].apply(normalize_name)
-
 # === Helper: Clean possible street mentions from articles ===
 def clean_affected_text(text: str):
     text = re.sub(r"['\"\[\]\(\):]", " ", text)
@@ -46,50 +51,88 @@ def clean_affected_text(text: str):
     return tokens
 
 # === STEP 1: Extract affected street roots ===
-reported_streets = set()
-
-for _, row in news_df.iterrows():
-    affected = row.get("affected_areas", "")
-    if not isinstance(affected, str):
-        continue
-
-    affected_list = re.split(r"[,\n]+", affected)
-    cleaned = []
-    for a in affected_list:
-        tokens = clean_affected_text(a)
-        if tokens:
-            cleaned.append(" ".join(tokens))
-    reported_streets.update(cleaned)
-    print(f"📰 Cleaned affected list: {cleaned}")
-
-reported_streets = [normalize_name(s) for s in reported_streets if len(s) > 3]
-print(f"📍 Total unique reported street names (normalized): {len(reported_streets)}")
+def extract_reported_streets(news_df: pd.DataFrame, verbose: bool = True) -> list[str]:
+    reported_streets = set()
+
+    for _, row in news_df.iterrows():
+        affected = row.get("affected_areas", "")
+        if not isinstance(affected, str):
+            continue
+
+        affected_list = re.split(r"[,\n]+", affected)
+        cleaned = []
+        for a in affected_list:
+            tokens = clean_affected_text(a)
+            if tokens:
+                cleaned.append(" ".join(tokens))
+        reported_streets.update(cleaned)
+        if verbose:
+            print(f"📰 Cleaned affected list: {cleaned}")
+
+    reported_streets = [normalize_name(s) for s in reported_streets if len(s) > 3]
+    print(f"📍 Total unique reported street names (normalized): {len(reported_streets)}")
+    return reported_streets
 
 # === STEP 2: Mark segments if reported ===
-streets_df["s"] = streets_df["street_label_clean"].apply(
-    lambda st: 1 if any(rs in st for rs in reported_streets) else 0
-)
-print(f"✅ Flooded (reported) segments detected: {streets_df['s'].sum()} / {len(streets_df)}")
+def mark_reported_segments(streets_df: pd.DataFrame, reported_streets: list[str]) -> pd.DataFrame:
+    streets_df["street_label_clean"] = streets_df["street_label"].apply(normalize_name)
+    streets_df["s"] = streets_df["street_label_clean"].apply(
+        lambda st: 1 if any(rs in st for rs in reported_streets) else 0
+    )
+    print(f"✅ Flooded (reported) segments detected: {streets_df['s'].sum()} / {len(streets_df)}")
+    return streets_df
 
 # === STEP 3: Combine rainfall × streets ===
-rain_df["key"] = 1
-streets_df["key"] = 1
-final_df = pd.merge(rain_df, streets_df, on="key").drop(columns=["key"])
-
-# === STEP 4: Final formatting ===
-final_cols = [
-    "date", "rain_intensity_mmday", "r_1d", "r_3d", "r_7d", "r_14d", "r_30d",
-    "segment_id", "elev_mean", "elev_min", "elev_p10", "elev_p90", "elev_max",
-    "elev_range", "elev_start", "elev_end", "grade_pct", "n_elev_pts_used",
-    "attach_method", "corridor_id", "parent_u", "parent_v", "parent_key",
-    "street_label", "highway", "lanes", "length_m", "s"
-]
-final_df = final_df[[c for c in final_cols if c in final_df.columns]].drop_duplicates()
-
-# === STEP 5: Filter only flooded streets (s == 1) ===
-final_df = final_df[final_df["s"] == 1].reset_index(drop=True)
-
-# === STEP 6: Save output ===
-final_df.to_csv(output_path, index=False)
-print(f"✅ Final dataset saved → {output_path}")
-print(f"📊 Total rows: {len(final_df)} | Flooded segments: {final_df['s'].sum()}")
+def join_rainfall(streets_df: pd.DataFrame, rain_df: pd.DataFrame, paths: dict) -> pd.DataFrame:
+    # Per-segment gridded rainfall when the IMERG cell grid is available; AOI-wide mean otherwise
+    flooded_df = streets_df[streets_df["s"] == 1]
+    if os.path.exists(paths["rain_grid"]) and paths["segments"] is not None:
+        from pipeline.modules.rainfall_grid import (
+            load_rain_grid, load_or_build_segment_cell_index, segment_rain_features,
+        )
+
+        grid = load_rain_grid(paths["rain_grid"])
+        index = load_or_build_segment_cell_index(paths["segments"], grid, paths["rain_index"])
+        seg_rain = segment_rain_features(grid, index, segment_ids=flooded_df["segment_id"].astype(str).unique())
+        print(f"🌧 Per-segment rainfall: {len(grid.dates)} days × {grid.n_cells} IMERG cells")
+        return seg_rain.merge(
+            flooded_df.assign(segment_id=flooded_df["segment_id"].astype(str)),
+            on="segment_id", how="inner",
+        )
+
+    rain_df = rain_df.assign(key=1)
+    flooded_df = flooded_df.assign(key=1)
+    return pd.merge(rain_df, flooded_df, on="key").drop(columns=["key"])
+
+
+def main():
+    paths = _match_paths()
+
+    # === Load Data ===
+    rain_df = pd.read_csv(paths["rain"], parse_dates=["date"])
+    news_df = pd.read_csv(paths["news"])
+    streets_df = read_table(paths["streets"])
+
+    print(f"🌧 Rainfall days: {len(rain_df)}")
+    print(f"📰 News articles: {len(news_df)}")
+    print(f"🛣️ Street segments: {len(streets_df)}")
+
+    reported_streets = extract_reported_streets(news_df)
+    streets_df = mark_reported_segments(streets_df, reported_streets)
+    final_df = join_rainfall(streets_df, rain_df, paths)
+
+    # === STEP 4: Final formatting ===
+    final_df = final_df[[c for c in FINAL_COLS if c in final_df.columns]].drop_duplicates()
+
+    # === STEP 5: Filter only flooded streets (s == 1) ===
+    final_df = final_df[final_df["s"] == 1].reset_index(drop=True)
+
+    # === STEP 6: Save output ===
+    Path(paths["output"]).parent.mkdir(parents=True, exist_ok=True)
+    final_df.to_csv(paths["output"], index=False)
+    print(f"✅ Final dataset saved → {paths['output']}")
+    print(f"📊 Total rows: {len(final_df)} | Flooded segments: {final_df['s'].sum()}")
+
+
+if __name__ == "__main__":
+    main()
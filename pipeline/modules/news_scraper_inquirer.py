@@ -1,20 +1,25 @@
+from __future__ import annotations
+
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 import time
 
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium import webdriver
-from tqdm import tqdm
 import pandas as pd
 
+from pipeline.config import REPO_ROOT, OUTPUT_DIR
+from pipeline.modules.news_store import NewsStore
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.options import Options
+
 # Configs: Inquirer
 INQUIRER_SEARCH_PAGE_BASE_URL = "https://www.inquirer.net/search/?q=LIST:+Flooded&page="
 INQUIRER_PAGES_DELAY = 2
 ARTICLE_LOAD_DELAY = 1.5
+STORE_PATH = REPO_ROOT / "data" / "news" / "inquirer_articles.sqlite"
+ARTICLES_CSV = OUTPUT_DIR / "inquirer_flood_articles.csv"
+MAX_PARSE_ATTEMPTS = 3
 
 # Configs: AOI
 AOI_AREA_NAME = "Manila"
@@ -25,9 +30,20 @@ def fetch_inquirer_list_flooded_articles(
     delay_between_search_pages: float = INQUIRER_PAGES_DELAY,
     delay_per_article: float =ARTICLE_LOAD_DELAY,
     max_pages: int = 10,
-    headless: bool = True
+    headless: bool = True,
+    store_path: str | Path = STORE_PATH,
+    search_page_base_url: str = INQUIRER_SEARCH_PAGE_BASE_URL,
+    aoi_area_name: str = AOI_AREA_NAME,
 ) -> pd.DataFrame:
-    
+    """
+    Incrementally scrape Inquirer "LIST: Flooded" articles into the persistent `NewsStore`.
+
+    - Search pagination stops at the first page whose links are all already in the store
+    - Only new (or previously failed) article pages are fetched
+    - Returns every article in the store that lists the AOI, not just this run's
+    """
+    from selenium.webdriver.chrome.options import Options
+
     options = Options()
     if headless:
         options.add_argument("--headless=new")
@@ -35,20 +51,34 @@ def fetch_inquirer_list_flooded_articles(
     options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                   "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36")
 
+    store = NewsStore(store_path)
+    try:
+        _crawl_search_pages(store, options, search_page_base_url, delay_per_article, max_pages)
+        _parse_pending_articles(store, options, aoi_area_name, delay_between_search_pages, delay_per_article)
+        print(f"🗃️ Store status counts: {store.counts()}")
+        articles_df = store.to_frame(status="matched")
+    finally:
+        store.close()
+    return articles_df
+
+#  ------------- UTILITY FUNCTIONS -------------
 
-    # ---------------------------
-    #  SEARCH PAGE SCRAPING
-    # ---------------------------
+def _crawl_search_pages(store: NewsStore, options: Options, base_url: str, delay: float, max_pages: int) -> int:
+    """Record search-result links in the store; stop once a page has nothing new. Returns # new links."""
+    from selenium.webdriver.common.by import By
+    from selenium import webdriver
+
+    known = store.known_links()
+    n_new = 0
 
     search_page_driver = webdriver.Chrome(options=options)
-    collected = []
     page = 1
     try:
         print("📰 Crawling Inquirer search results (Flooded roads)...")
         while page <= max_pages:
-            url = INQUIRER_SEARCH_PAGE_BASE_URL + str(page)
+            url = base_url + str(page)
             search_page_driver.get(url)
-            time.sleep(delay_per_article)
+            time.sleep(delay)
 
             news_items = search_page_driver.find_elements(By.CSS_SELECTOR, "div.gsc-webResult.gsc-result")
             if not news_items:
@@ -57,85 +87,91 @@ def fetch_inquirer_list_flooded_articles(
                 print(f"ℹ️ No results on page {page}; stopping.")
                 break
 
-            print(f"🔎 Page {page}: {len(news_items)} items")
+            page_links = []
             for item in news_items:
                 try:
                     a = item.find_element(By.CSS_SELECTOR, "a.gs-title")
                     title = a.text.strip()
                     link = a.get_attribute("href")
-                    if link and not any(d["link"] == link for d in collected):
-                        collected.append({"title": title, "link": link})
+                    if link and link not in known:
+                        known.add(link)
+                        page_links.append((title, link))
                 except Exception:
                     continue
 
+            print(f"🔎 Page {page}: {len(news_items)} items, {len(page_links)} new")
+            if not page_links:
+                print(f"ℹ️ Page {page} holds only known links; stopping.")
+                break
+
+            n_new += store.add_links(page_links)
             page += 1
-        print(f"🛑 Stopped after page {page-1}")
+        print(f"🛑 Stopped after page {min(page, max_pages)}")
     finally:
         search_page_driver.quit()
 
-    print(f"🔎 Total article links: {len(collected)}")
-    if not collected:
-        return pd.DataFrame(columns=["title", "date", "link", "article_text"])
+    print(f"🔎 New article links: {n_new}")
+    return n_new
+
+
+def _parse_pending_articles(store: NewsStore, options: Options, aoi_area_name: str, delay_after_load: float, delay_aoi_lookup: float):
+    """Fetch every pending article page once and record its date, status and affected areas."""
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.common.by import By
+    from selenium import webdriver
+    from tqdm import tqdm
 
-    # ---------------------------
-    #  ARTICLE SCRAPING
-    # ---------------------------
+    pending = store.pending_links(max_attempts=MAX_PARSE_ATTEMPTS)
+    if not pending:
+        print("✅ No new articles to parse.")
+        return
 
     print("📝 Fetching article bodies and dates…")
 
     article_driver = webdriver.Chrome(options=options)
     wait = WebDriverWait(article_driver, 30)
-    target = AOI_AREA_NAME.strip().lower()
-    rows = []
-
-    for i, item in enumerate(tqdm(collected, desc="📖 Parsing article pages", unit="article")):
-        link = item.get("link", "")
-        title = item.get("title", "")
-
-        # print(f"\n\n> Link: {link}\n> Title: {title}\n")
-        
-        article_driver.get(link)
-        time.sleep(delay_between_search_pages)
-
-        # Fetch article publish datetime
-        datetime_meta = wait.until(EC.presence_of_element_located(
-            (By.CSS_SELECTOR, "meta[property='article:published_time']")
-        ))
-
-        date = datetime_meta.get_attribute("content")
-        date = datetime.strptime(date.rsplit(" ", 1)[0], "%a, %d %b %Y %H:%M:%S")
-        date = date.strftime("%d %b %Y") # Sample: 02 Sep 2025
-
-        # Fetch base wrapper element
-        wrapper = wait.until(EC.presence_of_element_located(
-            (By.XPATH, "//div[@id='art_body_wrap']")
-        ))
-
-        # If the AOI is detected as one of the reported city/municipality
-        try:
-            aoi_p = WebDriverWait(wrapper, delay_per_article).until(EC.presence_of_element_located(
-                (By.XPATH, f"//p[@dir='ltr' and contains(translate(normalize-space(.), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'),'{target}')]")
-            ))
-            ul = aoi_p.find_element(By.XPATH, "following-sibling::ul[1]")
-            affected_areas = ul.find_elements(By.CSS_SELECTOR, "li[dir='ltr']")
-            affected_areas = [p.text.strip() for p in affected_areas]
-
-            # Create a new record on the articles df
-            rows.append({
-                "id": i,
-                "title": title,
-                "link": link,
-                "date": date,
-                "affected_areas": affected_areas
-            })
-            
-        except TimeoutException:
-            # print(f"> [!] '{AOI_AREA_NAME}' not listed under this article.\n")
-            pass
-
-    article_driver.quit()
-    articles_df = pd.DataFrame(rows, columns=["id", "title", "link", "date", "affected_areas"])
-    return articles_df
+    target = aoi_area_name.strip().lower()
+
+    try:
+        for link, title in tqdm(pending, desc="📖 Parsing article pages", unit="article"):
+            try:
+                article_driver.get(link)
+                time.sleep(delay_after_load)
+
+                # Fetch article publish datetime
+                datetime_meta = wait.until(EC.presence_of_element_located(
+                    (By.CSS_SELECTOR, "meta[property='article:published_time']")
+                ))
+
+                date = datetime_meta.get_attribute("content")
+                date = datetime.strptime(date.rsplit(" ", 1)[0], "%a, %d %b %Y %H:%M:%S")
+
+                # Fetch base wrapper element
+                wrapper = wait.until(EC.presence_of_element_located(
+                    (By.XPATH, "//div[@id='art_body_wrap']")
+                ))
+            except Exception as e:
+                print(f"⚠️ {link}: {type(e).__name__}")
+                store.mark_parsed(link, status="error")
+                continue
+
+            # If the AOI is detected as one of the reported city/municipality
+            try:
+                aoi_p = WebDriverWait(wrapper, delay_aoi_lookup).until(EC.presence_of_element_located(
+                    (By.XPATH, f"//p[@dir='ltr' and contains(translate(normalize-space(.), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'),'{target}')]")
+                ))
+                ul = aoi_p.find_element(By.XPATH, "following-sibling::ul[1]")
+                affected_areas = ul.find_elements(By.CSS_SELECTOR, "li[dir='ltr']")
+                affected_areas = [p.text.strip() for p in affected_areas]
+
+                store.mark_parsed(link, status="matched", date=date, affected_areas=affected_areas, aoi=aoi_area_name)
+
+            except TimeoutException:
+                store.mark_parsed(link, status="no_aoi", date=date, aoi=aoi_area_name)
+    finally:
+        article_driver.quit()
 
 if __name__ == "__main__":
     articles_df = fetch_inquirer_list_flooded_articles(
@@ -145,6 +181,7 @@ if __name__ == "__main__":
         headless=True
     )
 
-    output_path = "inquirer_flood_articles.csv"
-    articles_df.to_csv(output_path, index=False, encoding="utf-8-sig")
-    print(f"✅ Exported {len(articles_df)} articles → {output_path}")
\ No newline at end of file
+    # [EXPORT] Regenerate the articles CSV from the store
+    with NewsStore(STORE_PATH) as store:
+        articles_df = store.export_csv(ARTICLES_CSV)
+    print(f"✅ Exported {len(articles_df)} articles → {ARTICLES_CSV}")
\ No newline at end of file
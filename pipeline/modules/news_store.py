@@ -0,0 +1,144 @@
+"""
+Persistent store of scraped Inquirer "LIST: Flooded" articles for SBAFN.
+
+Backed by a single SQLite file so repeated scraper runs only touch what is new:
+- every search-result link is recorded once (`link` is the primary key)
+- each article keeps its parse status, publish date and affected areas
+- the articles CSV consumed by `news_match_pipeline` is regenerated from the store
+
+Table `articles`
+    link, title, first_seen, status, attempts, date, aoi, affected_areas (JSON), parsed_at
+
+Status values
+- pending : link seen on a search page, article not fetched yet
+- matched : article lists the AOI; `affected_areas` holds the listed streets
+- no_aoi  : article parsed, AOI not listed
+- error   : fetch/parse failed; retried until `max_attempts`
+
+Usage
+    store = NewsStore(REPO_ROOT / "data" / "news" / "inquirer_articles.sqlite")
+    store.add_links([(title, link), ...])
+    for link, title in store.pending_links():
+        ...
+        store.mark_parsed(link, status="matched", date=dt, affected_areas=[...], aoi="Manila")
+    store.export_csv(OUTPUT_DIR / "inquirer_flood_articles.csv")
+"""
+from __future__ import annotations
+
+from datetime import datetime, date as date_type
+from pathlib import Path
+from typing import Iterable, Optional
+import json
+import sqlite3
+
+import pandas as pd
+
+ARTICLE_COLUMNS = ["id", "title", "link", "date", "affected_areas"]
+DATE_OUT_FORMAT = "%d %b %Y"  # Sample: 02 Sep 2025
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    link            TEXT PRIMARY KEY,
+    title           TEXT,
+    first_seen      TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'pending',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    date            TEXT,
+    aoi             TEXT,
+    affected_areas  TEXT,
+    parsed_at       TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_articles_status ON articles(status);
+"""
+
+
+class NewsStore:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ----- search pages -----
+
+    def known_links(self) -> set[str]:
+        return {r[0] for r in self.conn.execute("SELECT link FROM articles")}
+
+    def add_links(self, items: Iterable[tuple[str, str]]) -> int:
+        """Insert (title, link) pairs as `pending`; already known links are ignored. Returns # inserted."""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.conn:
+            cur = self.conn.executemany(
+                "INSERT OR IGNORE INTO articles (link, title, first_seen) VALUES (?, ?, ?)",
+                [(link, title, now) for title, link in items if link],
+            )
+        return cur.rowcount
+
+    # ----- article pages -----
+
+    def pending_links(self, max_attempts: int = 3) -> list[tuple[str, str]]:
+        """Links that still need fetching: new ones plus failed ones under the retry cap, oldest first."""
+        rows = self.conn.execute(
+            "SELECT link, title FROM articles "
+            "WHERE status = 'pending' OR (status = 'error' AND attempts < ?) "
+            "ORDER BY rowid",
+            (max_attempts,),
+        )
+        return list(rows)
+
+    def mark_parsed(
+        self,
+        link: str,
+        status: str,
+        date: Optional[date_type] = None,
+        affected_areas: Optional[list[str]] = None,
+        aoi: Optional[str] = None,
+    ):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE articles SET status = ?, attempts = attempts + 1, date = ?, aoi = ?, "
+                "affected_areas = ?, parsed_at = ? WHERE link = ?",
+                (
+                    status,
+                    date.strftime("%Y-%m-%d") if date else None,
+                    aoi,
+                    json.dumps(affected_areas, ensure_ascii=False) if affected_areas is not None else None,
+                    datetime.now().isoformat(timespec="seconds"),
+                    link,
+                ),
+            )
+
+    # ----- export -----
+
+    def counts(self) -> dict[str, int]:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM articles GROUP BY status"))
+
+    def to_frame(self, status: str = "matched") -> pd.DataFrame:
+        """Articles with the given status in the scraper's output layout (`id, title, link, date, affected_areas`)."""
+        df = pd.read_sql_query(
+            "SELECT rowid AS id, title, link, date, affected_areas FROM articles "
+            "WHERE status = ? ORDER BY date, rowid",
+            self.conn,
+            params=(status,),
+        )
+        if df.empty:
+            return pd.DataFrame(columns=ARTICLE_COLUMNS)
+        df["date"] = pd.to_datetime(df["date"]).dt.strftime(DATE_OUT_FORMAT)
+        df["affected_areas"] = df["affected_areas"].apply(lambda s: json.loads(s) if s else [])
+        return df[ARTICLE_COLUMNS]
+
+    def export_csv(self, out_csv: str | Path, status: str = "matched") -> pd.DataFrame:
+        out_csv = Path(out_csv)
+        out_csv.parent.mkdir(parents=True, exist_ok=True)
+        df = self.to_frame(status=status)
+        df.to_csv(out_csv, index=False, encoding="utf-8-sig")
+        return df
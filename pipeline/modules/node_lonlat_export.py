@@ -15,13 +15,15 @@ Usage in your pipeline (after you build `segments`):
     from segment_lonlat_export import export_segment_lonlat
     export_segment_lonlat(
         segments_gdf=segments, 
-        out_csv=OUTPUT_DIR / f"{TARGET_ABBR}_segments_lonlat.csv",
+        out_csv=OUTPUT_DIR / f"{TARGET_ABBR}_segments_lonlat.csv",        # optional sink
         also_parquet=OUTPUT_DIR / f"{TARGET_ABBR}_segments_lonlat.parquet"
     )
 
 Notes
 - Assumes `segments` is in EPSG:4326 for lon/lat output. If not, we reproject.
+- A SegmentTable is handled column-wise from its cached WGS84 vertices (no per-row loop).
 - If a geometry is MultiLineString (rare for segments), we use the longest LineString part.
+- Parquet write errors are raised, not swallowed (Parquet is the pipeline's interchange format).
 - Centroid of a LineString is safe enough for mid-location; for along-the-line measures later we’ll store an `along_frac` value per detection.
 """
 from __future__ import annotations
@@ -30,8 +32,13 @@ from pathlib import Path
 from typing import Optional
 
 import geopandas as gpd
+import pandas as pd
+import shapely
 from shapely.geometry import LineString, MultiLineString
 
+from pipeline.modules.segment_table import SegmentTable
+from pipeline.modules.table_io import write_table
+
 
 def _ensure_linestring(geom):
     if isinstance(geom, LineString):
@@ -45,12 +52,35 @@ def _ensure_linestring(geom):
     return None
 
 
+def _table_lonlat(table: SegmentTable) -> pd.DataFrame:
+    """Vectorized endpoints + centroid from the table's (lazily cached) WGS84 vertices."""
+    start, end = table.endpoints(4326)
+    cen = shapely.get_coordinates(shapely.centroid(table.geometry(4326)))
+    out = pd.DataFrame({"segment_id": table.segment_ids()})
+    if table.corridor_id is not None:
+        out["corridor_id"] = table.corridor_id
+    out["street_label"] = table.street_label
+    out["length_m"] = table.length_m
+    out["start_lon"], out["start_lat"] = start[:, 0], start[:, 1]
+    out["end_lon"], out["end_lat"] = end[:, 0], end[:, 1]
+    out["centroid_lon"], out["centroid_lat"] = cen[:, 0], cen[:, 1]
+    return out
+
+
 def export_segment_lonlat(
-    segments_gdf: gpd.GeoDataFrame,
+    segments_gdf: gpd.GeoDataFrame | SegmentTable,
     out_csv: Optional[Path] = None,
     also_parquet: Optional[Path] = None,
-) -> gpd.GeoDataFrame:
+) -> pd.DataFrame:
     """Return a DataFrame of segment endpoints + centroid lon/lat and optionally save it."""
+    if isinstance(segments_gdf, SegmentTable):
+        out = _table_lonlat(segments_gdf)
+        if out_csv is not None:
+            out.to_csv(out_csv, index=False)
+        if also_parquet is not None:
+            write_table(out, also_parquet)
+        return out
+
     if segments_gdf.crs is None or segments_gdf.crs.to_epsg() != 4326:
         seg_wgs = segments_gdf.to_crs(4326)
     else:
@@ -90,10 +120,7 @@ def export_segment_lonlat(
         out.to_csv(out_csv, index=False)
 
     if also_parquet is not None:
-        try:
-            out.to_parquet(also_parquet, index=False)
-        except Exception:
-            pass
+        write_table(out, also_parquet)
 
     return out
 
@@ -0,0 +1,243 @@
+"""
+Offline drive-network ingestion from a local OpenStreetMap .osm.pbf extract.
+
+Inputs
+- pbf_path: local extract (e.g. Geofabrik philippines-latest.osm.pbf), config `osm.pbf_path`
+- polygon: AOI polygon in WGS84; edges with at least one end node inside are kept (osmnx truncate_by_edge)
+
+Outputs
+- nodes, edges GeoDataFrames shaped like `osmnx.graph_to_gdfs(G)` for a simplified drive graph:
+    nodes: index osmid; columns y, x, street_count, geometry
+    edges: index (u, v, key); columns osmid, highway, name, ref, lanes, maxspeed, oneway,
+           reversed, length, geometry
+- cached GeoParquet pair under `osm.cache_dir`, keyed by pbf (name, size, mtime), AOI and filter
+
+Method
+1) Stream the pbf once with pyosmium (node locations resolved in-memory), keep ways matching the
+   osmnx "drive" filter whose bbox touches the AOI.
+2) Drop ways with no node inside the AOI polygon (vectorized point-in-polygon).
+3) Split ways at intersections / way ends (nodes shared by 2+ way positions) → simplified edges,
+   then drop edges whose end nodes are both outside the AOI.
+4) Two-way streets get both directions, one-way streets follow `oneway` (-1 reverses).
+
+Usage
+    from pipeline.modules.osm_extract import graph_gdfs_from_pbf
+    nodes, edges = graph_gdfs_from_pbf("data/osm/philippines-latest.osm.pbf", aoi_polygon)
+
+Notes
+- No network access: Nominatim/Overpass are not touched.
+- Lengths are great-circle metres, as in osmnx.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import REPO_ROOT, cfg_get
+
+FILTER_VERSION = "drive-v1"
+EARTH_RADIUS_M = 6_371_009.0
+
+# osmnx network_type="drive" exclusions
+EXCLUDED_HIGHWAY = {
+    "abandoned", "bridleway", "bus_guideway", "construction", "corridor", "cycleway", "elevator",
+    "escalator", "footway", "no", "path", "pedestrian", "planned", "platform", "proposed",
+    "raceway", "razed", "service", "steps", "track",
+}
+EXCLUDED_SERVICE = {"alley", "driveway", "emergency_access", "parking", "parking_aisle", "private"}
+EDGE_TAGS = ("highway", "name", "ref", "lanes", "maxspeed")
+ONEWAY_FORWARD = {"yes", "true", "1"}
+ONEWAY_REVERSE = {"-1", "reverse"}
+
+# ---------------------------------
+
+def _osm_cfg() -> dict:
+    return {
+        "pbf_path": cfg_get("osm", "pbf_path", default=None),
+        "cache_dir": REPO_ROOT / cfg_get("osm", "cache_dir", default="data/osm/cache"),
+    }
+
+
+def is_drivable(tags) -> bool:
+    hw = tags.get("highway")
+    if hw is None or hw in EXCLUDED_HIGHWAY:
+        return False
+    if tags.get("area") == "yes" or tags.get("access") == "private":
+        return False
+    if tags.get("motor_vehicle") == "no" or tags.get("motorcar") == "no":
+        return False
+    return tags.get("service") not in EXCLUDED_SERVICE
+
+
+def read_drive_ways(pbf_path: str | Path, bounds: tuple[float, float, float, float]):
+    """
+    Stream drivable ways whose bbox intersects `bounds`.
+    Returns a list of (way_id, tags dict, node_ids, lon, lat) with one ndarray per node column.
+    """
+    import osmium
+
+    west, south, east, north = bounds
+
+    class _DriveWays(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.ways = []
+
+        def way(self, w):
+            if not is_drivable(w.tags):
+                return
+            try:
+                refs = np.fromiter((n.ref for n in w.nodes), dtype=np.int64, count=len(w.nodes))
+                lon = np.fromiter((n.lon for n in w.nodes), dtype=np.float64, count=len(w.nodes))
+                lat = np.fromiter((n.lat for n in w.nodes), dtype=np.float64, count=len(w.nodes))
+            except osmium.InvalidLocationError:   # clipped extract: node outside the file
+                return
+            if len(refs) < 2 or lon.max() < west or lon.min() > east or lat.max() < south or lat.min() > north:
+                return
+            tags = {k: w.tags.get(k) for k in (*EDGE_TAGS, "oneway")}
+            self.ways.append((w.id, tags, refs, lon, lat))
+
+    h = _DriveWays()
+    h.apply_file(str(pbf_path), locations=True)
+    return h.ways
+
+
+def _haversine_m(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _keep_in_polygon(ways, polygon):
+    """Ways with at least one node inside the AOI polygon."""
+    import shapely
+
+    if polygon is None or not ways:
+        return ways
+    sizes = np.array([len(w[2]) for w in ways])
+    inside = shapely.contains_xy(polygon, np.concatenate([w[3] for w in ways]), np.concatenate([w[4] for w in ways]))
+    any_inside = np.logical_or.reduceat(inside, np.r_[0, np.cumsum(sizes)[:-1]])
+    return [w for w, keep in zip(ways, any_inside) if keep]
+
+
+def build_graph_gdfs(ways, polygon=None):
+    """Simplified nodes/edges GeoDataFrames (osmnx layout) from drivable ways."""
+    import geopandas as gpd
+    import shapely
+
+    # A node ends an edge if it's a way end or shared by more than one way position
+    occurrences = defaultdict(int)
+    coords = {}
+    for _, _, refs, lon, lat in ways:
+        for r, x, y in zip(refs.tolist(), lon.tolist(), lat.tolist()):
+            occurrences[r] += 1
+            coords[r] = (x, y)
+        occurrences[int(refs[0])] += 1      # way ends always split
+        occurrences[int(refs[-1])] += 1
+
+    rows = []
+    for way_id, tags, refs, lon, lat in ways:
+        breaks = [i for i, r in enumerate(refs.tolist()) if occurrences[r] > 1]
+        oneway = str(tags.get("oneway") or "no").lower()
+        for a, b in zip(breaks[:-1], breaks[1:]):
+            seg_lon, seg_lat = lon[a:b + 1], lat[a:b + 1]
+            length = float(_haversine_m(seg_lon[:-1], seg_lat[:-1], seg_lon[1:], seg_lat[1:]).sum())
+            base = {"osmid": way_id, **{k: tags.get(k) for k in EDGE_TAGS}, "length": length}
+            u, v = int(refs[a]), int(refs[b])
+            xy = np.column_stack([seg_lon, seg_lat])
+            if oneway in ONEWAY_REVERSE:
+                rows.append({**base, "u": v, "v": u, "oneway": True, "reversed": True, "xy": xy[::-1]})
+            elif oneway in ONEWAY_FORWARD:
+                rows.append({**base, "u": u, "v": v, "oneway": True, "reversed": False, "xy": xy})
+            else:
+                rows.append({**base, "u": u, "v": v, "oneway": False, "reversed": False, "xy": xy})
+                rows.append({**base, "u": v, "v": u, "oneway": False, "reversed": True, "xy": xy[::-1]})
+
+    edges = pd.DataFrame(rows)
+    if not edges.empty and polygon is not None:
+        end_xy = np.array([coords[n] for n in edges["u"].tolist() + edges["v"].tolist()])
+        inside = shapely.contains_xy(polygon, end_xy[:, 0], end_xy[:, 1]).reshape(2, -1)
+        edges = edges[inside.any(axis=0)].reset_index(drop=True)
+    if edges.empty:
+        raise ValueError("No drivable OSM ways inside the AOI")
+    edges["key"] = edges.groupby(["u", "v"]).cumcount()
+    xy_parts = edges.pop("xy").tolist()
+    geometry = shapely.linestrings(
+        np.concatenate(xy_parts), indices=np.repeat(np.arange(len(xy_parts)), [len(a) for a in xy_parts])
+    )
+    edges = gpd.GeoDataFrame(edges, geometry=geometry, crs=4326).set_index(["u", "v", "key"])
+
+    # street_count: physical streets per node (undirected, parallel streets counted once per way edge)
+    und = edges.reset_index()
+    und = und[~und["reversed"] | und["oneway"]]
+    ends = np.concatenate([und["u"].to_numpy(), und["v"].to_numpy()])
+    node_ids, counts = np.unique(ends, return_counts=True)
+    xy = np.array([coords[n] for n in node_ids.tolist()])
+    nodes = gpd.GeoDataFrame(
+        {"y": xy[:, 1], "x": xy[:, 0], "street_count": counts},
+        index=pd.Index(node_ids, name="osmid"),
+        geometry=shapely.points(xy),
+        crs=4326,
+    )
+    return nodes, edges
+
+#  ------------- CACHE -------------
+
+def cache_key(pbf_path: str | Path, polygon) -> str:
+    st = Path(pbf_path).stat()
+    h = hashlib.sha1()
+    h.update(f"{Path(pbf_path).name}|{st.st_size}|{st.st_mtime_ns}|{FILTER_VERSION}".encode())
+    if polygon is not None:
+        h.update(polygon.wkb)
+    return h.hexdigest()[:16]
+
+
+def graph_gdfs_from_pbf(
+    pbf_path: str | Path,
+    polygon=None,
+    cache_dir: Optional[Path] = None,
+    use_cache: bool = True,
+):
+    """nodes, edges for the AOI, from the Parquet cache when the pbf and AOI are unchanged."""
+    from pipeline.modules.table_io import read_table, write_table
+
+    pbf_path = Path(pbf_path)
+    cache_dir = Path(cache_dir or _osm_cfg()["cache_dir"])
+    key = cache_key(pbf_path, polygon)
+    nodes_path = cache_dir / f"drive_{key}_nodes.parquet"
+    edges_path = cache_dir / f"drive_{key}_edges.parquet"
+
+    if use_cache and nodes_path.exists() and edges_path.exists():
+        print(f"[osm] cached drive graph {key}")
+        return (
+            read_table(nodes_path).set_index("osmid"),
+            read_table(edges_path).set_index(["u", "v", "key"]),
+        )
+
+    bounds = tuple(polygon.bounds) if polygon is not None else (-180.0, -90.0, 180.0, 90.0)
+    ways = _keep_in_polygon(read_drive_ways(pbf_path, bounds), polygon)
+    nodes, edges = build_graph_gdfs(ways, polygon)
+    print(f"[osm] {pbf_path.name}: {len(ways):,} ways → {len(nodes):,} nodes | {len(edges):,} edges")
+
+    write_table(nodes.reset_index(), nodes_path)
+    write_table(edges.reset_index(), edges_path)
+    return nodes, edges
+
+
+if __name__ == "__main__":
+    from shapely.geometry import box
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--pbf", type=Path, default=None)
+    p.add_argument("--no_cache", action="store_true")
+    args = p.parse_args()
+
+    bbox = cfg_get("aoi", "bbox", default={})
+    aoi = box(bbox["west"], bbox["south"], bbox["east"], bbox["north"])
+    graph_gdfs_from_pbf(args.pbf or REPO_ROOT / _osm_cfg()["pbf_path"], aoi, use_cache=not args.no_cache)
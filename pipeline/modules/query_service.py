@@ -0,0 +1,511 @@
+"""
+Local HTTP query service over SBAFN segment outputs (risk + features), served from memory.
+
+Inputs (local files only)
+- {abbr}_segments.parquet:    segment_id, corridor_id, street_label, ..., geometry
+- {abbr}_pu_features.parquet: elevation features (optional)
+- {abbr}_risk.parquet:        risk_score, risk_band, rain_threshold_mmhr, drivers_* (optional)
+
+Endpoints (GET, JSON)
+- /segments?bbox=west,south,east,north
+- /segments?lon=..&lat=..&radius_m=..       nearest first
+- /segments?corridor_id=..
+- /segments?street=..                       normalized name; substring fallback
+  Selectors combine (intersection). Also: band=high,med  limit  offset  format=json|geojson
+- /segments/{segment_id}
+- /flooded?rain_mmhr=..[&level=corridor_id&group=..][&ids=1]   from {abbr}_threshold_index.bin
+- /flooded/summary?rain_mmhr=..&level=corridor_id            count / length for every group
+- /stats    request count, cache hit ratio, p50/p99 latency (ms)
+- /health
+
+Method
+1) Load once; geometry is projected to the metric CRS and indexed in a shapely STRtree. Street
+   names (normalized like news matching) and corridor ids map to row-index arrays.
+2) Per-row property JSON (and GeoJSON geometry, on first use) is rendered once at load, so a
+   response is a string join over the selected page.
+3) Bodies are kept in an LRU keyed by the canonical query, and compressed (br when the brotli
+   package is installed, else gzip) once per encoding.
+4) Pages are `limit` rows from `offset`; responses carry total and next_offset.
+5) Server-side latency goes to a rolling window and is reported on /stats and at shutdown.
+
+Usage
+    python -m pipeline.modules.query_service                         # serve config `service`
+    curl 'http://127.0.0.1:8765/segments?lon=120.99&lat=14.6&radius_m=300&limit=20'
+    python -m pipeline.modules.query_service --loadtest 20000 --concurrency 16
+
+Notes
+- ThreadingHTTPServer with HTTP/1.1 keep-alive; CORS is open for the Flutter web build.
+- The service is read-only; restart it to pick up new pipeline outputs.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import OUTPUT_DIR, cfg_get
+from pipeline import metrics
+
+# ---------------------------------
+
+def _service_cfg() -> dict:
+    return {
+        "host": cfg_get("service", "host", default="127.0.0.1"),
+        "port": int(cfg_get("service", "port", default=8765)),
+        "cache_entries": int(cfg_get("service", "cache_entries", default=4096)),
+        "page_size": int(cfg_get("service", "page_size", default=100)),
+        "max_page_size": int(cfg_get("service", "max_page_size", default=1000)),
+        "gzip_level": int(cfg_get("service", "gzip_level", default=5)),
+        "min_compress_bytes": int(cfg_get("service", "min_compress_bytes", default=1024)),
+        "latency_window": int(cfg_get("service", "latency_window", default=10_000)),
+    }
+
+
+class QueryError(ValueError):
+    """Bad query parameters (→ HTTP 400)."""
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            val = self._data.get(key)
+            if val is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return val
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class LatencyWindow:
+    """Rolling window of request latencies (seconds)."""
+
+    def __init__(self, size: int = 10_000):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+            self.count += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            vals = np.fromiter(self._values, dtype=float)
+        if not len(vals):
+            return {"requests": self.count, "p50_ms": None, "p99_ms": None}
+        p50, p99 = np.percentile(vals, [50, 99]) * 1000
+        return {"requests": self.count, "p50_ms": round(float(p50), 3), "p99_ms": round(float(p99), 3),
+                "max_ms": round(float(vals.max()) * 1000, 3)}
+
+#  ------------- INDEX -------------
+
+class SegmentIndex:
+    """In-memory segment table with spatial, corridor and street-name lookups."""
+
+    def __init__(self, segments, attrs: pd.DataFrame):
+        import shapely
+        from pyproj import Transformer
+        from pipeline.modules.segment_table import pick_metric_crs
+        from pipeline.modules.news_match_pipeline import normalize_name
+
+        segments = segments.to_crs(4326).reset_index(drop=True)
+        self.crs = pick_metric_crs(segments)
+        self._to_metric = Transformer.from_crs(4326, self.crs, always_xy=True)
+        self.geometry_wgs84 = segments.geometry.to_numpy()
+        self.geometry = segments.to_crs(self.crs).geometry.to_numpy()
+        self.tree = shapely.STRtree(self.geometry)
+
+        self.ids = attrs["segment_id"].astype(str).to_numpy()
+        self.row_of_id = pd.Index(self.ids)
+        # One JSON object per row; NaN → null, dict/list columns kept nested
+        self.props = attrs.to_json(orient="records", lines=True, force_ascii=False, double_precision=4).splitlines()
+        self._geojson: Optional[np.ndarray] = None
+        self._geojson_lock = threading.Lock()
+
+        self.band = attrs["risk_band"].astype(str).to_numpy() if "risk_band" in attrs.columns else None
+        self.corridors = self._groups(attrs["corridor_id"]) if "corridor_id" in attrs.columns else {}
+        labels = attrs["street_label"] if "street_label" in attrs.columns else pd.Series([""] * len(attrs))
+        self.names = self._groups(labels.astype(str).map(normalize_name))
+        self._normalize = normalize_name
+
+    @staticmethod
+    def _groups(values: pd.Series) -> dict[str, np.ndarray]:
+        return {str(k): np.sort(v) for k, v in values.groupby(values, sort=False).indices.items() if str(k)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_outputs(cls, abbr: str, outdir: Path = OUTPUT_DIR) -> "SegmentIndex":
+        from pipeline.modules.table_io import read_table, resolve_table
+
+        seg_path = resolve_table(outdir / f"{abbr}_segments", suffixes=(".parquet", ".geojson"))
+        if seg_path is None:
+            raise FileNotFoundError(f"no {abbr}_segments table under {outdir}; run the pipeline first")
+        segments = read_table(seg_path)
+        attrs = pd.DataFrame(segments.drop(columns="geometry"))
+        for stem in (f"{abbr}_pu_features", f"{abbr}_risk"):
+            path = resolve_table(outdir / stem, suffixes=(".parquet", ".csv"))
+            if path is None:
+                print(f"[service] {stem} not found; serving without it")
+                continue
+            extra = read_table(path)
+            extra = extra[["segment_id"] + [c for c in extra.columns if c not in attrs.columns]]
+            attrs = attrs.merge(extra, on="segment_id", how="left")
+        return cls(segments, attrs)
+
+    # ----- selectors (each returns sorted-or-ranked row positions) -----
+
+    def bbox(self, west: float, south: float, east: float, north: float) -> np.ndarray:
+        import shapely
+
+        box = shapely.segmentize(shapely.box(west, south, east, north), max(east - west, north - south) / 16)
+        box = shapely.transform(box, lambda xy: np.column_stack(self._to_metric.transform(xy[:, 0], xy[:, 1])))
+        return np.sort(self.tree.query(box, predicate="intersects"))
+
+    def radius(self, lon: float, lat: float, radius_m: float) -> np.ndarray:
+        import shapely
+
+        pt = shapely.Point(*self._to_metric.transform(lon, lat))
+        rows = self.tree.query(pt, predicate="dwithin", distance=radius_m)
+        return rows[np.argsort(shapely.distance(self.geometry[rows], pt), kind="stable")]
+
+    def corridor(self, corridor_id: str) -> np.ndarray:
+        return self.corridors.get(str(corridor_id), np.empty(0, dtype=np.intp))
+
+    def street(self, name: str) -> np.ndarray:
+        key = self._normalize(name)
+        if not key:
+            return np.empty(0, dtype=np.intp)
+        if key in self.names:
+            return self.names[key]
+        hits = [rows for k, rows in self.names.items() if key in k]
+        return np.sort(np.concatenate(hits)) if hits else np.empty(0, dtype=np.intp)
+
+    def geojson(self) -> np.ndarray:
+        """GeoJSON geometry strings (WGS84), rendered for all rows on first use."""
+        if self._geojson is None:
+            import shapely
+
+            with self._geojson_lock:
+                if self._geojson is None:
+                    self._geojson = shapely.to_geojson(self.geometry_wgs84)
+        return self._geojson
+
+    # ----- queries -----
+
+    def select(self, params: dict) -> np.ndarray:
+        sel = []
+        try:
+            if "bbox" in params:
+                parts = [float(v) for v in params["bbox"].split(",")]
+                if len(parts) != 4:
+                    raise QueryError("bbox must be west,south,east,north")
+                sel.append(self.bbox(*parts))
+            if "lon" in params or "lat" in params:
+                sel.append(self.radius(float(params["lon"]), float(params["lat"]), float(params.get("radius_m", 100))))
+        except (KeyError, ValueError) as e:
+            if isinstance(e, QueryError):
+                raise
+            raise QueryError(f"bad spatial parameters: {e}") from None
+        if "corridor_id" in params:
+            sel.append(self.corridor(params["corridor_id"]))
+        if "street" in params:
+            sel.append(self.street(params["street"]))
+        if not sel:
+            raise QueryError("give bbox, lon/lat[/radius_m], corridor_id or street")
+
+        rows = sel[0]
+        for other in sel[1:]:
+            rows = rows[np.isin(rows, other)]
+        if "band" in params and self.band is not None:
+            rows = rows[np.isin(self.band[rows], params["band"].split(","))]
+        return rows
+
+    def render(self, rows: np.ndarray, offset: int, limit: int, fmt: str = "json") -> bytes:
+        page = rows[offset:offset + limit]
+        total = len(rows)
+        nxt = offset + limit if offset + limit < total else None
+        head = f'"total":{total},"offset":{offset},"limit":{limit},"next_offset":{json.dumps(nxt)}'
+        if fmt == "geojson":
+            geoms = self.geojson()
+            feats = ",".join(f'{{"type":"Feature","geometry":{geoms[i]},"properties":{self.props[i]}}}' for i in page)
+            body = f'{{"type":"FeatureCollection",{head},"features":[{feats}]}}'
+        else:
+            body = f'{{{head},"segments":[{",".join(self.props[i] for i in page)}]}}'
+        return body.encode("utf-8")
+
+#  ------------- HTTP -------------
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 5) -> bytes:
+    if encoding == "br":
+        return _brotli().compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    return body
+
+
+class QueryService:
+    """Query parsing, caching, compression and latency accounting (transport-agnostic)."""
+
+    def __init__(self, index: SegmentIndex, cfg: Optional[dict] = None, thresholds=None):
+        self.index = index
+        self.thresholds = thresholds        # threshold_index.ThresholdIndex, for /flooded
+        self.cfg = cfg or _service_cfg()
+        self.cache = LRUCache(self.cfg["cache_entries"])
+        self.latency = LatencyWindow(self.cfg["latency_window"])
+        self.encodings = ("br", "gzip") if _brotli() is not None else ("gzip",)
+
+    def negotiate(self, accept_encoding: str) -> str:
+        offered = {p.split(";")[0].strip() for p in (accept_encoding or "").split(",")}
+        return next((e for e in self.encodings if e in offered), "identity")
+
+    def _flooded(self, path: str, params: dict) -> bytes:
+        if self.thresholds is None:
+            raise LookupError("threshold index not built")
+        try:
+            rain = float(params["rain_mmhr"])
+        except (KeyError, ValueError):
+            raise QueryError("rain_mmhr is required (number)") from None
+        level = params.get("level", "aoi")
+        try:
+            if path == "/flooded/summary":
+                df = self.thresholds.summary(rain, level=level)
+                return json.dumps({"level": level, "rain_mmhr": rain, "groups": df.to_dict(orient="records")}).encode()
+            res = self.thresholds.query(rain, level=level, group=params.get("group"), ids=params.get("ids") == "1")
+        except (KeyError, ValueError) as e:
+            raise QueryError(str(e.args[0])) from None
+        return json.dumps(res).encode()
+
+    def _query(self, path: str, params: dict) -> bytes:
+        if path.startswith("/flooded"):
+            return self._flooded(path, params)
+        if path.startswith("/segments/"):
+            seg_id = unquote(path[len("/segments/"):])
+            pos = self.index.row_of_id.get_indexer([seg_id])[0]
+            if pos < 0:
+                raise LookupError(seg_id)
+            return self.index.render(np.array([pos]), 0, 1, params.get("format", "json"))
+        try:
+            limit = min(int(params.get("limit", self.cfg["page_size"])), self.cfg["max_page_size"])
+            offset = max(int(params.get("offset", 0)), 0)
+        except ValueError:
+            raise QueryError("limit/offset must be integers") from None
+        if limit < 1:
+            raise QueryError("limit must be ≥ 1")
+        rows = self.index.select(params)
+        return self.index.render(rows, offset, limit, params.get("format", "json"))
+
+    def handle(self, target: str, accept_encoding: str = "") -> tuple[int, bytes, str]:
+        """(status, body, content-encoding) for a GET request target."""
+        parts = urlsplit(target)
+        path = parts.path.rstrip("/") or "/"
+        if path == "/health":
+            return 200, b'{"status":"ok"}', "identity"
+        if path == "/stats":
+            return 200, json.dumps(self.stats()).encode(), "identity"
+        if path not in ("/segments", "/flooded", "/flooded/summary") and not path.startswith("/segments/"):
+            return 404, b'{"error":"not found"}', "identity"
+
+        params = dict(parse_qsl(parts.query))
+        key = (path, tuple(sorted(params.items())))
+        entry = self.cache.get(key)
+        if entry is None:
+            try:
+                body = self._query(path, params)
+            except QueryError as e:
+                return 400, json.dumps({"error": str(e)}).encode(), "identity"
+            except LookupError as e:
+                return 404, json.dumps({"error": f"not found: {e.args[0]}"}).encode(), "identity"
+            entry = {"identity": body}
+            self.cache.put(key, entry)
+
+        encoding = self.negotiate(accept_encoding)
+        if len(entry["identity"]) < self.cfg["min_compress_bytes"]:
+            encoding = "identity"
+        body = entry.get(encoding)
+        if body is None:
+            body = entry[encoding] = compress(entry["identity"], encoding, self.cfg["gzip_level"])
+        return 200, body, encoding
+
+    def stats(self) -> dict:
+        lookups = self.cache.hits + self.cache.misses
+        return {
+            "segments": len(self.index),
+            **self.latency.summary(),
+            "cache_entries": len(self.cache),
+            "cache_hit_ratio": round(self.cache.hits / lookups, 4) if lookups else None,
+        }
+
+
+def _handler_class(service: QueryService, verbose: bool = False):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"      # keep-alive
+        disable_nagle_algorithm = True     # headers and body go out as separate writes
+        server_version = "sbafn-query/0.1"
+
+        def do_GET(self):
+            t0 = time.perf_counter()
+            status, body, encoding = service.handle(self.path, self.headers.get("Accept-Encoding", ""))
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Vary", "Accept-Encoding")
+            if encoding != "identity":
+                self.send_header("Content-Encoding", encoding)
+            self.end_headers()
+            self.wfile.write(body)
+            service.latency.add(time.perf_counter() - t0)
+
+        def log_message(self, fmt, *args):
+            if verbose:
+                super().log_message(fmt, *args)
+
+    return Handler
+
+
+def make_server(index: SegmentIndex, host: Optional[str] = None, port: Optional[int] = None,
+                verbose: bool = False, thresholds=None) -> tuple[ThreadingHTTPServer, QueryService]:
+    cfg = _service_cfg()
+    service = QueryService(index, cfg, thresholds)
+    server = ThreadingHTTPServer((host or cfg["host"], cfg["port"] if port is None else port),
+                                 _handler_class(service, verbose))
+    server.daemon_threads = True
+    return server, service
+
+
+def serve(abbr: str, host: Optional[str] = None, port: Optional[int] = None, verbose: bool = False,
+          outdir: Path = OUTPUT_DIR) -> None:
+    with metrics.stage("service_load", aoi=abbr) as st:
+        index = SegmentIndex.from_outputs(abbr, outdir)
+        st.count(segments=len(index))
+    thresholds = None
+    if (outdir / f"{abbr}_threshold_index.bin").exists():
+        from pipeline.modules.threshold_index import ThresholdIndex
+
+        thresholds = ThresholdIndex.load(outdir / f"{abbr}_threshold_index.bin")
+    server, service = make_server(index, host, port, verbose, thresholds)
+    print(f"🛰 [service] {len(index):,} segments on http://{server.server_address[0]}:{server.server_address[1]}")
+    with metrics.stage("service", aoi=abbr) as st:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            stats = service.stats()
+            st.count(requests=stats["requests"], cache_hits=service.cache.hits)
+            print(f"[service] {stats}")
+
+#  ------------- LOAD TEST -------------
+
+def sample_queries(index: SegmentIndex, n: int = 1000, seed: int = 0) -> list[str]:
+    """Mixed bbox / radius / corridor / street query targets drawn from the served segments."""
+    import shapely
+    from urllib.parse import quote_plus
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(index), n)
+    pts = shapely.get_coordinates(shapely.centroid(index.geometry_wgs84[rows]))
+    corridors = list(index.corridors) or [""]
+    names = list(index.names) or [""]
+    out = []
+    for k, (lon, lat) in enumerate(pts):
+        kind = k % 4
+        if kind == 0:
+            d = 0.002
+            out.append(f"/segments?bbox={lon - d:.5f},{lat - d:.5f},{lon + d:.5f},{lat + d:.5f}&limit=50")
+        elif kind == 1:
+            out.append(f"/segments?lon={lon:.5f}&lat={lat:.5f}&radius_m=200&limit=50")
+        elif kind == 2:
+            out.append(f"/segments?corridor_id={quote_plus(corridors[rng.integers(len(corridors))])}")
+        else:
+            out.append(f"/segments?street={quote_plus(names[rng.integers(len(names))])}")
+    return out
+
+
+def loadtest(host: str, port: int, targets: list[str], n_requests: int, concurrency: int = 16) -> dict:
+    """Client-side QPS and p50/p99 over keep-alive connections."""
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+
+    def worker(k: int) -> list[float]:
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        lat = []
+        for i in range(k, n_requests, concurrency):
+            t0 = time.perf_counter()
+            conn.request("GET", targets[i % len(targets)], headers={"Accept-Encoding": "gzip, br"})
+            resp = conn.getresponse()
+            resp.read()
+            lat.append(time.perf_counter() - t0)
+        conn.close()
+        return lat
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        lat = np.concatenate([np.asarray(x) for x in pool.map(worker, range(concurrency))])
+    wall = time.perf_counter() - t0
+    p50, p99 = np.percentile(lat, [50, 99]) * 1000
+    return {"requests": len(lat), "qps": round(len(lat) / wall, 1), "p50_ms": round(float(p50), 3),
+            "p99_ms": round(float(p99), 3)}
+
+#  ------------- ENTRY POINT -------------
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--abbr", default=cfg_get("aoi", "abbr", default="mnl"))
+    p.add_argument("--outdir", type=Path, default=OUTPUT_DIR, help="directory holding the pipeline outputs")
+    p.add_argument("--host", default=None)
+    p.add_argument("--port", type=int, default=None)
+    p.add_argument("--verbose", action="store_true", help="log every request")
+    p.add_argument("--loadtest", type=int, default=None, metavar="N",
+                   help="fire N mixed queries at a running service (--host/--port) and report QPS, p50/p99")
+    p.add_argument("--concurrency", type=int, default=16)
+    args = p.parse_args()
+
+    if args.loadtest:
+        cfg = _service_cfg()
+        index = SegmentIndex.from_outputs(args.abbr, args.outdir)
+        targets = sample_queries(index, n=max(1, args.loadtest // 2))   # about half repeat (cache hits)
+        res = loadtest(args.host or cfg["host"], args.port or cfg["port"], targets, args.loadtest, args.concurrency)
+        print(f"[loadtest] {res}")
+    else:
+        serve(args.abbr, args.host, args.port, args.verbose, args.outdir)
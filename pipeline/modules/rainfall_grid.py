@@ -0,0 +1,274 @@
+"""
+Per-segment gridded rainfall features for SBAFN.
+
+Instead of one AOI-wide mean per day, keep the IMERG grid over the AOI and map
+segments onto it once:
+
+- RainGrid: compact (days × cells) float32 arrays of daily precipitation and its
+  rolling accumulations (r_1d … r_30d), cells flattened lat-major from the AOI window
+- SegmentCellIndex: sparse (segments × cells) weight matrix built from segment
+  centroids; segments that straddle cell edges are split by their length share in
+  each cell (i.e. the area share of a constant-width road buffer). Rows sum to 1.
+
+Per-segment values for any set of days are a sparse product (days × cells) @ (cells × segments),
+so no days × segments dense table is ever stored.
+
+Usage
+    grid = build_rain_grid(dates, lat, lon, daily_cube)            # cube: days × lat × lon
+    grid = append_rain_grid(grid, new_dates, new_cube)             # daily refresh
+    save_rain_grid(grid, "data/rainfall_grid.npz")
+    index = build_segment_cell_index(segments_gdf, grid.lat, grid.lon)
+    save_segment_cell_index(index, "data/rainfall_segment_cells.npz")
+    long_df = segment_rain_features(grid, index, segment_ids=[...])
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+ROLLING_WINDOWS = [1, 3, 7, 14, 30]
+RAIN_COLUMNS = ["rain_intensity_mmday"] + [f"r_{d}d" for d in ROLLING_WINDOWS]
+
+# -----------------------------
+# Grid store
+# -----------------------------
+
+@dataclass
+class RainGrid:
+    dates: np.ndarray                 # (days,) datetime64[D], ascending
+    lat: np.ndarray                   # (n_lat,) cell-centre latitudes
+    lon: np.ndarray                   # (n_lon,) cell-centre longitudes
+    daily: np.ndarray                 # (days, cells) float32, cell = i_lat * n_lon + i_lon
+    rolling: dict[str, np.ndarray] = field(default_factory=dict)  # "r_Nd" → (days, cells)
+
+    @property
+    def n_cells(self) -> int:
+        return len(self.lat) * len(self.lon)
+
+    def feature(self, name: str) -> np.ndarray:
+        return self.daily if name == "rain_intensity_mmday" else self.rolling[name]
+
+
+def rolling_sums(daily: np.ndarray, windows: Sequence[int] = ROLLING_WINDOWS) -> dict[str, np.ndarray]:
+    """
+    Trailing row-window sums along axis 0 (same semantics as pandas rolling(min_periods=1).sum()):
+    missing days are skipped, and a window with no observed day stays NaN rather than 0 mm.
+    """
+    observed = np.isfinite(daily)
+    csum = np.cumsum(np.where(observed, daily, 0.0), axis=0, dtype=np.float64)
+    csum = np.vstack([np.zeros((1, daily.shape[1])), csum])
+    cnt = np.vstack([np.zeros((1, daily.shape[1]), dtype=np.int64), np.cumsum(observed, axis=0)])
+    out = {}
+    for w in windows:
+        lo = np.maximum(np.arange(1, daily.shape[0] + 1) - w, 0)
+        total = csum[1:] - csum[lo]
+        out[f"r_{w}d"] = np.where(cnt[1:] - cnt[lo] > 0, total, np.nan).astype(np.float32)
+    return out
+
+
+def build_rain_grid(dates: Sequence, lat: np.ndarray, lon: np.ndarray, cube: np.ndarray,
+                    windows: Sequence[int] = ROLLING_WINDOWS) -> RainGrid:
+    """`cube` is (days, n_lat, n_lon) daily precipitation [mm/day] on the AOI window."""
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    order = np.argsort(dates, kind="stable")
+    daily = np.asarray(cube, dtype=np.float32)[order].reshape(len(dates), -1)
+    return RainGrid(
+        dates=dates[order],
+        lat=np.asarray(lat, dtype=np.float64),
+        lon=np.asarray(lon, dtype=np.float64),
+        daily=daily,
+        rolling=rolling_sums(daily, windows),
+    )
+
+
+def append_rain_grid(grid: RainGrid, dates: Sequence, cube: np.ndarray,
+                     windows: Sequence[int] = ROLLING_WINDOWS) -> RainGrid:
+    """
+    Extend `grid` with days newer than its last day. Rolling sums are computed only for
+    the new rows, continuing from the last max(windows) - 1 stored days.
+    """
+    new = build_rain_grid(dates, grid.lat, grid.lon, cube, windows=[])
+    keep = new.dates > grid.dates[-1] if len(grid.dates) else np.ones(len(new.dates), dtype=bool)
+    if not keep.any():
+        return grid
+    new_daily = new.daily[keep]
+
+    n_tail = min(max(windows) - 1, len(grid.dates))
+    rolled = rolling_sums(np.vstack([grid.daily[len(grid.dates) - n_tail:], new_daily]), windows)
+    return RainGrid(
+        dates=np.concatenate([grid.dates, new.dates[keep]]),
+        lat=grid.lat,
+        lon=grid.lon,
+        daily=np.vstack([grid.daily, new_daily]),
+        rolling={k: np.vstack([grid.rolling[k], v[n_tail:]]) for k, v in rolled.items()},
+    )
+
+
+def save_rain_grid(grid: RainGrid, path: str | Path) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, dates=grid.dates, lat=grid.lat, lon=grid.lon, daily=grid.daily, **grid.rolling)
+    return path
+
+
+def load_rain_grid(path: str | Path) -> RainGrid:
+    with np.load(path) as z:
+        rolling = {k: z[k] for k in z.files if k.startswith("r_")}
+        return RainGrid(dates=z["dates"], lat=z["lat"], lon=z["lon"], daily=z["daily"], rolling=rolling)
+
+# -----------------------------
+# Segment → cell index
+# -----------------------------
+
+@dataclass
+class SegmentCellIndex:
+    segment_ids: np.ndarray           # (segments,) str
+    weights: sparse.csr_matrix        # (segments, cells), rows sum to 1
+
+    def rows_for(self, segment_ids: Optional[Sequence[str]] = None) -> tuple[np.ndarray, sparse.csr_matrix]:
+        if segment_ids is None:
+            return self.segment_ids, self.weights
+        pos = pd.Index(self.segment_ids).get_indexer(list(segment_ids))
+        pos = pos[pos >= 0]
+        return self.segment_ids[pos], self.weights[pos]
+
+
+def _cell_edges(centres: np.ndarray) -> np.ndarray:
+    """Cell boundaries (ascending) from centres of a regular grid."""
+    c = np.sort(centres)
+    res = float(np.median(np.diff(c))) if len(c) > 1 else 0.1
+    return np.concatenate([c - res / 2, [c[-1] + res / 2]])
+
+
+def build_segment_cell_index(segments_gdf: gpd.GeoDataFrame, lat: np.ndarray, lon: np.ndarray) -> SegmentCellIndex:
+    """
+    Map every segment onto the rainfall grid.
+
+    1) Centroid → cell by binary search on the cell edges (all segments at once).
+    2) Segments whose bounds cross a cell edge are intersected with their candidate
+       cells in a metric CRS and weighted by the length falling in each cell.
+    Segments outside the grid are clamped to the nearest edge cell.
+    """
+    import geopandas as gpd
+    import shapely
+    from shapely.geometry import box
+
+    from pipeline.modules.segment_table import pick_metric_crs
+
+    seg = segments_gdf.to_crs(4326)
+    lat_sorted, lon_sorted = np.sort(lat), np.sort(lon)
+    lat_edges, lon_edges = _cell_edges(lat_sorted), _cell_edges(lon_sorted)
+    n_lat, n_lon = len(lat), len(lon)
+    # map sorted positions back to the stored (possibly descending) order
+    lat_pos = np.argsort(lat)
+    lon_pos = np.argsort(lon)
+
+    def cell_of(ys, xs):
+        i = np.clip(np.searchsorted(lat_edges, ys, side="right") - 1, 0, n_lat - 1)
+        j = np.clip(np.searchsorted(lon_edges, xs, side="right") - 1, 0, n_lon - 1)
+        return lat_pos[i] * n_lon + lon_pos[j]
+
+    metric = pick_metric_crs(seg)
+    geoms = seg.geometry.values
+    cent = seg.geometry.to_crs(metric).centroid.to_crs(4326)
+    centre_cell = cell_of(cent.y.to_numpy(), cent.x.to_numpy())
+
+    b = seg.geometry.bounds.to_numpy()  # minx, miny, maxx, maxy
+    straddle = cell_of(b[:, 1], b[:, 0]) != cell_of(b[:, 3], b[:, 2])
+
+    rows = [np.flatnonzero(~straddle)]
+    cols = [centre_cell[~straddle]]
+    vals = [np.ones(int((~straddle).sum()), dtype=np.float32)]
+
+    if straddle.any():
+        cell_polys = gpd.GeoDataFrame(
+            {"cell": [lat_pos[i] * n_lon + lon_pos[j] for i in range(n_lat) for j in range(n_lon)]},
+            geometry=[box(lon_edges[j], lat_edges[i], lon_edges[j + 1], lat_edges[i + 1])
+                      for i in range(n_lat) for j in range(n_lon)],
+            crs=4326,
+        )
+        st = gpd.GeoDataFrame({"row": np.flatnonzero(straddle)}, geometry=geoms[straddle], crs=4326).to_crs(metric)
+        cells_m = cell_polys.to_crs(metric)
+        pairs = gpd.sjoin(st, cells_m, predicate="intersects", how="inner")
+        inter_len = shapely.length(shapely.intersection(
+            pairs.geometry.values, cells_m.geometry.values[pairs["index_right"].to_numpy()]
+        ))
+        pairs = pd.DataFrame({"row": pairs["row"].to_numpy(), "cell": pairs["cell"].to_numpy(), "len": inter_len})
+        pairs = pairs[pairs["len"] > 0]
+        pairs["w"] = pairs["len"] / pairs.groupby("row")["len"].transform("sum")
+
+        # straddlers that never intersect the grid fall back to their centroid cell
+        missing = np.setdiff1d(np.flatnonzero(straddle), pairs["row"].to_numpy())
+        rows += [pairs["row"].to_numpy(), missing]
+        cols += [pairs["cell"].to_numpy(), centre_cell[missing]]
+        vals += [pairs["w"].to_numpy(dtype=np.float32), np.ones(len(missing), dtype=np.float32)]
+
+    W = sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(seg), n_lat * n_lon),
+        dtype=np.float32,
+    )
+    return SegmentCellIndex(segment_ids=seg["segment_id"].astype(str).to_numpy(dtype=str), weights=W)
+
+
+def save_segment_cell_index(index: SegmentCellIndex, path: str | Path) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    W = index.weights
+    np.savez_compressed(path, segment_ids=index.segment_ids, indptr=W.indptr, indices=W.indices,
+                        data=W.data, shape=np.asarray(W.shape))
+    return path
+
+
+def load_segment_cell_index(path: str | Path) -> SegmentCellIndex:
+    with np.load(path, allow_pickle=False) as z:
+        W = sparse.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"]))
+        return SegmentCellIndex(segment_ids=z["segment_ids"], weights=W)
+
+
+def load_or_build_segment_cell_index(segments_path: str | Path, grid: RainGrid, index_path: str | Path) -> SegmentCellIndex:
+    """Reuse the saved index unless the segments file is newer or the grid shape changed."""
+    from pipeline.modules.table_io import read_table
+
+    segments_path, index_path = Path(segments_path), Path(index_path)
+    if index_path.exists() and index_path.stat().st_mtime >= segments_path.stat().st_mtime:
+        index = load_segment_cell_index(index_path)
+        if index.weights.shape[1] == grid.n_cells:
+            return index
+    index = build_segment_cell_index(read_table(segments_path, columns=["segment_id", "geometry"]), grid.lat, grid.lon)
+    save_segment_cell_index(index, index_path)
+    return index
+
+# -----------------------------
+# Lookup
+# -----------------------------
+
+def segment_rain_features(
+    grid: RainGrid,
+    index: SegmentCellIndex,
+    segment_ids: Optional[Sequence[str]] = None,
+    columns: Sequence[str] = RAIN_COLUMNS,
+) -> pd.DataFrame:
+    """
+    Long table (date, segment_id, rain_intensity_mmday, r_1d … r_30d) for the requested segments.
+    Each feature is one sparse product: (days × cells) @ (cells × segments).
+    """
+    ids, W = index.rows_for(segment_ids)
+    n_days, n_seg = len(grid.dates), len(ids)
+    out = {
+        "date": np.repeat(grid.dates, n_seg),
+        "segment_id": np.tile(ids, n_days),
+    }
+    for col in columns:
+        out[col] = np.asarray((W @ grid.feature(col).T).T).ravel()
+    df = pd.DataFrame(out)
+    df["date"] = pd.to_datetime(df["date"])
+    return df
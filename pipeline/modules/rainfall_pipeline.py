@@ -1,96 +1,289 @@
 # rainfall_pipeline.py
-import xarray as xr
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, timedelta
+from functools import partial
+from typing import TYPE_CHECKING
 import numpy as np
 import pandas as pd
-from datetime import datetime
-import earthaccess
 from tqdm import tqdm
 import os
 import re
 
+from pipeline.config import REPO_ROOT, cfg_get
+from pipeline import metrics
+from pipeline.modules.rainfall_grid import append_rain_grid, build_rain_grid, load_rain_grid, save_rain_grid
+from pipeline.modules.rainfall_store import RainfallStore, update_rolling
+
+if TYPE_CHECKING:
+    import xarray as xr
+
 # === CONFIG ===
 LAT_MIN, LAT_MAX = 14.45, 14.75
 LON_MIN, LON_MAX = 120.8, 121.2
-START_DATE, END_DATE = "2025-05-01", "2025-10-22"
-DATA_DIR = "./data/imerg_data_dl"
-OUTPUT_FILE = "./data/rainfall_daily_features.csv"
+AOI_BBOX = (LON_MIN, LAT_MIN, LON_MAX, LAT_MAX)
+START_DATE, END_DATE = "2025-05-01", None     # END_DATE None → today (daily refresh)
+DATA_DIR = "data/imerg_data_dl"
+OUTPUT_FILE = "data/rainfall_daily_features.csv"
+GRID_FILE = "data/rainfall_grid.npz"
+STORE_DIR = "data/rainfall_store"
 
-os.makedirs(DATA_DIR, exist_ok=True)
+DOWNLOAD_BATCH_SIZE = 32    # granules handed to earthaccess per call
+DOWNLOAD_THREADS = 8        # concurrent HTTPS transfers inside each batch
+EXTRACT_WORKERS = None      # None → one process per core
+NC_ENGINE = "netcdf4"
+ROLLING_WINDOWS = [1, 3, 7, 14, 30]
 
-# === LOGIN ===
-auth = earthaccess.login()
-print("🔐 Logged in successfully")
+
+def _imerg_cfg() -> dict:
+    # CONFIGS: IMERG (module constants are the fallbacks)
+    bbox = cfg_get("rainfall", "imerg", "bbox", default={})
+    return {
+        "bbox": (bbox.get("west", LON_MIN), bbox.get("south", LAT_MIN), bbox.get("east", LON_MAX), bbox.get("north", LAT_MAX)),
+        "start_date": str(cfg_get("rainfall", "imerg", "start_date", default=START_DATE)),
+        "end_date": str(cfg_get("rainfall", "imerg", "end_date", default=END_DATE) or "") or None,
+        "data_dir": str(REPO_ROOT / cfg_get("rainfall", "imerg", "data_dir", default=DATA_DIR)),
+        "features_csv": str(REPO_ROOT / cfg_get("rainfall", "imerg", "features_csv", default=OUTPUT_FILE)),
+        "grid_file": str(REPO_ROOT / cfg_get("rainfall", "imerg", "grid_file", default=GRID_FILE)),
+        "store_dir": str(REPO_ROOT / cfg_get("rainfall", "imerg", "store_dir", default=STORE_DIR)),
+        "download_batch_size": cfg_get("rainfall", "imerg", "download_batch_size", default=DOWNLOAD_BATCH_SIZE),
+        "download_threads": cfg_get("rainfall", "imerg", "download_threads", default=DOWNLOAD_THREADS),
+    }
 
 # === SEARCH IMERGDL DAILY ===
-results = earthaccess.search_data(
-    short_name="GPM_3IMERGDL",
-    version="07",
-    temporal=(START_DATE, END_DATE),
-    bounding_box=(LON_MIN, LAT_MIN, LON_MAX, LAT_MAX),
-)
-print(f"🌧 Found {len(results)} IMERGDL daily granules")
+def search_granules(start_date: str = START_DATE, end_date: str | None = END_DATE, bbox: tuple = AOI_BBOX) -> list:
+    import earthaccess
+
+    end_date = end_date or date.today().isoformat()
+    results = earthaccess.search_data(
+        short_name="GPM_3IMERGDL",
+        version="07",
+        temporal=(start_date, end_date),
+        bounding_box=bbox,
+    )
+    print(f"🌧 Found {len(results)} IMERGDL daily granules")
+    return results
 
 # === DOWNLOAD ===
-downloaded_files = []
-for granule in tqdm(results, desc="📥 Downloading IMERGDL"):
-    urls = granule.data_links(access="https")
-    if not urls:
-        continue
-    url = urls[0]
-    fname = os.path.basename(url)
-    local_path = os.path.join(DATA_DIR, fname)
+def download_granules(results: list,
+                      data_dir: str = DATA_DIR,
+                      batch_size: int = DOWNLOAD_BATCH_SIZE,
+                      threads: int = DOWNLOAD_THREADS) -> list[str]:
+    """
+    Download missing granules in batches; earthaccess transfers each batch over `threads` connections.
+    Returns local paths of every granule that is on disk afterwards, in search order.
+    """
+    import earthaccess
 
-    if os.path.exists(local_path):
-        print(f"⏩ Skipping existing file: {fname}")
-        downloaded_files.append(local_path)
-        continue
+    os.makedirs(data_dir, exist_ok=True)
 
-    downloaded = earthaccess.download([granule], local_path=DATA_DIR)
-    if not downloaded:
-        continue
+    local_paths, pending = [], []
+    for granule in results:
+        urls = granule.data_links(access="https")
+        if not urls:
+            continue
+        local_path = os.path.join(data_dir, os.path.basename(urls[0]))
+        local_paths.append(local_path)
+        if not os.path.exists(local_path):
+            pending.append(granule)
 
-    downloaded_files.append(downloaded[0])
+    print(f"⏩ Already on disk: {len(local_paths) - len(pending)} | To download: {len(pending)}")
+    for i in tqdm(range(0, len(pending), batch_size), desc="📥 Downloading IMERGDL batches"):
+        earthaccess.download(pending[i:i + batch_size], local_path=data_dir, threads=threads)
 
-print(f"📦 Total ready: {len(downloaded_files)}")
+    ready = [p for p in local_paths if os.path.exists(p)]
+    print(f"📦 Total ready: {len(ready)}")
+    return ready
 
 # === EXTRACT RAINFALL ===
-rows = []
-for file_path in tqdm(downloaded_files, desc="🌧 Extracting precipitation"):
+def date_from_filename(fname: str) -> datetime | None:
+    match = re.search(r"(\d{8})-S\d{6}", fname)
+    return datetime.strptime(match.group(1), "%Y%m%d") if match else None
+
+
+def _coord_slice(coord: xr.DataArray, lo: float, hi: float) -> slice:
+    # .sel slices follow the coordinate's storage order
+    return slice(lo, hi) if coord.values[0] <= coord.values[-1] else slice(hi, lo)
+
+
+def read_aoi_precipitation(file_path: str, bbox: tuple = AOI_BBOX, engine: str | None = NC_ENGINE) -> xr.DataArray | None:
+    """Open a granule lazily and read only the AOI lat/lon window of `precipitation` into memory."""
+    import xarray as xr
+
+    lon_min, lat_min, lon_max, lat_max = bbox
+    with xr.open_dataset(file_path, engine=engine, cache=False) as ds:
+        if "precipitation" not in ds:
+            return None
+        rain = ds["precipitation"]
+        subset = rain.sel(lon=_coord_slice(rain["lon"], lon_min, lon_max),
+                          lat=_coord_slice(rain["lat"], lat_min, lat_max))
+        return subset.load()
+
+
+def extract_daily_mean(file_path: str, bbox: tuple = AOI_BBOX, engine: str | None = NC_ENGINE) -> dict | None:
+    """AOI-mean daily precipitation of one granule → {"date", "rain_intensity_mmday"} (None if unusable)."""
     fname = os.path.basename(file_path)
+    date = date_from_filename(fname)
+    if date is None:
+        return None
     try:
-        ds = xr.open_dataset(file_path, engine="netcdf4")
-        if "precipitation" not in ds:
-            continue
+        subset = read_aoi_precipitation(file_path, bbox=bbox, engine=engine)
+    except Exception as e:
+        print(f"⚠️ {fname}: {e}")
+        return None
+    if subset is None or subset.size == 0:
+        return None
 
-        rain = ds["precipitation"]
+    mean_rain = float(np.nanmean(subset.values))
+    if np.isnan(mean_rain):
+        return None
+    return {"date": date, "rain_intensity_mmday": mean_rain}
 
-        if rain.dims.index("lon") < rain.dims.index("lat"):
-            subset = rain.sel(lon=slice(LON_MIN, LON_MAX), lat=slice(LAT_MIN, LAT_MAX))
-        else:
-            subset = rain.sel(lat=slice(LAT_MAX, LAT_MIN), lon=slice(LON_MIN, LON_MAX))
 
-        mean_rain = float(np.nanmean(subset.values))
-        if np.isnan(mean_rain):
-            continue
+def extract_rainfall(files: list[str],
+                     bbox: tuple = AOI_BBOX,
+                     max_workers: int | None = EXTRACT_WORKERS,
+                     engine: str | None = NC_ENGINE) -> pd.DataFrame:
+    """Run `extract_daily_mean` over all granules in a process pool; returns rows sorted by date."""
+    worker = partial(extract_daily_mean, bbox=bbox, engine=engine)
+    chunksize = max(1, len(files) // (4 * (max_workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        rows = list(tqdm(ex.map(worker, files, chunksize=chunksize),
+                         total=len(files), desc="🌧 Extracting precipitation"))
 
-        match = re.search(r"(\d{8})-S\d{6}", fname)
-        if match:
-            date = datetime.strptime(match.group(1), "%Y%m%d")
-        else:
-            continue
+    rows = [r for r in rows if r]
+    if not rows:
+        return pd.DataFrame(columns=["date", "rain_intensity_mmday"])
+    return pd.DataFrame(rows).sort_values("date").reset_index(drop=True)
 
-        rows.append({"date": date, "rain_intensity_mmday": mean_rain})
+
+def extract_daily_grid(file_path: str, bbox: tuple = AOI_BBOX, engine: str | None = NC_ENGINE) -> dict | None:
+    """AOI precipitation grid of one granule → {"date", "lat", "lon", "precip" (n_lat × n_lon)}."""
+    fname = os.path.basename(file_path)
+    date = date_from_filename(fname)
+    if date is None:
+        return None
+    try:
+        subset = read_aoi_precipitation(file_path, bbox=bbox, engine=engine)
     except Exception as e:
         print(f"⚠️ {fname}: {e}")
-        continue
+        return None
+    if subset is None or subset.size == 0:
+        return None
+
+    if "time" in subset.dims:
+        subset = subset.isel(time=0, drop=True)
+    subset = subset.transpose("lat", "lon")
+    return {
+        "date": date,
+        "lat": subset["lat"].values,
+        "lon": subset["lon"].values,
+        "precip": subset.values.astype(np.float32),
+    }
+
+
+def extract_rainfall_grid(files: list[str],
+                          bbox: tuple = AOI_BBOX,
+                          max_workers: int | None = EXTRACT_WORKERS,
+                          engine: str | None = NC_ENGINE) -> tuple[list, np.ndarray, np.ndarray, np.ndarray] | None:
+    """Per-cell counterpart of `extract_rainfall`: returns (dates, lat, lon, cube[days, lat, lon])."""
+    worker = partial(extract_daily_grid, bbox=bbox, engine=engine)
+    chunksize = max(1, len(files) // (4 * (max_workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        grids = list(tqdm(ex.map(worker, files, chunksize=chunksize),
+                          total=len(files), desc="🌧 Extracting precipitation grid"))
+
+    grids = [g for g in grids if g]
+    if not grids:
+        return None
+    lat, lon = grids[0]["lat"], grids[0]["lon"]
+    grids = [g for g in grids if g["precip"].shape == (len(lat), len(lon))]
+    cube = np.stack([g["precip"] for g in grids])
+    return [g["date"] for g in grids], lat, lon, cube
 
 # === BUILD DATAFRAME ===
-df = pd.DataFrame(rows).sort_values("date")
-if not df.empty:
-    for days in [1, 3, 7, 14, 30]:
+def aoi_mean_from_grid(dates: np.ndarray, daily: np.ndarray) -> pd.DataFrame:
+    """AOI-wide daily mean from a (days × cells) grid; days with no valid cells are dropped."""
+    with np.errstate(invalid="ignore"):
+        mean_rain = np.nanmean(daily, axis=1) if daily.size else np.array([])
+    df = pd.DataFrame({"date": pd.to_datetime(dates), "rain_intensity_mmday": mean_rain.astype(float)})
+    return df.dropna(subset=["rain_intensity_mmday"]).sort_values("date").reset_index(drop=True)
+
+
+def add_rolling_features(df: pd.DataFrame, windows: list[int] = ROLLING_WINDOWS) -> pd.DataFrame:
+    for days in windows:
         df[f"r_{days}d"] = df["rain_intensity_mmday"].rolling(window=days, min_periods=1).sum()
+    return df
+
+
+def main():
+    import earthaccess
+
+    icfg = _imerg_cfg()
+    store = RainfallStore(icfg["store_dir"])
+    last_day = store.last_date()
+    start_date = icfg["start_date"]
+    if last_day is not None:
+        start_date = max(pd.Timestamp(start_date), last_day + timedelta(days=1)).date().isoformat()
+    end_date = icfg["end_date"] or date.today().isoformat()
+    print(f"🗃️ Last stored day: {last_day.date() if last_day is not None else '—'} | Refreshing {start_date} → {end_date}")
+
+    if start_date <= end_date:
+        # === LOGIN ===
+        auth = earthaccess.login()
+        print("🔐 Logged in successfully")
+
+        with metrics.stage("imerg_download") as st:
+            results = search_granules(start_date, end_date, icfg["bbox"])
+            downloaded_files = download_granules(results, icfg["data_dir"],
+                                                 batch_size=icfg["download_batch_size"], threads=icfg["download_threads"])
+            st.count(granules=len(downloaded_files))
+        if last_day is not None:
+            downloaded_files = [f for f in downloaded_files
+                                if (d := date_from_filename(os.path.basename(f))) and d > last_day]
+        with metrics.stage("imerg_extract") as st:
+            _refresh_stores(store, downloaded_files, icfg["bbox"], icfg["grid_file"])
+            st.count(granules=len(downloaded_files))
+    else:
+        print("✅ Rainfall store already up to date.")
+
+    # [EXPORT] Regenerate the features CSV from the store
+    df = store.read()
+    if df.empty:
+        print("⚠️ No rainfall data extracted.")
+        return
+    df.to_csv(icfg["features_csv"], index=False)
+    print(f"✅ Saved rainfall data ({len(df)} days) → {icfg['features_csv']}")
+
+
+def _refresh_stores(store: RainfallStore, new_files: list[str], bbox: tuple, grid_file: str):
+    """Extract only the new granules and append them to the per-cell grid and the daily store."""
+    # One pass over the granules: keep the per-cell grid (per-segment features)
+    # and derive the AOI-wide daily mean from it
+    extracted = extract_rainfall_grid(new_files, bbox) if new_files else None
+    if extracted is None:
+        print("ℹ️ No new granules to extract.")
+        return
+
+    if os.path.exists(grid_file):
+        grid = append_rain_grid(load_rain_grid(grid_file), extracted[0], extracted[3])
+    else:
+        grid = build_rain_grid(*extracted)
+    save_rain_grid(grid, grid_file)
+    print(f"✅ Saved rainfall grid ({len(grid.dates)} days × {grid.n_cells} cells) → {grid_file}")
+
+    new_daily = aoi_mean_from_grid(*_grid_days(extracted))
+    new_rows = update_rolling(store.tail(max(ROLLING_WINDOWS) - 1), new_daily, ROLLING_WINDOWS)
+    part = store.append(new_rows)
+    if part is not None:
+        print(f"✅ Appended {len(new_rows)} day(s) → {part}")
+
+
+def _grid_days(extracted: tuple) -> tuple[np.ndarray, np.ndarray]:
+    dates, _, _, cube = extracted
+    return np.asarray(dates, dtype="datetime64[D]"), cube.reshape(len(dates), -1)
+
 
-    df.to_csv(OUTPUT_FILE, index=False)
-    print(f"✅ Saved rainfall data → {OUTPUT_FILE}")
-else:
-    print("⚠️ No rainfall data extracted.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Append-only daily rainfall store for SBAFN.
+
+Daily AOI rainfall rows (date, rain_intensity_mmday, r_1d … r_30d) live in a
+directory of Parquet parts, one per refresh:
+
+    data/rainfall_store/daily-20250501-20251022.parquet
+    data/rainfall_store/daily-20251023-20251023.parquet
+
+- Parts are never rewritten; a refresh only writes days newer than the last stored day
+- The last stored day comes from the part file names (no data read)
+- Rolling windows for new days are computed from the stored tail, so they match a
+  full recompute exactly (row-based windows, as in `add_rolling_features`)
+
+Usage
+    store = RainfallStore("data/rainfall_store")
+    new_rows = update_rolling(store.tail(max(ROLLING_WINDOWS) - 1), new_daily_df)
+    store.append(new_rows)
+    store.read().to_csv("data/rainfall_daily_features.csv", index=False)
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional, Sequence
+import re
+
+import pandas as pd
+
+ROLLING_WINDOWS = [1, 3, 7, 14, 30]
+_PART_RE = re.compile(r"daily-(\d{8})-(\d{8})\.parquet$")
+
+
+def update_rolling(tail: pd.DataFrame, new: pd.DataFrame, windows: Sequence[int] = ROLLING_WINDOWS) -> pd.DataFrame:
+    """
+    Rolling sums for `new` days only, continuing from the stored `tail`.
+    `tail` needs at least max(windows) - 1 rows for the result to equal a full recompute.
+    """
+    new = new.sort_values("date").reset_index(drop=True)
+    if new.empty:
+        return new
+    series = pd.concat(
+        [tail["rain_intensity_mmday"], new["rain_intensity_mmday"]], ignore_index=True
+    )
+    out = new[["date", "rain_intensity_mmday"]].copy()
+    for days in windows:
+        rolled = series.rolling(window=days, min_periods=1).sum()
+        out[f"r_{days}d"] = rolled.iloc[len(tail):].to_numpy()
+    return out
+
+
+class RainfallStore:
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def parts(self) -> list[Path]:
+        return sorted(p for p in self.root.glob("daily-*.parquet") if _PART_RE.search(p.name))
+
+    def last_date(self) -> Optional[pd.Timestamp]:
+        ends = [_PART_RE.search(p.name).group(2) for p in self.parts()]
+        return pd.Timestamp(max(ends)) if ends else None
+
+    def read(self, columns: Optional[list[str]] = None) -> pd.DataFrame:
+        parts = self.parts()
+        if not parts:
+            return pd.DataFrame(columns=["date", "rain_intensity_mmday"] + [f"r_{d}d" for d in ROLLING_WINDOWS])
+        df = pd.concat([pd.read_parquet(p, columns=columns) for p in parts], ignore_index=True)
+        return df.drop_duplicates(subset="date", keep="last").sort_values("date").reset_index(drop=True)
+
+    def tail(self, n: int) -> pd.DataFrame:
+        """Last `n` stored rows, reading parts from the newest backwards until enough rows are found."""
+        frames, total = [], 0
+        for p in reversed(self.parts()):
+            df = pd.read_parquet(p)
+            frames.append(df)
+            total += len(df)
+            if total >= n:
+                break
+        if not frames:
+            return pd.DataFrame(columns=["date", "rain_intensity_mmday"])
+        df = pd.concat(frames[::-1], ignore_index=True).sort_values("date")
+        return df.iloc[-n:].reset_index(drop=True) if n > 0 else df.iloc[0:0]
+
+    def append(self, rows: pd.DataFrame) -> Optional[Path]:
+        """Write rows newer than the last stored day as a new part. Returns the part path (None if nothing new)."""
+        last = self.last_date()
+        rows = rows.copy()
+        rows["date"] = pd.to_datetime(rows["date"])
+        if last is not None:
+            rows = rows[rows["date"] > last]
+        if rows.empty:
+            return None
+        rows = rows.sort_values("date").reset_index(drop=True)
+        first, end = rows["date"].iloc[0], rows["date"].iloc[-1]
+        path = self.root / f"daily-{first:%Y%m%d}-{end:%Y%m%d}.parquet"
+        tmp = path.with_suffix(".parquet.part")
+        rows.to_parquet(tmp, index=False)
+        tmp.replace(path)
+        return path
@@ -0,0 +1,336 @@
+"""
+Batch flood-risk scoring of SBAFN street segments under rainfall scenarios.
+
+Inputs
+- features: per-segment table ({abbr}_pu_features.parquet): segment_id, elev_*, grade_robust_pct,
+  highway, lanes, ... (indicator columns that are not computed yet are skipped)
+- scorer: a trained LightGBM model (`risk.model_path`) or the weighted rule set in config `risk.rules`
+- scenarios: rainfall intensities in mm/hr (`risk.scenarios_mmhr`)
+
+Outputs
+- {abbr}_risk.parquet, one row per segment with the app's fields:
+  {segment_id, risk_score (0-100), risk_band (low/med/high), rain_threshold_mmhr,
+   drivers_top (list), drivers_contrib (struct: driver → share, sums to 1)}
+- {abbr}_risk_scenarios.npz: scores (uint8, segments × scenarios), segment_id, scenarios_mmhr
+
+Method
+1) Weighted rules: each indicator maps one feature to [0, 1] ("below" a reference, "flat" near
+   zero, or a categorical "map"). The weighted mean S places the segment's rain threshold between
+   rain_max (S = 0) and rain_min (S = 1); the score under rain r is 100 · sigmoid(k · (r − threshold)).
+2) Model: the booster is evaluated once per scenario with its rain feature set to the intensity.
+3) Segments are scored in row chunks into one preallocated uint8 matrix; risk_score / risk_band
+   come from the design scenario (`risk.design_mmhr`).
+4) rain_threshold_mmhr is the intensity at which the score reaches 50: closed form for the rules,
+   interpolated on the scenario grid for a model (NaN if never reached).
+5) Driver shares are the indicator terms w·x (rules) or positive SHAP contributions (model,
+   pred_contrib) at the design scenario, normalized per segment.
+
+Usage
+    python -m pipeline.modules.risk_scoring \\
+      --features pipeline/outputs/mnl_pu_features.parquet \\
+      --out pipeline/outputs/mnl_risk
+
+Notes
+- lightgbm is optional; without `risk.model_path` the rule set is used.
+- Throughput (segment_scenarios/s) is reported on the active metrics stage.
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import REPO_ROOT, OUTPUT_DIR, cfg_get
+from pipeline import metrics
+
+RISK_COLS = ["segment_id", "risk_score", "risk_band", "rain_threshold_mmhr", "drivers_top", "drivers_contrib"]
+BANDS = ("low", "med", "high")
+THRESHOLD_SCORE = 50.0
+
+DEFAULT_INDICATORS = [
+    {"driver": "Low Elevation", "feature": "elev_mean", "transform": "below", "ref": "p50", "scale": 4.0, "weight": 0.35},
+    {"driver": "Minimal Slope", "feature": "grade_robust_pct", "transform": "flat", "scale": 1.0, "weight": 0.20},
+    {"driver": "Canal Proximity", "feature": "canal_dist_m", "transform": "below", "ref": 150.0, "scale": 150.0, "weight": 0.25},
+    {"driver": "Poor Drainage", "feature": "inlet_cnt_30m", "transform": "below", "ref": 1.0, "scale": 1.0, "weight": 0.20},
+    {"driver": "Local Depression", "feature": "depr_depth_max_m", "transform": "above", "ref": 0.0, "scale": 0.5, "weight": 0.20},
+    {"driver": "Network Low Point", "feature": "elev_rel_2hop", "transform": "below", "ref": 0.0, "scale": 1.0, "weight": 0.15},
+]
+
+# ---------------------------------
+
+def _risk_cfg() -> dict:
+    scen = cfg_get("risk", "scenarios_mmhr", default={"start": 5, "stop": 150, "num": 100})
+    if isinstance(scen, dict):
+        scen = np.linspace(float(scen["start"]), float(scen["stop"]), int(scen["num"]))
+    model_path = cfg_get("risk", "model_path", default=None)
+    return {
+        "model_path": REPO_ROOT / model_path if model_path else None,
+        "rain_feature": cfg_get("risk", "rain_feature", default="rain_mmhr"),
+        "driver_names": cfg_get("risk", "driver_names", default={}) or {},
+        "scenarios": np.asarray(scen, dtype=np.float32),
+        "design_mmhr": float(cfg_get("risk", "design_mmhr", default=30.0)),
+        "bands": cfg_get("risk", "bands", default={"med": 40, "high": 70}),
+        "chunk_rows": int(cfg_get("risk", "chunk_rows", default=50_000)),
+        "top_drivers": int(cfg_get("risk", "top_drivers", default=3)),
+        "min_share": float(cfg_get("risk", "min_share", default=0.1)),
+        "rules": cfg_get("risk", "rules", default={}) or {},
+    }
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-z))
+
+#  ------------- SCORERS -------------
+
+class RuleScorer:
+    """Config-weighted indicator rules; see module docstring (Method 1)."""
+
+    def __init__(self, indicators: list[dict], rain_min_mmhr: float = 10.0, rain_max_mmhr: float = 150.0,
+                 steepness: float = 0.08):
+        self.indicators = indicators                    # as configured; fit() picks the usable subset
+        self.active_indicators_: list[dict] = []
+        self.rain_min = float(rain_min_mmhr)
+        self.rain_max = float(rain_max_mmhr)
+        self.steepness = float(steepness)
+        self.refs: dict[str, float] = {}
+
+    @classmethod
+    def from_config(cls, rules: dict) -> "RuleScorer":
+        return cls(rules.get("indicators") or DEFAULT_INDICATORS,
+                   **{k: rules[k] for k in ("rain_min_mmhr", "rain_max_mmhr", "steepness") if k in rules})
+
+    def fit(self, features: pd.DataFrame) -> "RuleScorer":
+        """Select the indicators whose feature exists; resolve percentile references ("p50") on the whole AOI."""
+        active = [ind for ind in self.indicators if ind["feature"] in features.columns]
+        skipped = [ind["feature"] for ind in self.indicators if ind["feature"] not in features.columns]
+        if skipped:
+            print(f"[risk] indicators without features (skipped): {', '.join(skipped)}")
+        if not active:
+            raise ValueError("none of the risk indicator features are present")
+        self.active_indicators_ = active
+        self.refs = {}
+        for ind in active:
+            ref = ind.get("ref")
+            if isinstance(ref, str) and ref.startswith("p"):
+                vals = pd.to_numeric(features[ind["feature"]], errors="coerce").to_numpy(dtype=float)
+                self.refs[ind["driver"]] = float(np.nanpercentile(vals, float(ref[1:])))
+        return self
+
+    @property
+    def drivers(self) -> list[str]:
+        return [ind["driver"] for ind in self.active_indicators_]
+
+    def _term(self, ind: dict, col: pd.Series) -> np.ndarray:
+        kind = ind.get("transform", "below")
+        if kind == "map":
+            values = {str(k): float(v) for k, v in (ind.get("values") or {}).items()}
+            x = col.astype(str).map(values).to_numpy(dtype=float)
+        else:
+            v = pd.to_numeric(col, errors="coerce").to_numpy(dtype=float)
+            scale = float(ind.get("scale", 1.0))
+            if kind == "flat":
+                x = 1.0 - np.abs(v) / scale
+            elif kind == "below":
+                x = (self.refs.get(ind["driver"], ind.get("ref", 0.0)) - v) / scale
+            elif kind == "above":
+                x = (v - self.refs.get(ind["driver"], ind.get("ref", 0.0))) / scale
+            else:
+                raise ValueError(f"unknown indicator transform: {kind}")
+        # Missing values carry no evidence
+        return np.nan_to_num(np.clip(x, 0.0, 1.0), nan=0.0)
+
+    def contributions(self, X: pd.DataFrame, design_mmhr: float) -> np.ndarray:
+        """(n, drivers) weighted indicator terms w·x (scenario-independent)."""
+        return np.column_stack([float(ind["weight"]) * self._term(ind, X[ind["feature"]]) for ind in self.active_indicators_])
+
+    def thresholds(self, X: pd.DataFrame) -> np.ndarray:
+        total = sum(float(ind["weight"]) for ind in self.active_indicators_)
+        s = self.contributions(X, 0.0).sum(axis=1) / total
+        return self.rain_max - (self.rain_max - self.rain_min) * s
+
+    def scores(self, X: pd.DataFrame, rain: np.ndarray) -> np.ndarray:
+        thr = self.thresholds(X).astype(np.float32)
+        return 100.0 * _sigmoid(self.steepness * (rain[None, :] - thr[:, None]))
+
+    def rain_threshold(self, X: pd.DataFrame, rain: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        return self.thresholds(X)
+
+
+class ModelScorer:
+    """Trained LightGBM booster (binary objective) with the scenario intensity as one feature."""
+
+    def __init__(self, model_path: Path, rain_feature: str = "rain_mmhr", driver_names: Optional[dict] = None):
+        try:
+            import lightgbm as lgb
+        except ImportError as e:
+            raise RuntimeError("risk.model_path is set but lightgbm is not installed") from e
+        self.booster = lgb.Booster(model_file=str(model_path))
+        self.feature_names = self.booster.feature_name()
+        self.rain_feature = rain_feature
+        self.driver_names = driver_names or {}
+
+    def fit(self, features: pd.DataFrame) -> "ModelScorer":
+        missing = [f for f in self.feature_names if f != self.rain_feature and f not in features.columns]
+        if missing:
+            print(f"[risk] model features missing from input (NaN): {', '.join(missing)}")
+        return self
+
+    @property
+    def drivers(self) -> list[str]:
+        return [self.driver_names.get(f, f.replace("_", " ").title()) for f in self.feature_names
+                if f != self.rain_feature]
+
+    def _frame(self, X: pd.DataFrame, rain: float) -> pd.DataFrame:
+        df = pd.DataFrame({f: X[f] if f in X.columns else np.nan for f in self.feature_names}, index=X.index)
+        for c in df.columns[df.dtypes == object]:
+            df[c] = df[c].astype("category")     # lightgbm re-maps to the training categories
+        df[self.rain_feature] = np.float32(rain)
+        return df
+
+    def scores(self, X: pd.DataFrame, rain: np.ndarray) -> np.ndarray:
+        df = self._frame(X, rain[0])
+        out = np.empty((len(X), len(rain)), dtype=np.float32)
+        for j, r in enumerate(rain):
+            df[self.rain_feature] = np.float32(r)
+            out[:, j] = 100.0 * self.booster.predict(df)
+        return out
+
+    def contributions(self, X: pd.DataFrame, design_mmhr: float) -> np.ndarray:
+        contrib = self.booster.predict(self._frame(X, design_mmhr), pred_contrib=True)[:, :-1]   # drop bias
+        keep = [i for i, f in enumerate(self.feature_names) if f != self.rain_feature]
+        return np.clip(contrib[:, keep], 0.0, None)
+
+    def rain_threshold(self, X: pd.DataFrame, rain: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        return grid_threshold(rain, scores, THRESHOLD_SCORE)
+
+
+def load_scorer(cfg: Optional[dict] = None):
+    cfg = cfg or _risk_cfg()
+    if cfg["model_path"] is not None:
+        return ModelScorer(cfg["model_path"], cfg["rain_feature"], cfg["driver_names"])
+    return RuleScorer.from_config(cfg["rules"])
+
+#  ------------- BATCH SCORING -------------
+
+def grid_threshold(rain: np.ndarray, scores: np.ndarray, level: float) -> np.ndarray:
+    """First intensity where each row's score reaches `level`, linearly interpolated (NaN if never)."""
+    hit = scores >= level
+    j = hit.argmax(axis=1)
+    out = np.full(len(scores), np.nan)
+    ok = hit.any(axis=1)
+    first = ok & (j == 0)
+    out[first] = rain[0]
+    mid = np.flatnonzero(ok & (j > 0))
+    jm = j[mid]
+    s0, s1 = scores[mid, jm - 1], scores[mid, jm]
+    t = (level - s0) / np.maximum(s1 - s0, 1e-6)
+    out[mid] = rain[jm - 1] + t * (rain[jm] - rain[jm - 1])
+    return out
+
+
+def band_of(scores: np.ndarray, bands: dict) -> pd.Categorical:
+    codes = (scores >= float(bands["med"])).astype(np.int8) + (scores >= float(bands["high"])).astype(np.int8)
+    return pd.Categorical.from_codes(codes, categories=list(BANDS))
+
+
+def driver_columns(contrib: np.ndarray, names: list[str], top: int = 3, min_share: float = 0.1):
+    """drivers_top (list of names, largest share first) and drivers_contrib (dict name → share)."""
+    total = contrib.sum(axis=1, keepdims=True)
+    share = np.divide(contrib, total, out=np.zeros_like(contrib, dtype=float), where=total > 0).round(3)
+    order = np.argsort(-share, axis=1, kind="stable")[:, :top]
+    picked = np.take_along_axis(share, order, axis=1) >= min_share
+    names = np.asarray(names, dtype=object)
+    drivers_top = [list(names[o[p]]) for o, p in zip(order, picked)]
+    drivers_contrib = [dict(zip(names, row)) for row in share.tolist()]
+    return drivers_top, drivers_contrib
+
+
+def score_segments(
+    features: pd.DataFrame,
+    scorer=None,
+    scenarios: Optional[np.ndarray] = None,
+    design_mmhr: Optional[float] = None,
+    bands: Optional[dict] = None,
+    chunk_rows: Optional[int] = None,
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Score every segment under every scenario.
+    Returns (risk frame with RISK_COLS, uint8 score matrix of shape (segments, scenarios)).
+    """
+    cfg = _risk_cfg()
+    scorer = (scorer or load_scorer(cfg)).fit(features)
+    rain = np.asarray(cfg["scenarios"] if scenarios is None else scenarios, dtype=np.float32)
+    design = cfg["design_mmhr"] if design_mmhr is None else float(design_mmhr)
+    bands = bands or cfg["bands"]
+    step = chunk_rows or cfg["chunk_rows"]
+
+    X = features.reset_index(drop=True)
+    n = len(X)
+    matrix = np.empty((n, len(rain)), dtype=np.uint8)
+    risk_score = np.empty(n, dtype=np.float32)
+    threshold = np.empty(n, dtype=np.float64)
+    contrib = np.empty((n, len(scorer.drivers)), dtype=np.float64)
+
+    # The design intensity rides along as an extra last column
+    rain_all = np.append(rain, np.float32(design))
+    st = metrics.current_stage()
+    for lo in range(0, n, step):
+        chunk = X.iloc[lo:lo + step]
+        s_all = scorer.scores(chunk, rain_all)
+        risk_score[lo:lo + len(chunk)] = s_all[:, -1]
+        s = np.rint(s_all[:, :-1])
+        matrix[lo:lo + len(chunk)] = s
+        threshold[lo:lo + len(chunk)] = scorer.rain_threshold(chunk, rain, s)
+        contrib[lo:lo + len(chunk)] = scorer.contributions(chunk, design)
+        if st is not None:
+            st.count(segments=len(chunk), segment_scenarios=len(chunk) * len(rain))
+
+    risk_score = np.rint(risk_score).astype(np.int16)
+    drivers_top, drivers_contrib = driver_columns(
+        contrib, scorer.drivers, top=cfg["top_drivers"], min_share=cfg["min_share"])
+    risk = pd.DataFrame({
+        "segment_id": X["segment_id"].to_numpy(),
+        "risk_score": risk_score,
+        "risk_band": band_of(risk_score, bands),
+        "rain_threshold_mmhr": np.round(threshold, 1).astype(np.float32),
+        "drivers_top": drivers_top,
+        "drivers_contrib": drivers_contrib,
+    })
+    return risk, matrix
+
+
+def write_risk(risk: pd.DataFrame, matrix: np.ndarray, scenarios: np.ndarray, out_stem: Path) -> dict[str, Path]:
+    from pipeline.modules.table_io import write_table
+
+    out_stem = Path(out_stem)
+    table = write_table(risk, out_stem.with_suffix(".parquet"))
+    grid = out_stem.with_name(out_stem.name + "_scenarios.npz")
+    np.savez(grid, scores=matrix, segment_id=risk["segment_id"].to_numpy(dtype=str),
+             scenarios_mmhr=np.asarray(scenarios, dtype=np.float32))
+    return {"parquet": table, "scenarios": grid}
+
+
+def run_risk_scoring(features: pd.DataFrame, out_stem: Path) -> pd.DataFrame:
+    cfg = _risk_cfg()
+    with metrics.stage("risk_scoring"):
+        risk, matrix = score_segments(features)
+        written = write_risk(risk, matrix, cfg["scenarios"], out_stem)
+    print(f"[risk] {len(risk):,} segments × {matrix.shape[1]} scenarios → {', '.join(str(p) for p in written.values())}")
+    print(f"[risk] bands: {risk['risk_band'].value_counts().to_dict()}")
+    return risk
+
+#  ------------- ENTRY POINT -------------
+
+if __name__ == "__main__":
+    from pipeline.modules.table_io import read_table
+
+    abbr = cfg_get("aoi", "abbr", default="mnl")
+    p = argparse.ArgumentParser()
+    p.add_argument("--features", type=Path, default=OUTPUT_DIR / f"{abbr}_pu_features.parquet")
+    p.add_argument("--out", type=Path, default=OUTPUT_DIR / f"{abbr}_risk", help="output stem (.parquet + _scenarios.npz)")
+    args = p.parse_args()
+
+    run_risk_scoring(read_table(args.features), args.out)
@@ -0,0 +1,389 @@
+"""
+Flood-aware routing over the SBAFN drive network, compiled to CSR arrays.
+
+Inputs
+- nodes / edges: osmnx-style GeoDataFrames (as built by core, or {abbr}_nodes_edges/*.parquet)
+- risk thresholds: {abbr}_risk.parquet (rain_threshold_mmhr) + segment parent_u/v/key, so each
+  edge takes the lowest threshold of its 30 m segments (it floods when any part floods)
+
+Outputs
+- {abbr}_graph_csr.npz: node_ids, xy (metric CRS), indptr, indices, length_m, edge_key, thr_mmhr, crs
+
+Method
+1) Compile once: nodes → ordinals, edges sorted by source → CSR (indptr / indices), one slot per
+   directed edge (parallel edges kept, so segment thresholds map one-to-one).
+2) Scenario weights: length_m for dry edges; edges with thr_mmhr ≤ rain are blocked
+   (`routing.mode: block`) or cost length × `routing.penalty` (`mode: penalize`).
+3) Single queries: heapq A* with a straight-line heuristic, scaled down if any edge is shorter
+   than its chord so it stays admissible; returns the node path.
+4) Batches: O/D pairs are grouped by origin (or by destination on the transposed graph when
+   there are fewer) and solved with scipy.sparse.csgraph.dijkstra (C) in chunks of sources
+   sorted by reach. Each chunk's search is capped at `limit_factor` × its farthest straight-line
+   target; pairs left unreached are re-run without the cap.
+5) Detours: every pair is solved dry and under the scenario; the result is the cost ratio, or
+   unreachable when flooding cuts the pair off.
+
+Usage
+    python -m pipeline.modules.routing --compile
+    python -m pipeline.modules.routing --od pairs.csv --rain 45 --out detours.parquet
+      (pairs.csv: o_lon, o_lat, d_lon, d_lat)
+
+    g = RoadGraph.load(OUTPUT_DIR / "mnl_graph_csr.npz")
+    cost, path = g.astar(g.nearest(lon0, lat0), g.nearest(lon1, lat1), g.weights(rain_mmhr=45))
+    df = g.detours(origins, destinations, rain_mmhr=45)
+
+Notes
+- No contraction hierarchies: scenario weights change with every rain value, and a hierarchy would
+  have to be rebuilt for each. Capped C Dijkstra is fast when trips are local or share endpoints
+  (5k local pairs ≈ 2 s, 2k origins × 20 shelters ≈ 0.1 s on a 15k-node grid). City-wide pairs
+  with all-distinct endpoints cost one full search per origin.
+"""
+from __future__ import annotations
+
+import argparse
+import heapq
+import math
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import OUTPUT_DIR, cfg_get
+from pipeline import metrics
+
+MIN_WEIGHT = 1e-3        # csgraph drops explicit zeros; keep zero-length edges traversable
+
+# ---------------------------------
+
+def _routing_cfg() -> dict:
+    return {
+        "mode": cfg_get("routing", "mode", default="block"),
+        "penalty": float(cfg_get("routing", "penalty", default=10.0)),
+        "limit_factor": float(cfg_get("routing", "limit_factor", default=2.5)),
+        "chunk_origins": int(cfg_get("routing", "chunk_origins", default=64)),
+        "snap_max_m": float(cfg_get("routing", "snap_max_m", default=250.0)),
+    }
+
+
+@dataclass(eq=False)
+class RoadGraph:
+    node_ids: np.ndarray     # int64 osmid per ordinal
+    xy: np.ndarray           # float64 (n, 2), metric CRS
+    indptr: np.ndarray       # int64 (n + 1)
+    indices: np.ndarray      # int32 target ordinal per slot
+    length_m: np.ndarray     # float32 per slot
+    edge_key: np.ndarray     # int32 osmnx key per slot
+    thr_mmhr: np.ndarray     # float32 per slot; inf = never floods
+    crs: str
+    _tree: Optional[object] = field(default=None, repr=False)
+    _h_scale: Optional[float] = field(default=None, repr=False)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    @property
+    def sources(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))
+
+    # ----- construction -----
+
+    @classmethod
+    def from_edges(cls, nodes, edges, metric_crs: Optional[str] = None) -> "RoadGraph":
+        """
+        Compile osmnx nodes (osmid index or column, x/y in WGS84) and edges (u, v, key, length).
+        Plain DataFrames work too; without `metric_crs` the UTM zone comes from the edge geometry
+        when there is one, else from the node coordinates.
+        """
+        from pyproj import Transformer
+        from pipeline.modules.segment_table import pick_metric_crs, utm_crs
+
+        nodes = nodes.reset_index() if "osmid" not in nodes.columns else nodes
+        edges = edges.reset_index() if "u" not in edges.columns else edges
+        if metric_crs is None:
+            if hasattr(edges, "total_bounds") and len(edges):
+                metric_crs = pick_metric_crs(edges)
+            else:
+                metric_crs = utm_crs(float(nodes["x"].mean()), float(nodes["y"].mean()))
+
+        node_ids = np.sort(nodes["osmid"].to_numpy(dtype=np.int64))
+        pos = pd.Index(node_ids)
+        x = nodes.set_index("osmid").loc[node_ids, "x"].to_numpy(dtype=float)
+        y = nodes.set_index("osmid").loc[node_ids, "y"].to_numpy(dtype=float)
+        xy = np.column_stack(Transformer.from_crs(4326, metric_crs, always_xy=True).transform(x, y))
+
+        src = pos.get_indexer(edges["u"].to_numpy(dtype=np.int64))
+        dst = pos.get_indexer(edges["v"].to_numpy(dtype=np.int64))
+        ok = (src >= 0) & (dst >= 0)
+        if not ok.all():
+            print(f"[routing] {int((~ok).sum()):,} edges reference unknown nodes; dropped")
+        order = np.flatnonzero(ok)[np.argsort(src[ok], kind="stable")]
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src[order], minlength=len(node_ids)), out=indptr[1:])
+        key = edges["key"].to_numpy(dtype=np.int32) if "key" in edges.columns else np.zeros(len(edges), dtype=np.int32)
+        return cls(
+            node_ids=node_ids,
+            xy=xy,
+            indptr=indptr,
+            indices=dst[order].astype(np.int32),
+            length_m=edges["length"].to_numpy(dtype=np.float32)[order],
+            edge_key=key[order],
+            thr_mmhr=np.full(len(order), np.inf, dtype=np.float32),
+            crs=metric_crs,
+        )
+
+    def attach_thresholds(self, risk: pd.DataFrame, segments: pd.DataFrame) -> int:
+        """Edge threshold = min rain_threshold_mmhr over its segments; returns edges with a threshold."""
+        seg = pd.DataFrame(segments[["segment_id", "parent_u", "parent_v", "parent_key"]]).merge(
+            risk[["segment_id", "rain_threshold_mmhr"]], on="segment_id", how="inner")
+        per_edge = seg.groupby(["parent_u", "parent_v", "parent_key"], sort=False)["rain_threshold_mmhr"].min()
+        slots = pd.DataFrame({
+            "parent_u": self.node_ids[self.sources],
+            "parent_v": self.node_ids[self.indices],
+            "parent_key": self.edge_key.astype(np.int64),
+        })
+        thr = slots.join(per_edge, on=["parent_u", "parent_v", "parent_key"])["rain_threshold_mmhr"]
+        self.thr_mmhr = thr.fillna(np.inf).to_numpy(dtype=np.float32)
+        return int(np.isfinite(self.thr_mmhr).sum())
+
+    def save(self, path: Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, node_ids=self.node_ids, xy=self.xy, indptr=self.indptr, indices=self.indices,
+                 length_m=self.length_m, edge_key=self.edge_key, thr_mmhr=self.thr_mmhr, crs=np.array(self.crs))
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "RoadGraph":
+        with np.load(path) as z:
+            return cls(**{k: z[k] for k in z.files if k != "crs"}, crs=str(z["crs"]))
+
+    # ----- weights -----
+
+    def weights(self, rain_mmhr: Optional[float] = None, mode: Optional[str] = None,
+                penalty: Optional[float] = None) -> np.ndarray:
+        """Per-slot cost in metres under a rain scenario (inf = blocked). None → dry network."""
+        cfg = _routing_cfg()
+        w = np.maximum(self.length_m.astype(np.float64), MIN_WEIGHT)
+        if rain_mmhr is None:
+            return w
+        flooded = self.thr_mmhr <= rain_mmhr
+        if (mode or cfg["mode"]) == "block":
+            w[flooded] = np.inf
+        else:
+            w[flooded] *= cfg["penalty"] if penalty is None else penalty
+        return w
+
+    def matrix(self, weights: np.ndarray):
+        """scipy CSR adjacency: blocked slots dropped, parallel edges collapsed to their minimum."""
+        from scipy.sparse import csr_matrix
+
+        keep = np.isfinite(weights)
+        src, dst, w = self.sources[keep], self.indices[keep], weights[keep]
+        # csr_matrix would sum duplicates: keep only the cheapest slot per (src, dst)
+        order = np.lexsort((w, dst, src))
+        src, dst, w = src[order], dst[order], w[order]
+        first = np.ones(len(src), dtype=bool)
+        first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        return csr_matrix((w[first], (src[first], dst[first])), shape=(self.n_nodes, self.n_nodes))
+
+    # ----- snapping -----
+
+    def nearest(self, lon, lat, max_m: Optional[float] = None) -> np.ndarray:
+        """Nearest node ordinal per (lon, lat); -1 beyond `routing.snap_max_m`."""
+        from pyproj import Transformer
+        from scipy.spatial import cKDTree
+
+        if self._tree is None:
+            self._tree = cKDTree(self.xy)
+        x, y = Transformer.from_crs(4326, self.crs, always_xy=True).transform(np.atleast_1d(lon), np.atleast_1d(lat))
+        dist, idx = self._tree.query(np.column_stack([x, y]))
+        limit = _routing_cfg()["snap_max_m"] if max_m is None else max_m
+        return np.where(dist <= limit, idx, -1)
+
+    # ----- single query -----
+
+    @property
+    def heuristic_scale(self) -> float:
+        """Largest s ≤ 1 with s · chord ≤ length on every edge, so the A* heuristic stays admissible."""
+        if self._h_scale is None:
+            chord = np.hypot(*(self.xy[self.sources] - self.xy[self.indices]).T)
+            ratio = np.divide(np.maximum(self.length_m, MIN_WEIGHT), chord, out=np.ones_like(chord), where=chord > 0)
+            self._h_scale = float(min(1.0, ratio.min())) if len(ratio) else 1.0
+        return self._h_scale
+
+    def astar(self, source: int, target: int, weights: Optional[np.ndarray] = None) -> tuple[float, list[int]]:
+        """Heap-based A* from `source` to `target` ordinals; (cost, node ordinal path), (inf, []) if unreachable."""
+        w = self.weights() if weights is None else weights
+        indptr, indices, xy = self.indptr, self.indices, self.xy
+        tx, ty = xy[target]
+        scale = self.heuristic_scale
+        h = lambda n: scale * math.hypot(xy[n, 0] - tx, xy[n, 1] - ty)
+
+        dist = {source: 0.0}
+        prev = {source: -1}
+        heap = [(h(source), 0.0, source)]
+        done = set()
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if u == target:
+                path = [u]
+                while prev[path[-1]] != -1:
+                    path.append(prev[path[-1]])
+                return d, path[::-1]
+            if u in done:
+                continue
+            done.add(u)
+            for slot in range(indptr[u], indptr[u + 1]):
+                nd = d + w[slot]
+                v = int(indices[slot])
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd + h(v), nd, v))
+        return math.inf, []
+
+    # ----- batches -----
+
+    def od_costs(self, origins: np.ndarray, destinations: np.ndarray, weights: Optional[np.ndarray] = None,
+                 limit_factor: Optional[float] = None, graph=None) -> np.ndarray:
+        """Shortest-path cost per (origin, destination) ordinal pair; inf if unreachable or unsnapped."""
+        from scipy.sparse.csgraph import dijkstra
+
+        cfg = _routing_cfg()
+        factor = cfg["limit_factor"] if limit_factor is None else limit_factor
+        G = graph if graph is not None else self.matrix(self.weights() if weights is None else weights)
+        origins, destinations = np.asarray(origins), np.asarray(destinations)
+        out = np.full(len(origins), np.inf)
+        valid = np.flatnonzero((origins >= 0) & (destinations >= 0))
+        if not len(valid):
+            return out
+
+        src, dst = origins[valid], destinations[valid]
+        if len(np.unique(dst)) < len(np.unique(src)):
+            # Fewer distinct destinations (e.g. shelters): search backwards from them on the transpose
+            G = G.T.tocsr()
+            src, dst = dst, src
+
+        uniq, inv = np.unique(src, return_inverse=True)
+        chord = np.hypot(*(self.xy[src] - self.xy[dst]).T)
+        reach = np.zeros(len(uniq))
+        np.maximum.at(reach, inv, chord)
+        # Chunks of sources with similar reach get tight distance caps
+        rank = np.empty(len(uniq), dtype=np.int64)
+        rank[np.argsort(reach, kind="stable")] = np.arange(len(uniq))
+        row = rank[inv]
+        by_row = np.argsort(row, kind="stable")
+        ordered = np.argsort(rank)
+
+        st = metrics.current_stage()
+        step = cfg["chunk_origins"]
+        for lo in range(0, len(uniq), step):
+            hi = min(lo + step, len(uniq))
+            pairs = by_row[np.searchsorted(row[by_row], lo):np.searchsorted(row[by_row], hi)]
+            sources = uniq[ordered[lo:hi]]
+            limit = float(reach[ordered[hi - 1]]) * factor + 1.0 if factor else np.inf
+            D = dijkstra(G, indices=sources, limit=limit)
+            costs = D[row[pairs] - lo, dst[pairs]]
+            # Pairs beyond the cap (long detours) get an uncapped search
+            miss = np.isinf(costs)
+            if miss.any() and np.isfinite(limit):
+                rows = np.unique(row[pairs[miss]] - lo)
+                D2 = dijkstra(G, indices=sources[rows])
+                costs[miss] = D2[np.searchsorted(rows, row[pairs[miss]] - lo), dst[pairs[miss]]]
+            out[valid[pairs]] = costs
+            if st is not None:
+                st.count(sources=hi - lo, od_pairs=len(pairs))
+        return out
+
+    def many_to_many(self, origins: np.ndarray, destinations: np.ndarray,
+                     weights: Optional[np.ndarray] = None) -> np.ndarray:
+        """Full (origins × destinations) cost matrix."""
+        o = np.repeat(np.asarray(origins), len(destinations))
+        d = np.tile(np.asarray(destinations), len(origins))
+        return self.od_costs(o, d, weights).reshape(len(origins), len(destinations))
+
+    def detours(self, origins: np.ndarray, destinations: np.ndarray, rain_mmhr: float,
+                mode: Optional[str] = None) -> pd.DataFrame:
+        """
+        Dry vs scenario cost per pair: detour_ratio, and reachable=False when flooding cuts the pair
+        off. Pairs with an unsnapped end (-1) have snapped=False, <NA> node ids and NaN costs.
+        """
+        dry = self.od_costs(origins, destinations, self.weights())
+        wet = self.od_costs(origins, destinations, self.weights(rain_mmhr, mode=mode))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = np.where(np.isfinite(wet) & (dry > 0), wet / dry, np.nan)
+        origins, destinations = np.asarray(origins), np.asarray(destinations)
+
+        snapped = (origins >= 0) & (destinations >= 0)
+
+        def node_label(idx):
+            # Unsnapped points (-1) get <NA> instead of borrowing node 0's osmid
+            return pd.Series(self.node_ids[np.maximum(idx, 0)], dtype="Int64").mask(idx < 0)
+
+        return pd.DataFrame({
+            "origin": node_label(origins),
+            "destination": node_label(destinations),
+            "dry_m": np.where(snapped, dry, np.nan),
+            "scenario_cost_m": np.where(snapped, wet, np.nan),
+            "detour_ratio": ratio,
+            "reachable": np.isfinite(wet),
+            "snapped": snapped,
+        })
+
+
+def build_routing_graph(nodes, edges, out_path: Path, risk: Optional[pd.DataFrame] = None,
+                        segments: Optional[pd.DataFrame] = None) -> RoadGraph:
+    """Compile + persist; `risk` and `segments` (segment_id, parent_u/v/key) attach edge thresholds."""
+    g = RoadGraph.from_edges(nodes, edges)
+    n_thr = g.attach_thresholds(risk, segments) if risk is not None and segments is not None else 0
+    g.save(out_path)
+    print(f"[routing] {g.n_nodes:,} nodes | {g.n_edges:,} edges ({n_thr:,} with a flood threshold) → {out_path}")
+    return g
+
+#  ------------- ENTRY POINT -------------
+
+if __name__ == "__main__":
+    from pipeline.modules.table_io import read_table, resolve_table, write_table
+
+    abbr = cfg_get("aoi", "abbr", default="mnl")
+    graph_path = OUTPUT_DIR / f"{abbr}_graph_csr.npz"
+    p = argparse.ArgumentParser()
+    p.add_argument("--compile", action="store_true", help=f"compile {abbr}_nodes_edges + risk into {graph_path.name}")
+    p.add_argument("--od", type=Path, default=None, help="CSV with o_lon, o_lat, d_lon, d_lat")
+    p.add_argument("--rain", type=float, default=None, help="scenario intensity (mm/hr)")
+    p.add_argument("--out", type=Path, default=None)
+    args = p.parse_args()
+
+    if args.compile:
+        ne = OUTPUT_DIR / f"{abbr}_nodes_edges"
+        risk_path = resolve_table(OUTPUT_DIR / f"{abbr}_risk", suffixes=(".parquet",))
+        seg_path = resolve_table(OUTPUT_DIR / f"{abbr}_segments", suffixes=(".parquet",))
+        build_routing_graph(
+            read_table(ne / f"{abbr}_nodes.parquet"),
+            read_table(ne / f"{abbr}_edges.parquet"),
+            graph_path,
+            risk=read_table(risk_path) if risk_path else None,
+            segments=read_table(seg_path, columns=["segment_id", "parent_u", "parent_v", "parent_key"]) if seg_path else None,
+        )
+
+    if args.od is not None:
+        g = RoadGraph.load(graph_path)
+        od = pd.read_csv(args.od)
+        with metrics.stage("routing", aoi=abbr):
+            o = g.nearest(od["o_lon"].to_numpy(), od["o_lat"].to_numpy())
+            d = g.nearest(od["d_lon"].to_numpy(), od["d_lat"].to_numpy())
+            res = g.detours(o, d, rain_mmhr=args.rain) if args.rain is not None else \
+                pd.DataFrame({"dry_m": g.od_costs(o, d)})
+        res = pd.concat([od.reset_index(drop=True), res], axis=1)
+        if args.out:
+            write_table(res, args.out)
+            print(f"[routing] {len(res):,} pairs → {args.out}")
+        else:
+            print(res.describe())
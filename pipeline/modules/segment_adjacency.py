@@ -0,0 +1,173 @@
+"""
+Neighbourhood-relative segment features from a sparse segment adjacency.
+
+Inputs
+- segments: SegmentTable (make_segment_table / make_corridors) or a segments GeoDataFrame
+- features: per-segment table with segment_id and the elevation column (`adjacency.elev_col`)
+
+Outputs
+- per segment and hop k in `adjacency.hops`:
+    nbr_cnt_{k}hop:   segments within k hops
+    elev_rel_{k}hop:  elevation − mean elevation of those segments (m; < 0 = lower than around it)
+    local_min_{k}hop: lower than every segment within k hops
+- downstream_cnt / upstream_cnt: 1-hop neighbours at least `adjacency.drop_m` lower / higher
+
+Method
+1) Both endpoints of every segment are snapped to a `snap_m` grid in the metric CRS and keyed, so
+   split points between 30 m parts and parent OSM nodes both become shared junction ids.
+2) Incidence B (segments × junctions, 2 entries per row); A = B·Bᵀ without the diagonal is the
+   1-hop adjacency, and the k-hop reach is (A + I)^k − I, binarised after each product.
+3) Neighbour sums and counts are sparse matrix–vector products over the valid-elevation mask;
+   min / lower-than counts reduce the matrix's (row, col) pairs with bincount / np.minimum.at.
+
+Usage
+    python -m pipeline.modules.segment_adjacency \\
+      --segments pipeline/outputs/mnl_segments.parquet \\
+      --features pipeline/outputs/mnl_pu_features.parquet \\
+      --out pipeline/outputs/mnl_adjacency_features.parquet
+
+    A = segment_adjacency(segments)                       # scipy CSR, n × n
+    feats = adjacency_features(A, elev, hops=(1, 2))
+
+Notes
+- Grade-separated crossings share no endpoint in OSM, so flyovers are not linked to the road below.
+- 271k segments (SegmentTable): adjacency ≈ 0.35 s, 1- and 2-hop features ≈ 0.6 s.
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import OUTPUT_DIR, cfg_get
+
+# ---------------------------------
+
+def _adjacency_cfg() -> dict:
+    return {
+        "enabled": bool(cfg_get("adjacency", "enabled", default=True)),
+        "elev_col": cfg_get("adjacency", "elev_col", default="elev_mean"),
+        "hops": [int(k) for k in cfg_get("adjacency", "hops", default=[1, 2])],
+        "snap_m": float(cfg_get("adjacency", "snap_m", default=0.05)),
+        "drop_m": float(cfg_get("adjacency", "drop_m", default=0.1)),
+    }
+
+
+def _segment_ids(segments) -> np.ndarray:
+    from pipeline.modules.segment_table import SegmentTable
+
+    return segments.segment_ids() if isinstance(segments, SegmentTable) else segments["segment_id"].to_numpy()
+
+
+def _endpoints(segments) -> tuple[np.ndarray, np.ndarray]:
+    """Metric start / end points for a SegmentTable or GeoDataFrame."""
+    import shapely
+    from pipeline.modules.segment_table import SegmentTable, pick_metric_crs
+
+    if isinstance(segments, SegmentTable):
+        return segments.endpoints()
+    geoms = segments.to_crs(pick_metric_crs(segments)).geometry.to_numpy() if segments.crs is not None \
+        else segments.geometry.to_numpy()
+    return shapely.get_coordinates(shapely.get_point(geoms, 0)), shapely.get_coordinates(shapely.get_point(geoms, -1))
+
+
+def junction_ids(points: np.ndarray, snap_m: float) -> np.ndarray:
+    """Dense id per snapped point: points within the same snap_m cell share an id."""
+    q = np.round(points / snap_m).astype(np.int64)
+    q -= q.min(axis=0, initial=0) if len(q) else 0
+    key = q[:, 0] * (int(q[:, 1].max(initial=0)) + 1) + q[:, 1]
+    return np.unique(key, return_inverse=True)[1].ravel()
+
+
+def segment_adjacency(segments, snap_m: Optional[float] = None):
+    """1-hop adjacency (scipy CSR, int8, no diagonal) between segments sharing an endpoint."""
+    from scipy import sparse
+
+    snap_m = _adjacency_cfg()["snap_m"] if snap_m is None else snap_m
+    start, end = _endpoints(segments)
+    n = len(start)
+    junction = junction_ids(np.concatenate([start, end]), snap_m)
+    rows = np.concatenate([np.arange(n), np.arange(n)])
+    B = sparse.csr_matrix((np.ones(2 * n, dtype=np.int32), (rows, junction)), shape=(n, int(junction.max(initial=-1)) + 1))
+    A = (B @ B.T).tocsr()
+    A.setdiag(0)
+    A.eliminate_zeros()
+    A.data[:] = 1
+    return A.astype(np.int8)
+
+
+def k_hop(A, k: int):
+    """Segments within k hops (CSR, no diagonal): (A + I)^k, binarised after every product."""
+    from scipy import sparse
+
+    step = (A + sparse.identity(A.shape[0], dtype=A.dtype, format="csr")).tocsr()
+    reach = step
+    for _ in range(k - 1):
+        reach = (reach @ step).tocsr()
+        reach.data[:] = 1
+    reach.setdiag(0)
+    reach.eliminate_zeros()
+    return reach.astype(np.int8)
+
+
+def _pairs(M) -> tuple[np.ndarray, np.ndarray]:
+    return np.repeat(np.arange(M.shape[0]), np.diff(M.indptr)), M.indices
+
+
+def adjacency_features(A, elev: np.ndarray, hops: Iterable[int] = (1, 2), drop_m: float = 0.1) -> pd.DataFrame:
+    """k-hop relative elevation, local-minimum flags and 1-hop down / upstream counts."""
+    elev = np.asarray(elev, dtype=np.float64)
+    valid = np.isfinite(elev)
+    v = np.where(valid, elev, 0.0)
+    n = len(elev)
+    cols = {}
+    for k in hops:
+        M = A if k == 1 else k_hop(A, k)
+        cnt = M @ valid.astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cols[f"nbr_cnt_{k}hop"] = np.asarray(M.sum(axis=1)).ravel().astype(np.int32)
+            cols[f"elev_rel_{k}hop"] = (elev - (M @ v) / cnt).astype(np.float32)
+        r, c = _pairs(M)
+        nbr_min = np.full(n, np.inf)
+        np.minimum.at(nbr_min, r, np.where(valid[c], elev[c], np.inf))
+        cols[f"local_min_{k}hop"] = valid & (cnt > 0) & (elev < nbr_min)
+
+    r, c = _pairs(A)
+    ok = valid[r] & valid[c]
+    cols["downstream_cnt"] = np.bincount(r[ok & (elev[c] <= elev[r] - drop_m)], minlength=n).astype(np.int32)
+    cols["upstream_cnt"] = np.bincount(r[ok & (elev[c] >= elev[r] + drop_m)], minlength=n).astype(np.int32)
+    return pd.DataFrame(cols)
+
+
+def add_adjacency_features(features: pd.DataFrame, segments) -> pd.DataFrame:
+    """Adjacency over `segments`, features from features[elev_col], left-joined on segment_id."""
+    cfg = _adjacency_cfg()
+    ids = _segment_ids(segments)
+    A = segment_adjacency(segments, snap_m=cfg["snap_m"])
+    elev = pd.Series(ids).map(features.set_index("segment_id")[cfg["elev_col"]]).to_numpy(dtype=np.float64)
+    adj = adjacency_features(A, elev, hops=cfg["hops"], drop_m=cfg["drop_m"])
+    adj.insert(0, "segment_id", ids)
+    print(f"[adjacency] {len(ids):,} segments | {A.nnz // 2:,} links | mean degree {A.nnz / max(len(ids), 1):.2f}")
+    return features.drop(columns=[c for c in adj.columns if c != "segment_id"], errors="ignore").merge(
+        adj, on="segment_id", how="left")
+
+#  ------------- ENTRY POINT -------------
+
+if __name__ == "__main__":
+    from pipeline.modules.table_io import read_table, write_table
+
+    abbr = cfg_get("aoi", "abbr", default="mnl")
+    p = argparse.ArgumentParser()
+    p.add_argument("--segments", type=Path, default=OUTPUT_DIR / f"{abbr}_segments.parquet")
+    p.add_argument("--features", type=Path, default=OUTPUT_DIR / f"{abbr}_pu_features.parquet")
+    p.add_argument("--out", type=Path, default=OUTPUT_DIR / f"{abbr}_adjacency_features.parquet")
+    args = p.parse_args()
+
+    elev_col = _adjacency_cfg()["elev_col"]
+    out = add_adjacency_features(read_table(args.features, columns=["segment_id", elev_col]),
+                                 read_table(args.segments, columns=["segment_id", "geometry"]))
+    write_table(out, args.out)
+    print(f"[adjacency] {len(out):,} segments → {args.out}")
@@ -0,0 +1,263 @@
+"""
+Memory-compact segment table for SBAFN.
+
+Inputs
+- edges: osmnx-style edges GeoDataFrame, via street_define.make_segment_table()
+- or a segments GeoDataFrame (segment_id, parent_u, parent_v, parent_key, ...), via from_geodataframe()
+
+Layout (one row per segment)
+- key:           int64, packed (edge ordinal << PART_BITS) | part
+- edge_u/v/key:  per parent edge (int64 / int64 / int32); segments reference them by ordinal
+- street_label, highway, lanes, corridor_id: pandas Categoricals
+- length_m:      float32
+- coords/offsets: projected (metric CRS) vertex array + CSR offsets; the only geometry kept
+- WGS84 vertices are derived on first use and cached
+
+String segment_ids (u_v_key_p{part}, the published format) are only built by segment_ids(),
+attributes(ids=True) and to_geodataframe(), i.e. at export time.
+
+Usage
+    from pipeline.modules.street_define import make_segment_table, make_corridors
+
+    table = make_segment_table(edges, split_len_m=30)
+    corridors, table = make_corridors(table)
+    export_table(typed_columns(table.to_geodataframe()), OUTPUT_DIR / "mnl_segments")
+    print(f"{table.nbytes / len(table):.0f} B/segment")
+
+Notes
+- A GeoDataFrame of the same segments costs several times more: one shapely object per row,
+  an object-dtype string id, object-dtype labels and float64 metrics.
+- PART_BITS = 16 allows 65,535 parts per parent edge (≈ 1,900 km at a 30 m split).
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+PART_BITS = 16
+PART_MASK = (1 << PART_BITS) - 1
+WGS84 = "EPSG:4326"
+
+# ---------------------------------
+
+def pack_keys(edge: np.ndarray, part: np.ndarray) -> np.ndarray:
+    return (np.asarray(edge, dtype=np.int64) << PART_BITS) | np.asarray(part, dtype=np.int64)
+
+
+def as_categorical(values) -> pd.Categorical:
+    s = pd.Series(values, dtype=object)
+    return pd.Categorical(s.where(s.notna(), None).map(lambda v: v if v is None else str(v)))
+
+
+def _gather_ranges(offsets: np.ndarray, idx: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Vertex rows of segments `idx` and the new offsets, for ragged arrays in CSR layout."""
+    counts = np.diff(offsets)[idx]
+    new_offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    rows = np.repeat(offsets[idx] - new_offsets[:-1], counts) + np.arange(new_offsets[-1])
+    return rows, new_offsets
+
+
+@dataclass(eq=False)
+class SegmentTable:
+    key: np.ndarray
+    edge_u: np.ndarray
+    edge_v: np.ndarray
+    edge_key: np.ndarray
+    street_label: pd.Categorical
+    highway: pd.Categorical
+    lanes: pd.Categorical
+    length_m: np.ndarray
+    coords: np.ndarray
+    offsets: np.ndarray
+    crs: str
+    corridor_id: Optional[pd.Categorical] = None
+    _wgs84: Optional[np.ndarray] = field(default=None, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.key)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.key) == 0
+
+    # ----- keys -----
+
+    @property
+    def edge(self) -> np.ndarray:
+        return self.key >> PART_BITS
+
+    @property
+    def part(self) -> np.ndarray:
+        return (self.key & PART_MASK).astype(np.int32)
+
+    @property
+    def parent_u(self) -> np.ndarray:
+        return self.edge_u[self.edge]
+
+    @property
+    def parent_v(self) -> np.ndarray:
+        return self.edge_v[self.edge]
+
+    @property
+    def parent_key(self) -> np.ndarray:
+        # Stored as int32; published as int64 like the osmnx edge key
+        return self.edge_key[self.edge].astype(np.int64)
+
+    def segment_ids(self, keys: Optional[np.ndarray] = None) -> np.ndarray:
+        """Published string ids (u_v_key_p{part}) for all segments or for packed `keys`."""
+        keys = self.key if keys is None else np.asarray(keys, dtype=np.int64)
+        edge = keys >> PART_BITS
+        parts = [self.edge_u[edge], self.edge_v[edge], self.edge_key[edge]]
+        ids = pd.Series(parts[0]).astype(str)
+        for p in parts[1:]:
+            ids = ids + "_" + pd.Series(p).astype(str)
+        return (ids + "_p" + pd.Series(keys & PART_MASK).astype(str)).to_numpy(dtype=object)
+
+    # ----- geometry -----
+
+    def xy(self, crs: Optional[str] = None) -> np.ndarray:
+        """Vertex array in the table's metric CRS, or WGS84 when crs is 4326 (computed once)."""
+        if crs is None or str(crs) == str(self.crs):
+            return self.coords
+        if str(crs).upper() not in (WGS84, "4326"):
+            from pyproj import Transformer
+
+            t = Transformer.from_crs(self.crs, crs, always_xy=True)
+            return np.column_stack(t.transform(self.coords[:, 0], self.coords[:, 1]))
+        if self._wgs84 is None:
+            from pyproj import Transformer
+
+            t = Transformer.from_crs(self.crs, WGS84, always_xy=True)
+            self._wgs84 = np.column_stack(t.transform(self.coords[:, 0], self.coords[:, 1]))
+        return self._wgs84
+
+    def geometry(self, crs: Optional[str] = None) -> np.ndarray:
+        """Shapely LineString array, built on demand (not stored)."""
+        import shapely
+
+        counts = np.diff(self.offsets)
+        return shapely.linestrings(self.xy(crs), indices=np.repeat(np.arange(len(self)), counts))
+
+    def endpoints(self, crs: Optional[str] = None) -> tuple[np.ndarray, np.ndarray]:
+        xy = self.xy(crs)
+        return xy[self.offsets[:-1]], xy[self.offsets[1:] - 1]
+
+    # ----- tables -----
+
+    def attributes(self, ids: bool = False) -> pd.DataFrame:
+        """Compact attribute frame (categoricals, float32); `ids=True` adds string segment_id."""
+        df = pd.DataFrame({
+            "segment_key": self.key,
+            "parent_u": self.parent_u,
+            "parent_v": self.parent_v,
+            "parent_key": self.parent_key,
+            "street_label": self.street_label,
+            "highway": self.highway,
+            "lanes": self.lanes,
+            "length_m": self.length_m,
+        })
+        if self.corridor_id is not None:
+            df.insert(1, "corridor_id", self.corridor_id)
+        if ids:
+            df.insert(0, "segment_id", self.segment_ids())
+        return df
+
+    def to_geodataframe(self, crs: Optional[str] = WGS84, columns: Optional[Iterable[str]] = None):
+        """Export layout: segment_id, [corridor_id], parent_u/v/key, labels, length_m, geometry."""
+        import geopandas as gpd
+
+        df = self.attributes(ids=True).drop(columns=["segment_key"])
+        if columns is not None:
+            df = df[list(columns)]
+        return gpd.GeoDataFrame(df, geometry=self.geometry(crs), crs=crs or self.crs)
+
+    def take(self, idx) -> "SegmentTable":
+        """Row subset (int positions or boolean mask); parent edge arrays are shared."""
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        rows, offsets = _gather_ranges(self.offsets, idx)
+        return replace(
+            self,
+            key=self.key[idx],
+            street_label=self.street_label[idx],
+            highway=self.highway[idx],
+            lanes=self.lanes[idx],
+            length_m=self.length_m[idx],
+            coords=self.coords[rows],
+            offsets=offsets,
+            corridor_id=None if self.corridor_id is None else self.corridor_id[idx],
+            _wgs84=None if self._wgs84 is None else self._wgs84[rows],
+        )
+
+    @property
+    def nbytes(self) -> int:
+        n = sum(a.nbytes for a in (self.key, self.edge_u, self.edge_v, self.edge_key, self.length_m,
+                                   self.coords, self.offsets))
+        for cat in (self.street_label, self.highway, self.lanes, self.corridor_id):
+            if cat is not None:
+                n += cat.codes.nbytes + int(pd.Series(cat.categories).memory_usage(deep=True))
+        return n + (self._wgs84.nbytes if self._wgs84 is not None else 0)
+
+    # ----- construction -----
+
+    @classmethod
+    def from_geodataframe(cls, gdf, metric_crs: Optional[str] = None) -> "SegmentTable":
+        """Compact a segments GeoDataFrame (e.g. read back from {abbr}_segments.parquet)."""
+        import shapely
+
+        metric_crs = metric_crs or pick_metric_crs(gdf)
+        df = gdf.reset_index(drop=True)
+        edge = df.groupby(["parent_u", "parent_v", "parent_key"], sort=False, dropna=False).ngroup().to_numpy()
+        first = np.unique(edge, return_index=True)[1]
+        if "segment_id" in df.columns:
+            part = df["segment_id"].astype(str).str.extract(r"_p(\d+)$")[0]
+            part = part.fillna(-1).astype(np.int64).to_numpy()
+        else:
+            part = np.full(len(df), -1, dtype=np.int64)
+        if (part < 0).any():
+            part = np.where(part < 0, pd.Series(edge).groupby(edge).cumcount().to_numpy(), part)
+
+        geoms = df.to_crs(metric_crs).geometry.to_numpy() if df.crs is not None else df.geometry.to_numpy()
+        coords = shapely.get_coordinates(geoms)
+        offsets = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(shapely.get_num_coordinates(geoms), out=offsets[1:])
+
+        length = df["length_m"].to_numpy(dtype=np.float32) if "length_m" in df.columns \
+            else shapely.length(geoms).astype(np.float32)
+        col = lambda c: df[c] if c in df.columns else pd.Series([None] * len(df))
+        return cls(
+            key=pack_keys(edge, part),
+            edge_u=df["parent_u"].to_numpy(dtype=np.int64)[first],
+            edge_v=df["parent_v"].to_numpy(dtype=np.int64)[first],
+            edge_key=df["parent_key"].to_numpy(dtype=np.int32)[first],
+            street_label=as_categorical(col("street_label")),
+            highway=as_categorical(col("highway")),
+            lanes=as_categorical(col("lanes")),
+            length_m=length,
+            coords=coords,
+            offsets=offsets,
+            crs=metric_crs,
+            corridor_id=as_categorical(df["corridor_id"]) if "corridor_id" in df.columns else None,
+        )
+
+
+def pick_metric_crs(gdf) -> str:
+    """UTM zone of the layer's WGS84 bounds centre (good enough for city scale)."""
+    west, south, east, north = gdf.total_bounds
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        from pyproj import Transformer
+
+        west, south, east, north = Transformer.from_crs(gdf.crs, WGS84, always_xy=True).transform_bounds(
+            west, south, east, north)
+    return utm_crs((west + east) / 2, (south + north) / 2)
+
+
+def utm_crs(lon: float, lat: float) -> str:
+    """UTM zone CRS containing a WGS84 point."""
+    zone = int((lon + 180) // 6) + 1
+    return f"EPSG:{(32700 if lat < 0 else 32600) + zone}"
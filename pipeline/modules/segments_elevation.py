@@ -2,31 +2,36 @@
 Join 30 m elevation points to SBAFN segments via buffer, with centroid fallback.
 
 Inputs
-- segments: GeoJSON/GeoParquet/GeoPackage (LineString), WGS84 or any CRS
-- elevation CSV: lon, lat, elev (column names are auto-detected heuristically)
+- segments: GeoParquet/GeoJSON/GeoPackage (LineString), WGS84 or any CRS,
+  or an in-memory SegmentTable (already projected; string ids are added to the output only)
+- elevation grid: Parquet or CSV with lon, lat, elev (column names are auto-detected heuristically)
 
 Outputs
-- CSV: segments with elevation features per segment
+- table (Parquet, or CSV by suffix): segments with elevation features per segment
     {segment_id, corridor_id?, street_label?, length_m?,
      elev_mean, elev_min, elev_p10, elev_p90, elev_max, elev_range,
      elev_start, elev_end, grade_pct,
      n_elev_pts_used, attach_method}
 
 Method
-1) Project to EPSG:32651 (UTM 51N) for Manila so distances are meters.
-2) Build a small buffer around each segment (default 15 m) and sjoin elevation points inside.
-3) If no points land in the buffer, fallback: take the nearest elevation point to the segment centroid within max_nn (default 60 m).
+1) Project to EPSG:32651 (UTM 51N) for Manila so distances are meters (a SegmentTable is already projected).
+2) One STRtree query pairs every segment with the elevation points within its buffer (default 15 m);
+   mean/min/p10/p90/max/range are reduced for all segments at once (sorted codes + np.add.reduceat).
+3) If no points land in the buffer, fallback: take the nearest elevation point to the segment centroid
+   within max_nn (default 60 m), as one bulk nearest query; attach_method = buffer | fallback | none.
 4) For grade, sample start and end by taking the nearest elevation point to each endpoint (independent of buffer).
 
 Usage
-    python segments_elevation_join.py \
-      --segments pipeline/outputs/mnl_segments.geojson \
-      --elev_csv pipeline/outputs/manila_city_30m_grid_cityonly.csv \
-      --out_csv pipeline/outputs/mnl_segments_with_elevation.csv
+    python -m pipeline.modules.segments_elevation \
+      --segments pipeline/outputs/mnl_segments.parquet \
+      --elev_data data/dem/mnl_30m_grid.parquet \
+      --out pipeline/outputs/mnl_pu_features.parquet
 
 Notes
 - Assumes elevation is ground elevation; bridges/tunnels are not corrected here.
 - Tune --buf_m and --max_nn_m if your grid resolution differs.
+- elev_start / elev_end often hit the same 30 m cell on a 30 m segment; elevation_profile.py samples
+  the DEM raster every 5 m and gives grade_robust_pct, the grade used by the risk rules.
 """
 from __future__ import annotations
 
@@ -35,8 +40,11 @@ from pathlib import Path
 from typing import Tuple
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point
+
+from pipeline.modules.segment_table import SegmentTable
+from pipeline.modules.table_io import read_table, write_table
 
 UTM_MNL = "EPSG:32651"  # UTM 51N
 WGS84 = "EPSG:4326"
@@ -75,7 +83,7 @@ def detect_cols(df: pd.DataFrame) -> Tuple[str, str, str]:
 
 def build_elev_gdf(elev_data: pd.DataFrame | Path) -> gpd.GeoDataFrame:
     if isinstance(elev_data, Path):
-        elev_df = pd.read_csv(elev_data)
+        elev_df = read_table(elev_data)
     else:
         elev_df = elev_data
 
@@ -86,113 +94,128 @@ def build_elev_gdf(elev_data: pd.DataFrame | Path) -> gpd.GeoDataFrame:
     return gdf
 
 
-def summarize(vals: pd.Series) -> dict:
-    v = vals.dropna().astype(float)
-    if v.empty:
-        return {"elev_mean": None, "elev_min": None, "elev_p10": None, "elev_p90": None, "elev_max": None, "elev_range": None}
-    return {
-        "elev_mean": float(v.mean()),
-        "elev_min": float(v.min()),
-        "elev_p10": float(v.quantile(0.10)),
-        "elev_p90": float(v.quantile(0.90)),
-        "elev_max": float(v.max()),
-        "elev_range": float(v.max() - v.min()),
+STAT_COLS = ["elev_mean", "elev_min", "elev_p10", "elev_p90", "elev_max", "elev_range"]
+
+
+def grouped_stats(codes: np.ndarray, values: np.ndarray, n_groups: int) -> tuple[dict, np.ndarray]:
+    """
+    mean/min/p10/p90/max/range of `values` per group code in [0, n_groups), all groups at once.
+    Quantiles use linear interpolation (pandas' default). Empty groups get NaN.
+    Returns (stats dict of float64 arrays, counts).
+    """
+    order = np.lexsort((values, codes))          # by group, then by value within group
+    codes, values = codes[order], values[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.zeros(n_groups, dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    has = counts > 0
+    g_start, g_n = starts[has], counts[has]
+
+    def quantile(q):
+        pos = (g_n - 1) * q
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, g_n - 1)
+        v_lo, v_hi = values[g_start + lo], values[g_start + hi]
+        return v_lo + (v_hi - v_lo) * (pos - lo)
+
+    def full(x):
+        out = np.full(n_groups, np.nan)
+        out[has] = x
+        return out
+
+    vmin, vmax = values[g_start], values[g_start + g_n - 1]
+    stats = {
+        "elev_mean": full(np.add.reduceat(values, g_start) / g_n) if len(g_start) else full([]),
+        "elev_min": full(vmin),
+        "elev_p10": full(quantile(0.10)),
+        "elev_p90": full(quantile(0.90)),
+        "elev_max": full(vmax),
+        "elev_range": full(vmax - vmin),
     }
+    return stats, counts
 
 
-def nearest_value(point_geom, elev_gdf_utm: gpd.GeoDataFrame, max_nn_m: float) -> Tuple[float | None, float | None]:
-    # returns (elev, dist_m)
-    # use sjoin_nearest with a max distance cap
-    try:
-        joined = gpd.sjoin_nearest(
-            gpd.GeoDataFrame(geometry=[point_geom], crs=elev_gdf_utm.crs),
-            elev_gdf_utm[["elev","geometry"]],
-            how="left",
-            distance_col="dist_m",
-            max_distance=max_nn_m
-        )
-        if joined.empty or pd.isna(joined.iloc[0].get("elev")):
-            return None, None
-        return float(joined.iloc[0]["elev"]), float(joined.iloc[0]["dist_m"])
-    except Exception:
-        return None, None
+def nearest_values(tree, tree_values: np.ndarray, points: np.ndarray, max_nn_m: float) -> np.ndarray:
+    """Value of the nearest tree point within max_nn_m for each query point (NaN when none); one bulk query."""
+    out = np.full(len(points), np.nan)
+    if not len(points):
+        return out
+    (q_idx, t_idx) = tree.query_nearest(points, max_distance=max_nn_m, all_matches=False)
+    out[q_idx] = tree_values[t_idx]
+    return out
 
 
 def join_elevation_to_segments(
-    segments_gpd: gpd.GeoDataFrame,
+    segments_gpd: gpd.GeoDataFrame | SegmentTable,
     elev_data: pd.DataFrame | Path,
     buf_m: float = 15.0,
     max_nn_m: float = 60.0,
-) -> Path:
-    
-    seg = segments_gpd
+) -> pd.DataFrame:
+    """
+    Per-segment elevation features as one columnar pass:
+    buffer join (STRtree dwithin) → grouped stats; centroid nearest-point fallback for segments
+    with no point in their buffer; bulk endpoint nearest lookups for grade.
+    """
+    import shapely
+
+    table = segments_gpd if isinstance(segments_gpd, SegmentTable) else None
     elev = build_elev_gdf(elev_data)
-
-    # 2) Project to metric
-    seg_utm = seg.to_crs(UTM_MNL)
-    elev_utm = elev.to_crs(UTM_MNL)
-
-    # 3) Buffer-join points inside buffer
-    seg_buf = seg_utm.copy()
-    seg_buf["geometry"] = seg_buf.geometry.buffer(buf_m)
-
-    # sjoin points to buffers
-    joined = gpd.sjoin(elev_utm[["elev","geometry"]], seg_buf[["geometry","segment_id"]], predicate="within", how="left")
-    # group points by segment
-    grp = joined.dropna(subset=["segment_id"]).groupby("segment_id")["elev"]
-
-    # Index for quick segment lookup
-    seg_utm = seg_utm.set_index("segment_id")
-    rows = []
-    for _, row in seg.iterrows():
-        segid = row.get("segment_id")
-        if pd.isna(segid):
-            continue
-
-        # buffer stats (or None)
-        if segid in grp.groups:
-            vals = grp.get_group(segid)
-            stats = summarize(vals)
-            n_used = int(vals.notna().sum())
-            method = "buffer"
-        else:
-            stats = {k: None for k in ["elev_mean","elev_min","elev_p10","elev_p90","elev_max","elev_range"]}
-            n_used = 0
-            method = "fallback"
-
-        # grade via nearest to endpoints
-        geom_utm = seg_utm.loc[segid].geometry
-        start_pt = geom_utm.interpolate(0.0, normalized=True)
-        end_pt = geom_utm.interpolate(1.0, normalized=True)
-        elev_start, _ = nearest_value(start_pt, elev_utm, max_nn_m)
-        elev_end, _ = nearest_value(end_pt, elev_utm, max_nn_m)
-
-        length_m = row.get("length_m")
-        try:
-            length_m = float(length_m)
-        except Exception:
-            length_m = float(geom_utm.length)
-
-        grade_pct = ((elev_end - elev_start) / length_m * 100.0) if (
-            elev_start is not None and elev_end is not None and length_m and length_m > 0
-        ) else None
-
-        rows.append({
-            "segment_id": segid,
-            **stats,
-            "elev_start": elev_start,
-            "elev_end": elev_end,
-            "grade_pct": grade_pct,
-            "n_elev_pts_used": n_used,
-            "attach_method": method,
-        })
-
-    metrics_df = pd.DataFrame(rows)
-
-    # 4) Merge ALL original segment attributes (except geometry) into the output
-    seg_attrs = seg.drop(columns=["geometry"], errors="ignore").copy()
-    out_df = metrics_df.merge(seg_attrs, on="segment_id", how="left")
-    return out_df
+    elev = elev[elev["elev"].notna()]
+
+    # 1) Project to metric (a SegmentTable already holds projected vertices)
+    if table is not None:
+        geoms = table.geometry()
+        seg_attrs = table.attributes().drop(columns=["segment_key"])
+        seg_ids = None
+        length_m = table.length_m.astype(np.float64)
+        metric = table.crs
+    else:
+        seg = segments_gpd[segments_gpd["segment_id"].notna()]
+        geoms = seg.to_crs(UTM_MNL).geometry.to_numpy()
+        seg_attrs = seg.drop(columns=["geometry"], errors="ignore").reset_index(drop=True)
+        seg_ids = seg_attrs.pop("segment_id").to_numpy()
+        length_m = pd.to_numeric(seg_attrs["length_m"], errors="coerce").to_numpy(dtype=np.float64) \
+            if "length_m" in seg_attrs.columns else np.full(len(seg), np.nan)
+        metric = UTM_MNL
+    n = len(geoms)
+    length_m = np.where(np.isfinite(length_m), length_m, shapely.length(geoms))
+
+    pts = elev.to_crs(metric).geometry.to_numpy()
+    pt_elev = elev["elev"].to_numpy(dtype=np.float64)
+    tree = shapely.STRtree(pts)
+
+    # 2) Points within buf_m of each segment (≡ inside its buffer), reduced per segment
+    seg_idx, pt_idx = tree.query(geoms, predicate="dwithin", distance=buf_m)
+    stats, n_used = grouped_stats(seg_idx, pt_elev[pt_idx], n)
+
+    # 3) Fallback: nearest point to the centroid within max_nn_m, for segments with an empty buffer
+    method = np.where(n_used > 0, "buffer", "none").astype(object)
+    empty = np.flatnonzero(n_used == 0)
+    if len(empty):
+        nn = nearest_values(tree, pt_elev, shapely.centroid(geoms[empty]), max_nn_m)
+        hit = np.isfinite(nn)
+        for col in ("elev_mean", "elev_min", "elev_p10", "elev_p90", "elev_max"):
+            stats[col][empty[hit]] = nn[hit]
+        stats["elev_range"][empty[hit]] = 0.0
+        method[empty[hit]] = "fallback"
+
+    # 4) Grade from the nearest point to each endpoint (independent of the buffer)
+    ends = nearest_values(tree, pt_elev, np.concatenate([shapely.get_point(geoms, 0), shapely.get_point(geoms, -1)]), max_nn_m)
+    elev_start, elev_end = ends[:n], ends[n:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grade_pct = np.where(length_m > 0, (elev_end - elev_start) / length_m * 100.0, np.nan)
+
+    # 5) Columnar output: features, then ALL original segment attributes (except geometry)
+    out_df = pd.DataFrame({
+        "segment_id": table.segment_ids() if table is not None else seg_ids,
+        **stats,
+        "elev_start": elev_start,
+        "elev_end": elev_end,
+        "grade_pct": grade_pct,
+        "n_elev_pts_used": n_used,
+        "attach_method": method,
+    })
+    return pd.concat([out_df, seg_attrs.reset_index(drop=True)], axis=1)
 
 # -----------------------------
 # CLI
@@ -201,16 +224,19 @@ if __name__ == "__main__":
     p = argparse.ArgumentParser()
     p.add_argument("--segments", type=Path, required=True)
     p.add_argument("--elev_data", type=Path, required=True)
-    p.add_argument("--out_csv", type=Path, required=True)
+    p.add_argument("--out", type=Path, required=True, help=".parquet (default) or .csv")
     p.add_argument("--buf_m", type=float, default=15.0)
     p.add_argument("--max_nn_m", type=float, default=60.0)
     args = p.parse_args()
 
-    path = join_elevation_to_segments(
-        segments_gpd=args.segments,
+    out_df = join_elevation_to_segments(
+        segments_gpd=read_table(args.segments),
         elev_data=args.elev_data,
-        out_csv_path=args.out_csv,
         buf_m=args.buf_m,
         max_nn_m=args.max_nn_m,
     )
-    print(f"Wrote {path}")
+    if args.out.suffix.lower() == ".csv":
+        out_df.to_csv(args.out, index=False)
+    else:
+        write_table(out_df, args.out)
+    print(f"Wrote {args.out}")
@@ -5,28 +5,32 @@ Inputs
 - edges_gdf: GeoDataFrame from osmnx.graph_to_gdfs(G) (edges), WGS84 (epsg:4326) or any CRS
 
 Outputs
-- segments_gdf: intersection-to-intersection edges (optionally split to target length)
-  columns (suggested):
-    segment_id, parent_u, parent_v, parent_key, corridor_id (filled after make_corridors),
-    street_label, highway,  lanes, length_m, geometry (LineString)
+- segments: intersection-to-intersection edges (optionally split to target length)
+    make_segment_table(): compact SegmentTable (packed int64 keys, categoricals, float32,
+                          projected vertex arrays; see segment_table.py)
+    make_segments():      the same as a GeoDataFrame, columns:
+      segment_id, parent_u, parent_v, parent_key, corridor_id (filled after make_corridors),
+      street_label, highway,  lanes, length_m, geometry (LineString)
 
 - corridors_gdf: connected pieces per normalized name
   columns: corridor_id, name, n_segments, total_length_m, highway, geometry
 
 Notes
-- Project to a metric CRS for length-based splitting; default uses UTM zone from centroid (safe for city scale)
+- Project to a metric CRS for length-based splitting; default uses UTM zone from the bounds centre (safe for city scale)
 - Name normalization prefers `name`; falls back to `ref` then `highway`
 - Handles `name`/`highway` lists from OSMnx by taking first non-null item
 - Dual carriageways remain separate corridors; optional merge hook included
 """
 from __future__ import annotations
+from dataclasses import replace
 from typing import Optional
 
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import LineString
+import shapely
 import numpy as np
-import networkx as nx
+
+from pipeline.modules.segment_table import SegmentTable, as_categorical, pack_keys, pick_metric_crs
 
 # -----------------------------
 # Utility helpers
@@ -41,249 +45,209 @@ def _first_non_null(value):
     return value if (pd.notna(value) and str(value).strip()) else None
 
 
-def _normalize_street_label(row: pd.Series) -> str:
-    name = _first_non_null(row.get("name"))
-    ref = _first_non_null(row.get("ref"))
-    hw  = _first_non_null(row.get("highway"))
-    label = name or ref or hw or "unnamed"
-    return str(label)
-
-
-def _pick_metric_crs(gdf: gpd.GeoDataFrame) -> str:
-    """Choose a UTM zone based on the geometry centroid (good enough for city scale)."""
-    # EPSG:4326 expected; get centroid lon/lat
-    centroid = gdf.to_crs(4326).unary_union.centroid
-    lon, lat = centroid.x, centroid.y
-    zone = int((lon + 180) // 6) + 1
-    south = lat < 0
-    epsg = 32700 + zone if south else 32600 + zone  # 326XX = UTM north, 327XX = UTM south
-    return f"EPSG:{epsg}"
-
-
-def _explode_linestring(ls: LineString, max_len: float) -> list[LineString]:
-    """Split a LineString into ~equal subsegments not exceeding max_len (meters)."""
-    if max_len is None or ls.length <= max_len:
-        return [ls]
-    # number of cuts = ceil(total/max_len)
-    n = int(np.ceil(ls.length / max_len))
-    if n <= 1:
-        return [ls]
-    # sample points along the line at equal fractions
-    fracs = np.linspace(0, 1, n + 1)
-    pts = [ls.interpolate(d, normalized=True) for d in fracs]
-    parts = []
-    for i in range(len(pts) - 1):
-        seg = LineString([pts[i], pts[i+1]])
-        # preserve curvature by densifying against original? For now keep straight chord; 
-        # if geometry has many vertices, consider segmentize before splitting.
-        parts.append(seg)
-    return parts
+def _split_coords(geoms: np.ndarray, split_len_m: Optional[float]):
+    """
+    Split each line into ceil(length / split_len_m) equal parts (straight chords between
+    equally spaced points), vectorized over a geometry array.
+    Returns (edge index, part index, vertex array, CSR offsets) for the resulting segments.
+    """
+    lengths = shapely.length(geoms)
+    n_parts = np.ones(len(geoms), dtype=np.int64)
+    if split_len_m:
+        long_ = lengths > split_len_m
+        n_parts[long_] = np.ceil(lengths[long_] / split_len_m).astype(np.int64)
+    split = n_parts > 1
+
+    edge = np.repeat(np.arange(len(geoms)), n_parts)
+    first_seg = np.zeros(len(geoms) + 1, dtype=np.int64)
+    np.cumsum(n_parts, out=first_seg[1:])
+    part = np.arange(len(edge)) - first_seg[edge]
+
+    # vertex counts: full geometry for unsplit edges, 2-point chords for split ones
+    n_vertices = np.where(split, 2, shapely.get_num_coordinates(geoms))[edge]
+    offsets = np.zeros(len(edge) + 1, dtype=np.int64)
+    np.cumsum(n_vertices, out=offsets[1:])
+    coords = np.empty((offsets[-1], 2), dtype=np.float64)
+
+    whole = np.flatnonzero(~split)
+    if len(whole):
+        xy, owner = shapely.get_coordinates(geoms[whole], return_index=True)
+        seg = first_seg[whole][owner]
+        within = np.arange(len(owner)) - np.searchsorted(owner, owner)
+        coords[offsets[seg] + within] = xy
+
+    cut = np.flatnonzero(split)
+    if len(cut):
+        # n+1 equally spaced points per split edge; chord j runs from point j to j+1
+        n = n_parts[cut]
+        rep = np.repeat(np.arange(len(cut)), n + 1)
+        pt_start = np.zeros(len(cut) + 1, dtype=np.int64)
+        np.cumsum(n + 1, out=pt_start[1:])
+        j = np.arange(len(rep)) - pt_start[rep]
+        pts = shapely.get_coordinates(shapely.line_interpolate_point(geoms[cut][rep], j / n[rep], normalized=True))
+        seg_rep = np.repeat(np.arange(len(cut)), n)
+        k = np.arange(len(seg_rep)) - (pt_start[seg_rep] - seg_rep)      # part index within its edge
+        seg = first_seg[cut][seg_rep] + k
+        a = pt_start[seg_rep] + k
+        coords[offsets[seg]] = pts[a]
+        coords[offsets[seg] + 1] = pts[a + 1]
+    return edge, part, coords, offsets
 
 # -----------------------------
 # Public API
 # -----------------------------
 
-def make_segments(
+def make_segment_table(
     edges_gdf: gpd.GeoDataFrame,
     split_len_m: Optional[int] = 30,
     metric_crs: Optional[str] = None,
-) -> gpd.GeoDataFrame:
+) -> SegmentTable:
     """
-    Build model-ready "segments" from OSMnx edges.
+    Build model-ready "segments" from OSMnx edges as a compact SegmentTable.
 
-    - Normalizes street names to `street_label`
-    - Keeps key attributes
+    - Normalizes street names to `street_label` (categorical)
+    - Keeps highway / lanes (categorical) and parent edge ids (packed int64 keys)
     - Optionally splits long edges into ~split_len_m chunks (in meters)
-
-    Returns GeoDataFrame in EPSG:4326 with columns:
-      segment_id, parent_u, parent_v, parent_key, street_label,
-      highway, lanes, length_m, geometry
+    - Geometry is kept once, as projected vertex arrays in `metric_crs`
     """
-
-    # [ERROR HANDLING] If `edges_gdf` is empty, return an empty gpd (projected EPSG:4326)
-    if edges_gdf.empty:
-        return gpd.GeoDataFrame(columns=[
-            "segment_id","parent_u","parent_v","parent_key",
-            "street_label","highway","lanes","length_m","geometry"
-        ], geometry="geometry", crs="EPSG:4326")
-
-    edges = edges_gdf.reset_index().copy()
+    if metric_crs is None:
+        metric_crs = pick_metric_crs(edges_gdf) if not edges_gdf.empty else "EPSG:32651"
+    edges = edges_gdf.reset_index()
 
     # normalize columns
-    for col in ("name", "ref", "highway"):
+    for col in ("u", "v", "key", "name", "ref", "highway", "lanes"):
         if col not in edges.columns:
             edges[col] = None
 
-    edges["street_label"] = edges.apply(_normalize_street_label, axis=1)
-
-    keep_cols = [
-        "u", "v", "key", "street_label", "highway", "lanes", "geometry"
-    ]
-    for c in keep_cols:
-        if c not in edges.columns:
-            edges[c] = None
-    edges = edges[keep_cols].copy()
-
+    name, ref, hw = (edges[c].map(_first_non_null) for c in ("name", "ref", "highway"))
+    street_label = name.fillna(ref).fillna(hw).fillna("unnamed").astype(str)
     # flatten list-like columns to scalars (Parquet-safe)
-    for col in ("highway", "lanes"):
-        edges[col] = edges[col].apply(lambda v: _first_non_null(v) if isinstance(v, (list, tuple)) else v)
-
-    # project to metric for splitting/lengths
-    metric = metric_crs or _pick_metric_crs(edges)
-    wm = edges.to_crs(metric)
-
-    rows = []
-    for idx, r in wm.iterrows():
-        geom: LineString = r.geometry
-        parts = _explode_linestring(geom, split_len_m) if split_len_m else [geom]
-        for j, p in enumerate(parts):
-            length_m = float(p.length)
-            seg = {
-                "parent_u": r["u"],
-                "parent_v": r["v"],
-                "parent_key": r["key"],
-                "street_label": r["street_label"],
-                "highway": r.get("highway"),
-                "lanes": r.get("lanes"),
-                "length_m": length_m,
-                "_part": j,
-                "geometry": p,
-            }
-            rows.append(seg)
-
-    segs = gpd.GeoDataFrame(rows, crs=metric)
-
-    # build stable segment_id from parent edge and part index
-    segs["segment_id"] = (
-        segs["parent_u"].astype(str) + "_" + segs["parent_v"].astype(str) + "_" +
-        segs["parent_key"].astype(str) + "_p" + segs["_part"].astype(str)
+    lanes = edges["lanes"].map(lambda v: _first_non_null(v) if isinstance(v, (list, tuple)) else v)
+
+    geoms = edges.geometry.to_crs(metric_crs).to_numpy() if not edges.empty else np.array([], dtype=object)
+    edge, part, coords, offsets = _split_coords(geoms, split_len_m)
+    seg_len = shapely.length(shapely.linestrings(coords, indices=np.repeat(np.arange(len(edge)), np.diff(offsets)))) \
+        if len(edge) else np.array([], dtype=np.float64)
+
+    return SegmentTable(
+        key=pack_keys(edge, part),
+        edge_u=edges["u"].to_numpy(dtype=np.int64),
+        edge_v=edges["v"].to_numpy(dtype=np.int64),
+        edge_key=edges["key"].fillna(0).to_numpy(dtype=np.int32),
+        street_label=pd.Categorical(street_label.to_numpy()[edge]),
+        highway=as_categorical(hw.to_numpy()[edge]),
+        lanes=as_categorical(lanes.to_numpy()[edge]),
+        length_m=seg_len.astype(np.float32),
+        coords=coords,
+        offsets=offsets,
+        crs=metric_crs,
     )
-    segs = segs.drop(columns=["_part"])  # internal
 
-    # back to WGS84 for storage/web
-    segs = segs.to_crs(4326)
-    segs = segs[
-        [
-            "segment_id", "parent_u", "parent_v", "parent_key",
-            "street_label", "highway", "lanes", "length_m", "geometry",
-        ]
-    ]
-    return segs
+
+def make_segments(
+    edges_gdf: gpd.GeoDataFrame,
+    split_len_m: Optional[int] = 30,
+    metric_crs: Optional[str] = None,
+) -> gpd.GeoDataFrame:
+    """
+    GeoDataFrame form of make_segment_table() (EPSG:4326) with columns:
+      segment_id, parent_u, parent_v, parent_key, street_label,
+      highway, lanes, length_m, geometry
+    """
+    return make_segment_table(edges_gdf, split_len_m=split_len_m, metric_crs=metric_crs).to_geodataframe()
+
+
+def _corridor_components(table: SegmentTable) -> np.ndarray:
+    """
+    Connected component per segment, over the (street_label, parent node) graph: segments of the
+    same label that share a parent node belong to the same corridor. Components are numbered per
+    label in order of first appearance (0, 1, ...).
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    label = table.street_label.codes.astype(np.int64)
+    # one graph node per (label, osm node)
+    pairs = pd.MultiIndex.from_arrays([np.r_[label, label], np.r_[table.parent_u, table.parent_v]])
+    node, _ = pd.factorize(pairs)
+    n = len(table)
+    m = int(node.max()) + 1
+    graph = coo_matrix((np.ones(n, dtype=np.int8), (node[:n], node[n:])), shape=(m, m))
+    _, comp = connected_components(graph, directed=False)
+    seg_comp = comp[node[:n]]
+    # renumber per label by first appearance
+    first = pd.Series(np.arange(n)).groupby(seg_comp).transform("min").to_numpy()
+    return pd.Series(first).groupby(label).rank(method="dense").to_numpy(dtype=np.int64) - 1
 
 
 def make_corridors(
-    segments_gdf: gpd.GeoDataFrame,
+    segments,
     merge_dual: bool = False,
     merge_buffer_m: float = 8.0,
     metric_crs: Optional[str] = None,
-) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+):
     """
     Build human-friendly "corridors" by connected components per street_label.
 
-    Returns (corridors_gdf, segments_with_corridor_id)
-    - corridors columns: corridor_id, name, n_segments, total_length_m, highway, geometry
+    segments: SegmentTable (preferred) or a segments GeoDataFrame
+    Returns (corridors_gdf, segments_with_corridor_id), the latter in the type that was passed
+    - corridors columns: corridor_id, name, n_segments, total_length_m, highway, geometry (EPSG:4326)
     - segments gains: corridor_id
 
-    merge_dual: if True, merges dual carriageways with identical labels that sit within merge_buffer_m of each other
+    merge_dual: if True, merges dual carriageways with identical labels into one corridor per label
+    (merge_buffer_m is kept for API compatibility)
     """
-    segs = segments_gdf.copy()
-    if segs.empty:
-        return gpd.GeoDataFrame(columns=["corridor_id", "name", "n_segments", "total_length_m", "highway", "geometry"], crs=segs.crs), segs
-
-    # ensure label
-    if "street_label" not in segs.columns:
-        raise ValueError("segments_gdf must contain 'street_label'")
-
-    # compute a dominant highway type per corridor later
-    if "highway" not in segs.columns:
-        segs["highway"] = None
-
-    # work in metric for dissolves/buffers
-    metric = metric_crs or _pick_metric_crs(segs)
-    wm = segs.to_crs(metric)
-
-    # map from segment_id to corridor_id
-    corr_ids = []
-
-    grouped = wm.groupby("street_label", dropna=False)
-    for name, df in grouped:
-        # Build undirected graph on parent nodes (works even after splitting because we still carry parent_u/v)
-        Gname = nx.Graph()
-        Gname.add_edges_from(df[["parent_u", "parent_v"]].dropna().itertuples(index=False, name=None))
-        if Gname.number_of_edges() == 0 and len(df) > 0:
-            # isolated single-segment with missing parent ids; treat as one component
-            comps = [set(range(len(df)))]
-            comp_index_by_row = {i:0 for i in range(len(df))}
-        else:
-            comps = list(nx.connected_components(Gname))
-            # Assign rows to components by matching their parent_u nodes
-            node_to_comp = {}
-            for i, comp in enumerate(comps):
-                for n in comp:
-                    node_to_comp[n] = i
-            comp_index_by_row = df["parent_u"].map(node_to_comp).fillna(0).astype(int).to_dict()
-
-        # Apply IDs
-        slug = str(name or "unnamed").lower().strip().replace(" ", "_")
-        # Guarantee uniqueness by adding component index
-        local_ids = []
-        for ridx, r in df.reset_index().iterrows():
-            comp_idx = comp_index_by_row.get(r["parent_u"], 0)
-            local_ids.append(f"{slug}_{comp_idx}")
-        corr_ids.extend(local_ids)
-
-    wm["corridor_id"] = corr_ids
-
-    # Optional: merge dual carriageways by buffering and dissolving corridors with same name that touch within buffer
+    corridor_cols = ["corridor_id", "name", "n_segments", "total_length_m", "highway", "geometry"]
+    as_gdf = not isinstance(segments, SegmentTable)
+    if as_gdf:
+        if segments.empty:
+            return gpd.GeoDataFrame(columns=corridor_cols, crs=segments.crs), segments.copy()
+        # ensure label
+        if "street_label" not in segments.columns:
+            raise ValueError("segments_gdf must contain 'street_label'")
+        table = SegmentTable.from_geodataframe(segments, metric_crs=metric_crs)
+    else:
+        table = segments
+        if table.empty:
+            return gpd.GeoDataFrame(columns=corridor_cols, crs=4326), table
+
+    slug = pd.Series(table.street_label.categories).str.lower().str.strip().str.replace(" ", "_", regex=False)
+    label_slug = slug.to_numpy()[table.street_label.codes]
     if merge_dual:
-        # dissolve by (name, corridor_id) first to get clean pieces
-        base = wm.dissolve(by=["street_label", "corridor_id"], aggfunc={})
-        base = base.reset_index()
-        # group by name, buffer, dissolve overlaps
-        merged_rows = []
-        for name, df in base.groupby("street_label", dropna=False):
-            buf = df.copy()
-            buf["geometry"] = buf.geometry.buffer(merge_buffer_m)
-            # dissolve overlapping buffers, then carry original geometry union
-            buf_diss = buf.dissolve()
-            # map dissolved parts back is non-trivial; keep simple: one merged geometry per name
-            geom_union = df.geometry.unary_union
-            merged_rows.append({
-                "street_label": name,
-                "geometry": geom_union
-            })
-        merged = gpd.GeoDataFrame(merged_rows, crs=metric)
-        merged["corridor_id"] = merged["street_label"].str.lower().str.replace(" ", "_", regex=False)
-        corridors = merged
-        # assign segments to merged corridors by name match
-        wm = wm.merge(corridors[["street_label", "corridor_id"]], on="street_label", suffixes=("", "_merged"))
-        wm["corridor_id"] = wm["corridor_id_merged"]
-        wm = wm.drop(columns=["corridor_id_merged"])
-
-    # Build corridors table (sum length, pick mode)
-    # Recompute length in metric CRS reliably
-    wm["_len"] = wm.geometry.length
-    agg = (
-        wm.groupby("corridor_id")
-          .agg(
-              name=("street_label", "first"),
-              n_segments=("segment_id", "count"),
-              total_length_m=("_len", "sum"),
-              highway=("highway", lambda s: s.dropna().iloc[0] if len(s.dropna()) else None),
-              geometry=("geometry", lambda g: g.unary_union)
-          )
-          .reset_index()
+        corridor = pd.Categorical(label_slug)
+    else:
+        corridor = pd.Categorical(pd.Series(label_slug) + "_" + pd.Series(_corridor_components(table)).astype(str))
+    table = replace(table, corridor_id=corridor)
+
+    # Build corridors table (sum length, pick first non-null highway, lines gathered per corridor)
+    codes = corridor.codes
+    geoms = table.geometry(4326)
+    frame = pd.DataFrame({"corridor": codes, "name": table.street_label, "highway": table.highway,
+                          "_len": shapely.length(table.geometry())})
+    agg = frame.groupby("corridor", sort=True, observed=True).agg(
+        name=("name", "first"),
+        n_segments=("_len", "size"),
+        total_length_m=("_len", "sum"),
+        highway=("highway", "first"),
     )
-    corridors = gpd.GeoDataFrame(agg, geometry="geometry", crs=metric).to_crs(4326)
-
-    # Attach corridor_id back onto segments (WGS84)
-    segs_out = wm[["segment_id", "corridor_id"]].merge(segs, on="segment_id", how="right")
-    segs_out = gpd.GeoDataFrame(segs_out, geometry="geometry", crs=segs.crs)
-
-    # Final tidy columns
-    corridors = corridors[["corridor_id", "name", "n_segments", "total_length_m", "highway", "geometry"]]
-
-    return corridors, segs_out
+    order = np.argsort(codes, kind="stable")
+    corridors = gpd.GeoDataFrame(
+        {
+            "corridor_id": corridor.categories[agg.index].astype(str),
+            "name": agg["name"].astype(str).to_numpy(),
+            "n_segments": agg["n_segments"].to_numpy(),
+            "total_length_m": agg["total_length_m"].to_numpy(),
+            "highway": agg["highway"].astype(object).to_numpy(),
+        },
+        geometry=shapely.multilinestrings(geoms[order], indices=codes[order]),
+        crs=4326,
+    )[corridor_cols]
+
+    if as_gdf:
+        segs_out = segments.copy()
+        segs_out.insert(1, "corridor_id", np.asarray(corridor.astype(str)))
+        return corridors, segs_out
+    return corridors, table
 
 # -----------------------------
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+"""
+GeoParquet/Arrow table I/O shared by SBAFN pipeline stages.
+
+Parquet is the native interchange format between stages:
+- geometry stored as WKB with GeoParquet metadata (+ per-row bbox covering column)
+- typed columns (int64 ids, float64 metrics, string labels) instead of CSV text
+- zstd compression, bounded row groups with min/max statistics for predicate pushdown
+- reads are memory-mapped by default
+
+CSV / GeoJSON are opt-in export sinks, selected per run with `formats`
+(config: `outputs.formats`, e.g. [parquet, csv, geojson]).
+
+Usage
+    from pipeline.modules.table_io import export_table, read_table
+
+    export_table(segments, OUTPUT_DIR / "mnl_segments", formats=["parquet", "geojson"])
+    segments = read_table(OUTPUT_DIR / "mnl_segments.parquet")
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pandas as pd
+
+DEFAULT_FORMATS = ("parquet",)
+ROW_GROUP_SIZE = 64_000
+COMPRESSION = "zstd"
+
+# Column dtypes enforced before writing segment-like tables
+SEGMENT_DTYPES = {
+    "segment_id": "string",
+    "corridor_id": "string",
+    "parent_u": "Int64",
+    "parent_v": "Int64",
+    "parent_key": "Int64",
+    "street_label": "string",
+    "highway": "string",
+    "lanes": "string",
+    "length_m": "float64",
+}
+
+
+def typed_columns(df: pd.DataFrame, dtypes: dict = SEGMENT_DTYPES) -> pd.DataFrame:
+    """Cast known columns to stable Arrow-friendly dtypes; list values are flattened to strings."""
+    out = df.copy()
+    for col, dtype in dtypes.items():
+        if col not in out.columns:
+            continue
+        s = out[col]
+        if s.dtype == object:
+            s = s.apply(lambda v: ", ".join(map(str, v)) if isinstance(v, (list, tuple)) else v)
+        if dtype == "Int64":
+            s = pd.to_numeric(s, errors="coerce")
+        out[col] = s.astype(dtype)
+    return out
+
+
+def flatten_list_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """OSMnx attributes mix scalars and lists in object columns; Arrow needs one type per column."""
+    out = df.copy()
+    for col in out.columns:
+        if col == "geometry" or out[col].dtype != object:
+            continue
+        if out[col].map(lambda v: isinstance(v, (list, tuple, set))).any():
+            out[col] = out[col].apply(lambda v: ", ".join(map(str, v)) if isinstance(v, (list, tuple, set)) else v)
+        out[col] = out[col].astype("string")
+    return out
+
+
+def write_table(
+    df: pd.DataFrame,
+    path: str | Path,
+    row_group_size: int = ROW_GROUP_SIZE,
+    compression: str = COMPRESSION,
+) -> Path:
+    """Write a (Geo)DataFrame as (Geo)Parquet. Geometry → WKB with GeoParquet metadata."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".part")
+
+    if hasattr(df, "geometry") and "geometry" in df.columns:
+        df.to_parquet(
+            tmp,
+            index=False,
+            compression=compression,
+            geometry_encoding="WKB",
+            write_covering_bbox=True,
+            row_group_size=row_group_size,
+            write_statistics=True,
+        )
+    else:
+        df.to_parquet(
+            tmp,
+            index=False,
+            compression=compression,
+            row_group_size=row_group_size,
+            write_statistics=True,
+        )
+    tmp.replace(path)
+    return path
+
+
+def read_table(
+    path: str | Path,
+    columns: Optional[list[str]] = None,
+    memory_map: bool = True,
+):
+    """
+    Read a table written by any stage. Parquet is memory-mapped; GeoParquet comes back as a
+    GeoDataFrame. CSV / GeoJSON / GeoPackage are still accepted for older outputs.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        geo = b"geo" in (pq.read_schema(path, memory_map=memory_map).metadata or {})
+        # Attribute-only reads of GeoParquet come back as a plain DataFrame
+        if geo and (columns is None or "geometry" in columns):
+            import geopandas as gpd
+
+            return gpd.read_parquet(path, columns=columns, memory_map=memory_map)
+        return pd.read_parquet(path, columns=columns, memory_map=memory_map)
+    if suffix == ".csv":
+        return pd.read_csv(path, usecols=columns)
+    if suffix in {".geojson", ".json", ".gpkg", ".shp"}:
+        import geopandas as gpd
+
+        gdf = gpd.read_file(path)
+        return gdf[columns] if columns else gdf
+    raise ValueError(f"Unsupported table format: {path}")
+
+
+def resolve_table(stem: str | Path, suffixes: Iterable[str] = (".parquet", ".csv", ".geojson")) -> Optional[Path]:
+    """First existing `stem.<suffix>`, preferring Parquet. None if nothing was written yet."""
+    stem = Path(stem)
+    for suffix in suffixes:
+        candidate = stem.with_suffix(suffix)
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def export_table(
+    df: pd.DataFrame,
+    stem: str | Path,
+    formats: Iterable[str] = DEFAULT_FORMATS,
+) -> dict[str, Path]:
+    """
+    Write `df` to `stem.parquet` plus any opt-in sinks ("csv", "geojson").
+    CSV drops geometry; GeoJSON is written in WGS84.
+    """
+    stem = Path(stem)
+    formats = set(formats) | {"parquet"}
+    written = {"parquet": write_table(df, stem.with_suffix(".parquet"))}
+
+    is_geo = hasattr(df, "geometry") and "geometry" in df.columns
+    if "csv" in formats:
+        out = stem.with_suffix(".csv")
+        df.drop(columns=["geometry"], errors="ignore").to_csv(out, index=False)
+        written["csv"] = out
+    if "geojson" in formats and is_geo:
+        out = stem.with_suffix(".geojson")
+        gdf = df if (df.crs is None or df.crs.to_epsg() == 4326) else df.to_crs(4326)
+        out.write_text(gdf.to_json(), encoding="utf-8")
+        written["geojson"] = out
+    return written
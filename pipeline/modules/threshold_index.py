@@ -0,0 +1,319 @@
+"""
+Precomputed rainfall-threshold index: which segments flood at X mm/hr, per AOI / corridor / barangay.
+
+Inputs
+- per-segment frame: segment_id, rain_threshold_mmhr (risk_scoring), length_m, and the group
+  columns (corridor_id; barangay when `threshold_index.barangay_path` polygons are configured)
+
+Outputs
+- {abbr}_threshold_index.bin, a compact little-endian binary (layout below)
+
+Method
+1) Per level (aoi, corridor_id, barangay), rows are sorted by (group, threshold). Segments that
+   never reach the score threshold (NaN) sort last as +inf.
+2) Flooded at X within a group = the prefix of its slice with threshold ≤ X: one binary search
+   (searchsorted) gives the count, and a cumulative-length array gives the total length.
+3) All-group summaries compare once against the sorted array and reduce per group slice.
+
+Binary layout (version 1)
+    b"SBTI" | u32 header_len | header (UTF-8 JSON) | zero pad to 8 | data (arrays 8-byte aligned)
+    header = {"version", "n", "ids": {...}, "levels": {name: {"groups": [...], "arrays": {...}}}}
+    each array entry: {"offset", "dtype", "count"}, with the offset from the start of the data section.
+    per level: offsets (u32, groups+1), thr (f32, sorted within group), order (u32 segment
+    ordinal), cumlen (f64, n+1, running length in level order)
+    ids: blob (UTF-8 segment_ids) + id_offsets (u32, n+1)
+
+Usage
+    from pipeline.modules.threshold_index import ThresholdIndex
+
+    idx = ThresholdIndex.build(frame, groups=["corridor_id"]); idx.save(path)
+    idx = ThresholdIndex.load(path)                         # mmap; arrays and ids are zero-copy views
+    idx.query(45.0)                                         # {"count", "length_m", ...} for the AOI
+    idx.query(45.0, level="corridor_id", group="rizal_avenue_1", ids=True)
+    idx.summary(45.0, level="corridor_id")                  # counts / lengths for every corridor
+
+Notes
+- A query is a dict lookup plus one searchsorted: microseconds, independent of AOI size.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import REPO_ROOT, OUTPUT_DIR, cfg_get
+
+MAGIC = b"SBTI"
+VERSION = 1
+AOI_LEVEL = "aoi"
+ALIGN = 8
+
+# ---------------------------------
+
+def _threshold_cfg() -> dict:
+    path = cfg_get("threshold_index", "barangay_path", default=None)
+    return {
+        "groups": list(cfg_get("threshold_index", "groups", default=["corridor_id", "barangay"])),
+        "barangay_path": REPO_ROOT / path if path else None,
+        "barangay_name_col": cfg_get("threshold_index", "barangay_name_col", default="name"),
+    }
+
+
+def assign_barangay(segments, polygons_path: Path, name_col: str = "name") -> pd.Series:
+    """Barangay name by segment_id (polygon containing the segment midpoint); NaN outside all polygons."""
+    import shapely
+    from pipeline.modules.segment_table import SegmentTable
+    from pipeline.modules.table_io import read_table
+
+    if isinstance(segments, SegmentTable):
+        ids, geoms = segments.segment_ids(), segments.geometry("EPSG:4326")
+    else:
+        ids, geoms = segments["segment_id"].to_numpy(), segments.to_crs(4326).geometry.to_numpy()
+    polys = read_table(polygons_path).to_crs(4326)
+    mids = shapely.line_interpolate_point(geoms, 0.5, normalized=True)
+    pt_idx, poly_idx = shapely.STRtree(polys.geometry.to_numpy()).query(mids, predicate="within")
+    out = np.full(len(mids), None, dtype=object)
+    out[pt_idx] = polys[name_col].astype(str).to_numpy()[poly_idx]
+    return pd.Series(out, index=ids)
+
+
+@dataclass
+class Level:
+    groups: list[str]
+    offsets: np.ndarray     # u32 (groups + 1)
+    thr: np.ndarray         # f32, ascending within each group slice
+    order: np.ndarray       # u32 segment ordinals, level order
+    cumlen: np.ndarray      # f64 (n + 1), running length in level order
+
+    def __post_init__(self):
+        self._code = {g: i for i, g in enumerate(self.groups)}
+
+    def code(self, group) -> int:
+        try:
+            return self._code[str(group)]
+        except KeyError:
+            raise KeyError(f"unknown group: {group}") from None
+
+    def flooded(self, rain_mmhr: float, code: int = 0) -> tuple[int, int]:
+        """[lo, lo + k) slice of level order flooded at `rain_mmhr` within group `code`."""
+        lo, hi = int(self.offsets[code]), int(self.offsets[code + 1])
+        return lo, int(np.searchsorted(self.thr[lo:hi], rain_mmhr, side="right"))
+
+
+class ThresholdIndex:
+    def __init__(self, id_blob: bytes, id_offsets: np.ndarray, levels: dict[str, Level], _buffer=None):
+        self.id_blob = id_blob          # UTF-8 segment_ids, back to back
+        self.id_offsets = id_offsets    # u32 (n + 1)
+        self.levels = levels
+        self._buffer = _buffer          # keeps the mmap alive for loaded indexes
+
+    def __len__(self) -> int:
+        return len(self.id_offsets) - 1
+
+    def segment_ids(self, rows: Iterable[int]) -> list[str]:
+        o = self.id_offsets
+        return [bytes(self.id_blob[o[i]:o[i + 1]]).decode("utf-8") for i in rows]
+
+    # ----- construction -----
+
+    @classmethod
+    def build(cls, frame: pd.DataFrame, groups: Iterable[str] = ("corridor_id",),
+              name: str = AOI_LEVEL) -> "ThresholdIndex":
+        """`frame`: segment_id, rain_threshold_mmhr, length_m and the group columns."""
+        thr = pd.to_numeric(frame["rain_threshold_mmhr"], errors="coerce").to_numpy(dtype=np.float32)
+        thr = np.where(np.isnan(thr), np.float32(np.inf), thr)
+        length = pd.to_numeric(frame.get("length_m", pd.Series(0.0, index=frame.index)), errors="coerce")
+        length = length.fillna(0.0).to_numpy(dtype=np.float64)
+
+        levels = {AOI_LEVEL: cls._level(np.zeros(len(frame), dtype=np.int64), [name], thr, length)}
+        for col in groups:
+            if col not in frame.columns:
+                print(f"[threshold] no `{col}` column; level skipped")
+                continue
+            vals = frame[col].astype(object).where(frame[col].notna(), None)
+            codes, uniques = pd.factorize(vals, sort=True)
+            levels[col] = cls._level(codes, [str(u) for u in uniques], thr, length)
+        encoded = [str(v).encode("utf-8") for v in frame["segment_id"]]
+        id_offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+        np.cumsum([len(b) for b in encoded], out=id_offsets[1:])
+        return cls(b"".join(encoded), id_offsets, levels)
+
+    @staticmethod
+    def _level(codes: np.ndarray, names: list[str], thr: np.ndarray, length: np.ndarray) -> Level:
+        keep = np.flatnonzero(codes >= 0)                         # rows without a group are left out
+        order = keep[np.lexsort((thr[keep], codes[keep]))]
+        offsets = np.zeros(len(names) + 1, dtype=np.uint32)
+        np.cumsum(np.bincount(codes[keep], minlength=len(names)), out=offsets[1:])
+        cumlen = np.zeros(len(order) + 1, dtype=np.float64)
+        np.cumsum(length[order], out=cumlen[1:])
+        return Level(names, offsets, thr[order], order.astype(np.uint32), cumlen)
+
+    # ----- queries -----
+
+    def level(self, level: str) -> Level:
+        try:
+            return self.levels[level]
+        except KeyError:
+            raise KeyError(f"unknown level: {level} (have {', '.join(self.levels)})") from None
+
+    def _code(self, level: str, group) -> int:
+        """Group code within `level`; only the single-group aoi level may omit `group`."""
+        if group is None:
+            if level != AOI_LEVEL:
+                raise ValueError(f"group is required for level {level}")
+            return 0
+        return self.level(level).code(group)
+
+    def flooded_rows(self, rain_mmhr: float, level: str = AOI_LEVEL, group=None) -> np.ndarray:
+        lv = self.level(level)
+        lo, k = lv.flooded(rain_mmhr, self._code(level, group))
+        return lv.order[lo:lo + k]
+
+    def query(self, rain_mmhr: float, level: str = AOI_LEVEL, group=None, ids: bool = False) -> dict:
+        """Flooded count / length (and optionally segment_ids) at `rain_mmhr` for one group."""
+        lv = self.level(level)
+        code = self._code(level, group)
+        lo, k = lv.flooded(rain_mmhr, code)
+        total = int(lv.offsets[code + 1]) - int(lv.offsets[code])
+        out = {
+            "level": level,
+            "group": lv.groups[code],
+            "rain_mmhr": float(rain_mmhr),
+            "count": k,
+            "total": total,
+            "length_m": round(float(lv.cumlen[lo + k] - lv.cumlen[lo]), 1),
+            "total_length_m": round(float(lv.cumlen[lo + total] - lv.cumlen[lo]), 1),
+        }
+        if ids:
+            out["segment_ids"] = self.segment_ids(lv.order[lo:lo + k])
+        return out
+
+    def summary(self, rain_mmhr: float, level: str = AOI_LEVEL) -> pd.DataFrame:
+        """Flooded count and length for every group of `level` (one pass over the sorted array)."""
+        lv = self.level(level)
+        hit = np.asarray(lv.thr) <= rain_mmhr
+        starts = np.asarray(lv.offsets[:-1], dtype=np.int64)
+        # Within each slice the thresholds ascend, so the hits are the slice prefix
+        counts = np.add.reduceat(hit.astype(np.int64), starts) if len(hit) else np.zeros(len(starts), dtype=np.int64)
+        counts[np.diff(lv.offsets) == 0] = 0
+        return pd.DataFrame({
+            "group": lv.groups,
+            "count": counts,
+            "total": np.diff(lv.offsets).astype(np.int64),
+            "length_m": (lv.cumlen[starts + counts] - lv.cumlen[starts]).round(1),
+        })
+
+    # ----- binary I/O -----
+
+    def save(self, path: Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        blobs: list[np.ndarray] = []
+        pos = 0
+
+        def add(arr: np.ndarray) -> dict:
+            nonlocal pos
+            arr = np.ascontiguousarray(arr)
+            arr = arr.astype(arr.dtype.newbyteorder("<"), copy=False)
+            entry = {"offset": pos, "dtype": arr.dtype.str, "count": int(arr.size)}
+            blobs.append(arr)
+            pos = _align(pos + arr.nbytes)
+            return entry
+
+        header = {
+            "version": VERSION,
+            "n": len(self),
+            "ids": {"blob": add(np.frombuffer(bytes(self.id_blob), dtype=np.uint8)), "offsets": add(self.id_offsets)},
+            "levels": {
+                name: {"groups": lv.groups, "arrays": {k: add(getattr(lv, k)) for k in ("offsets", "thr", "order", "cumlen")}}
+                for name, lv in self.levels.items()
+            },
+        }
+        head = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+        tmp = path.with_suffix(path.suffix + ".part")
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(head)) + head)
+            base = _align(f.tell())
+            for arr in blobs:
+                f.write(b"\0" * (_align(f.tell() - base) + base - f.tell()))
+                f.write(arr.tobytes())
+        tmp.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "ThresholdIndex":
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[:4] != MAGIC:
+            raise ValueError(f"{path}: not a threshold index")
+        (head_len,) = struct.unpack_from("<I", buf, 4)
+        header = json.loads(bytes(buf[8:8 + head_len]))
+        if header["version"] != VERSION:
+            raise ValueError(f"{path}: unsupported threshold index version {header['version']}")
+
+        base = _align(8 + head_len)
+
+        def arr(entry):
+            return np.frombuffer(buf, dtype=np.dtype(entry["dtype"]), count=entry["count"], offset=base + entry["offset"])
+
+        levels = {
+            name: Level(spec["groups"], **{k: arr(v) for k, v in spec["arrays"].items()})
+            for name, spec in header["levels"].items()
+        }
+        return cls(memoryview(buf)[base + header["ids"]["blob"]["offset"]:], arr(header["ids"]["offsets"]), levels,
+                   _buffer=buf)
+
+
+def _align(pos: int) -> int:
+    return (pos + ALIGN - 1) // ALIGN * ALIGN
+
+
+def build_threshold_index(risk: pd.DataFrame, features: pd.DataFrame, out_path: Path, name: str = AOI_LEVEL,
+                          segments=None) -> ThresholdIndex:
+    """
+    Join risk thresholds onto segment lengths / corridors from `features` and save the index.
+    `segments` (GeoDataFrame or SegmentTable) supplies geometry for the barangay level when configured.
+    """
+    cfg = _threshold_cfg()
+    cols = [c for c in ("segment_id", "length_m", "corridor_id") if c in features.columns]
+    frame = pd.DataFrame(features[cols]).merge(risk[["segment_id", "rain_threshold_mmhr"]], on="segment_id", how="left")
+    if "barangay" in cfg["groups"] and cfg["barangay_path"] is not None:
+        if segments is None and "geometry" in features.columns:
+            segments = features
+        if segments is not None:
+            frame["barangay"] = frame["segment_id"].map(
+                assign_barangay(segments, cfg["barangay_path"], cfg["barangay_name_col"]))
+        else:
+            print("[threshold] barangay_path is set but no segment geometry was given; level skipped")
+    idx = ThresholdIndex.build(frame, groups=[g for g in cfg["groups"] if g in frame.columns], name=name)
+    idx.save(out_path)
+    print(f"[threshold] {len(idx):,} segments, levels {', '.join(idx.levels)} → {out_path}")
+    return idx
+
+#  ------------- ENTRY POINT -------------
+
+if __name__ == "__main__":
+    from pipeline.modules.table_io import read_table
+
+    abbr = cfg_get("aoi", "abbr", default="mnl")
+    p = argparse.ArgumentParser()
+    p.add_argument("--segments", type=Path, default=OUTPUT_DIR / f"{abbr}_segments.parquet")
+    p.add_argument("--risk", type=Path, default=OUTPUT_DIR / f"{abbr}_risk.parquet")
+    p.add_argument("--out", type=Path, default=OUTPUT_DIR / f"{abbr}_threshold_index.bin")
+    p.add_argument("--query", type=float, default=None, metavar="MMHR", help="print the AOI answer at this intensity")
+    args = p.parse_args()
+
+    if args.query is not None and args.out.exists():
+        print(ThresholdIndex.load(args.out).query(args.query))
+    else:
+        build_threshold_index(read_table(args.risk), read_table(args.segments), args.out, name=abbr)
+        if args.query is not None:
+            print(ThresholdIndex.load(args.out).query(args.query))
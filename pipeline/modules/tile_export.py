@@ -0,0 +1,292 @@
+"""
+Offline vector tile (MVT) export of SBAFN segment layers for the Flutter map.
+
+Inputs
+- segments: GeoDataFrame (LineString), any CRS, with `segment_id`
+- features: optional per-segment table (e.g. {abbr}_pu_features / risk scores) joined on segment_id
+
+Outputs
+- MBTiles (SQLite): one gzip'd Mapbox Vector Tile per (z, x, y), TMS row order, with
+  `metadata` (name, format=pbf, bounds, center, minzoom, maxzoom, vector_layers json)
+- PMTiles: converted from the MBTiles archive when the `pmtiles` package is installed
+
+Method
+1) Project once to Web Mercator (EPSG:3857).
+2) Per zoom, simplify every geometry at ~half a tile pixel and drop segments shorter than one pixel.
+3) Assign each feature to the tiles its bbox covers (vectorized), clip to the buffered tile and
+   encode only the pruned attributes (`segment_id`, `risk_band`, `risk_score` when present).
+
+Usage
+    python -m pipeline.modules.tile_export \\
+      --segments pipeline/outputs/mnl_segments.parquet \\
+      --features pipeline/outputs/mnl_pu_features.parquet \\
+      --out pipeline/outputs/tiles/mnl_segments.mbtiles
+
+Notes
+- Fully offline: no tile server or network access; clients fetch only the visible tiles.
+- Attributes missing from the inputs are skipped (risk columns appear once scoring has run).
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import math
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import cfg_get
+
+WEB_MERCATOR = "EPSG:3857"
+WORLD_M = 2 * math.pi * 6378137.0        # web mercator world width (m)
+ORIGIN_M = WORLD_M / 2
+
+LAYER_NAME = "segments"
+MIN_ZOOM = 11
+MAX_ZOOM = 16
+EXTENT = 4096                            # MVT tile coordinate extent
+BUFFER_PX = 64                           # clip buffer in tile units, avoids seams at tile edges
+SIMPLIFY_PX = 0.5                        # simplification tolerance in tile units
+KEEP_ATTRS = ("segment_id", "risk_band", "risk_score")
+
+# ---------------------------------
+
+def _tiles_cfg() -> dict:
+    return {
+        "enabled": cfg_get("tiles", "enabled", default=True),
+        "min_zoom": int(cfg_get("tiles", "min_zoom", default=MIN_ZOOM)),
+        "max_zoom": int(cfg_get("tiles", "max_zoom", default=MAX_ZOOM)),
+        "attributes": list(cfg_get("tiles", "attributes", default=list(KEEP_ATTRS))),
+        "pmtiles": cfg_get("tiles", "pmtiles", default=True),
+    }
+
+
+def tile_size_m(z: int) -> float:
+    return WORLD_M / (1 << z)
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """(minx, miny, maxx, maxy) of XYZ tile (y=0 at the top) in EPSG:3857 metres."""
+    size = tile_size_m(z)
+    minx = -ORIGIN_M + x * size
+    maxy = ORIGIN_M - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def simplify_tolerance_m(z: int, px: float = SIMPLIFY_PX) -> float:
+    return tile_size_m(z) / EXTENT * px
+
+
+def _tile_ranges(bounds: np.ndarray, z: int) -> tuple[np.ndarray, ...]:
+    """Inclusive XYZ tile index ranges covered by each feature bbox."""
+    size = tile_size_m(z)
+    n = (1 << z) - 1
+    x0 = np.clip(np.floor((bounds[:, 0] + ORIGIN_M) / size), 0, n).astype(np.int64)
+    x1 = np.clip(np.floor((bounds[:, 2] + ORIGIN_M) / size), 0, n).astype(np.int64)
+    y0 = np.clip(np.floor((ORIGIN_M - bounds[:, 3]) / size), 0, n).astype(np.int64)
+    y1 = np.clip(np.floor((ORIGIN_M - bounds[:, 1]) / size), 0, n).astype(np.int64)
+    return x0, x1, y0, y1
+
+
+def _explode_tiles(bounds: np.ndarray, z: int) -> pd.DataFrame:
+    """One row per (feature, tile) pair touched by the feature bbox."""
+    x0, x1, y0, y1 = _tile_ranges(bounds, z)
+    nx, ny = x1 - x0 + 1, y1 - y0 + 1
+    counts = nx * ny
+    feat = np.repeat(np.arange(len(bounds)), counts)
+    # position of each pair within its feature's tile block
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    nx_rep = np.repeat(nx, counts)
+    return pd.DataFrame({
+        "feat": feat,
+        "x": np.repeat(x0, counts) + local % nx_rep,
+        "y": np.repeat(y0, counts) + local // nx_rep,
+    })
+
+
+def _feature_props(df: pd.DataFrame, attrs: list[str]) -> list[dict]:
+    """Plain-python property dicts (MVT encoder rejects numpy scalars and NA)."""
+    cols = [c for c in attrs if c in df.columns]
+    out = []
+    for rec in df[cols].to_dict("records"):
+        props = {}
+        for k, v in rec.items():
+            if v is None or (isinstance(v, float) and math.isnan(v)) or v is pd.NA:
+                continue
+            props[k] = v.item() if isinstance(v, np.generic) else v
+        out.append(props)
+    return out
+
+
+def encode_zoom(geoms_3857: np.ndarray, props: list[dict], z: int, layer_name: str = LAYER_NAME):
+    """Yield (z, x, y, mvt_bytes) for every non-empty tile at zoom z."""
+    import mapbox_vector_tile
+    import shapely
+
+    tol = simplify_tolerance_m(z)
+    geoms = shapely.simplify(geoms_3857, tol, preserve_topology=False)
+    keep = ~shapely.is_empty(geoms) & (shapely.length(geoms_3857) >= 2 * tol)
+    idx = np.flatnonzero(keep)
+    if idx.size == 0:
+        return
+
+    pairs = _explode_tiles(shapely.bounds(geoms[idx]), z).sort_values(["x", "y"], kind="stable")
+    buf = tile_size_m(z) / EXTENT * BUFFER_PX
+
+    for (x, y), grp in pairs.groupby(["x", "y"], sort=False):
+        minx, miny, maxx, maxy = tile_bounds(z, int(x), int(y))
+        feat_idx = idx[grp["feat"].to_numpy()]
+        clipped = shapely.clip_by_rect(geoms[feat_idx], minx - buf, miny - buf, maxx + buf, maxy + buf)
+        features = [
+            {"geometry": g, "properties": props[i]}
+            for g, i in zip(clipped, feat_idx)
+            if not g.is_empty
+        ]
+        if not features:
+            continue
+        data = mapbox_vector_tile.encode(
+            [{"name": layer_name, "features": features}],
+            default_options={"quantize_bounds": (minx, miny, maxx, maxy), "extents": EXTENT},
+        )
+        yield z, int(x), int(y), data
+
+#  ------------- ARCHIVE WRITERS -------------
+
+def _init_mbtiles(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    con = sqlite3.connect(path)
+    con.executescript(
+        """
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+        """
+    )
+    return con
+
+
+def write_mbtiles(
+    tiles: Iterable[tuple[int, int, int, bytes]],
+    path: str | Path,
+    metadata: dict,
+) -> tuple[Path, int]:
+    """Write XYZ tiles into an MBTiles archive (TMS rows, gzip'd pbf). Returns (path, n_tiles)."""
+    path = Path(path)
+    con = _init_mbtiles(path)
+    n = 0
+    with con:
+        batch = []
+        for z, x, y, data in tiles:
+            batch.append((z, x, (1 << z) - 1 - y, gzip.compress(data, compresslevel=6)))
+            if len(batch) >= 1000:
+                con.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", batch)
+                n += len(batch)
+                batch.clear()
+        con.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", batch)
+        n += len(batch)
+        con.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        con.executemany("INSERT INTO metadata VALUES (?, ?)", [(k, str(v)) for k, v in metadata.items()])
+    con.close()
+    return path, n
+
+
+def mbtiles_to_pmtiles(mbtiles_path: Path, max_zoom: int) -> Optional[Path]:
+    """Convert to a single-file PMTiles archive when the optional `pmtiles` package is present."""
+    try:
+        from pmtiles.convert import mbtiles_to_pmtiles as _convert
+    except ImportError:
+        print("[tiles] pmtiles not installed; keeping MBTiles only")
+        return None
+    out = mbtiles_path.with_suffix(".pmtiles")
+    _convert(str(mbtiles_path), str(out), max_zoom)
+    return out
+
+#  ------------- ENTRY POINT -------------
+
+def export_segment_tiles(
+    segments_gdf,
+    out_path: str | Path,
+    features: Optional[pd.DataFrame] = None,
+    min_zoom: int = MIN_ZOOM,
+    max_zoom: int = MAX_ZOOM,
+    attributes: Iterable[str] = KEEP_ATTRS,
+    pmtiles: bool = True,
+    name: str = "SBAFN segments",
+) -> dict[str, Path]:
+    """
+    Build a zoom pyramid of segment tiles. `features` (keyed by segment_id) supplies attribute
+    columns such as risk_band / risk_score that are not on the geometry table.
+    """
+    attributes = list(attributes)
+    seg = segments_gdf[["segment_id", "geometry"]].copy()
+    seg["segment_id"] = seg["segment_id"].astype(str)
+    if features is not None:
+        extra = [c for c in attributes if c in features.columns and c != "segment_id"]
+        if extra:
+            feat = features[["segment_id", *extra]].drop_duplicates("segment_id")
+            seg = seg.merge(feat.assign(segment_id=feat["segment_id"].astype(str)), on="segment_id", how="left")
+
+    seg = seg[seg.geometry.notna() & ~seg.geometry.is_empty]
+    seg_3857 = seg.to_crs(WEB_MERCATOR)
+    geoms = seg_3857.geometry.to_numpy()
+    props = _feature_props(seg_3857, attributes)
+
+    west, south, east, north = seg.to_crs(4326).total_bounds
+    layer_fields = {c: ("Number" if pd.api.types.is_numeric_dtype(seg[c]) else "String")
+                    for c in attributes if c in seg.columns}
+    metadata = {
+        "name": name,
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": min_zoom,
+        "maxzoom": max_zoom,
+        "bounds": f"{west:.6f},{south:.6f},{east:.6f},{north:.6f}",
+        "center": f"{(west + east) / 2:.6f},{(south + north) / 2:.6f},{min(max_zoom, 14)}",
+        "json": json.dumps({"vector_layers": [{
+            "id": LAYER_NAME, "fields": layer_fields, "minzoom": min_zoom, "maxzoom": max_zoom,
+        }]}),
+    }
+
+    def _all_tiles():
+        for z in range(min_zoom, max_zoom + 1):
+            yield from encode_zoom(geoms, props, z)
+
+    mbtiles, n_tiles = write_mbtiles(_all_tiles(), out_path, metadata)
+    print(f"[tiles] {len(seg):,} segments → {n_tiles:,} tiles (z{min_zoom}–{max_zoom}) → {mbtiles}")
+
+    written = {"mbtiles": mbtiles}
+    if pmtiles:
+        pm = mbtiles_to_pmtiles(mbtiles, max_zoom)
+        if pm is not None:
+            written["pmtiles"] = pm
+            print(f"[tiles] wrote {pm}")
+    return written
+
+
+if __name__ == "__main__":
+    from pipeline.modules.table_io import read_table
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--segments", type=Path, required=True)
+    p.add_argument("--features", type=Path, default=None)
+    p.add_argument("--out", type=Path, required=True, help="output .mbtiles (PMTiles written alongside)")
+    p.add_argument("--min_zoom", type=int, default=MIN_ZOOM)
+    p.add_argument("--max_zoom", type=int, default=MAX_ZOOM)
+    p.add_argument("--no_pmtiles", action="store_true")
+    args = p.parse_args()
+
+    export_segment_tiles(
+        read_table(args.segments, columns=["segment_id", "geometry"]),
+        args.out,
+        features=read_table(args.features) if args.features else None,
+        min_zoom=args.min_zoom,
+        max_zoom=args.max_zoom,
+        pmtiles=not args.no_pmtiles,
+    )
@@ -0,0 +1,86 @@
+"""Tiled fill / D8 / upstream area (hydrology) against a single-window solve."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.modules.hydrology import D8_CODES, condition_dem, run_hydrology
+
+CELL = (30.0, 30.0)
+
+
+def _dem(H, W, seed=0, holes=True):
+    """Ridges and valleys plus noise, rounded to 0.5 m so flats and pits cross tile edges."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:H, 0:W]
+    z = 20 + 5 * np.sin(x / 17.0) + 4 * np.cos(y / 23.0) + 0.02 * x + rng.normal(0, 1.5, (H, W))
+    z = np.round(z * 2) / 2
+    if holes:
+        z[rng.random((H, W)) < 0.003] = np.nan
+        z[H // 3:H // 3 + 7, W // 2:W // 2 + 11] = np.nan
+    return z
+
+
+def _assert_same(whole, tiled):
+    filled, depth, d8, upstream = whole
+    np.testing.assert_array_equal(tiled[0], filled)
+    np.testing.assert_array_equal(tiled[1], depth)
+    np.testing.assert_array_equal(tiled[2], d8)
+    np.testing.assert_allclose(tiled[3], upstream, rtol=1e-9)
+
+
+@pytest.mark.parametrize("shape, tile, holes", [((97, 131), 20, True), ((64, 64), 7, False), ((150, 120), 50, True)])
+def test_tiled_matches_untiled(shape, tile, holes):
+    dem = _dem(*shape, holes=holes)
+    whole = condition_dem(dem, CELL)
+    _assert_same(whole, condition_dem(dem, CELL, tile_cells=tile))
+
+    filled, depth, d8, upstream = whole
+    valid = ~np.isnan(dem)
+    assert (depth[valid] >= 0).all() and depth[valid].max() > 0
+    assert np.isin(d8[valid], np.append(D8_CODES, 0)).all()
+    # every cell drains to an outlet (code 0), so outlets collect the whole area
+    assert np.nansum(upstream[valid & (d8 == 0)]) == pytest.approx(valid.sum() * CELL[0] * CELL[1])
+
+
+def test_flat_spanning_tiles_drains_to_its_exit():
+    dem = np.full((40, 40), 10.0)
+    dem[[0, -1], :] = dem[:, [0, -1]] = 50.0
+    dem[-1, 5] = 1.0                                      # single gap in the wall
+    whole = condition_dem(dem, CELL)
+    _assert_same(whole, condition_dem(dem, CELL, tile_cells=9))
+    assert whole[3][-1, 5] == pytest.approx(40 * 40 * 900.0)     # walls drain inwards too
+
+
+def test_run_hydrology_tiles_do_not_change_rasters(tmp_path):
+    rasterio = pytest.importorskip("rasterio")
+    gpd = pytest.importorskip("geopandas")
+    from rasterio.transform import from_origin
+    from shapely.geometry import LineString
+
+    dem = _dem(300, 300, seed=3).astype(np.float32)
+    transform = from_origin(285000.0, 1625000.0, 30.0, 30.0)
+    dem_path = tmp_path / "t_30m_dem.tif"
+    with rasterio.open(dem_path, "w", driver="GTiff", height=300, width=300, count=1, dtype="float32",
+                       nodata=np.nan, crs="EPSG:32651", transform=transform) as ds:
+        ds.write(dem, 1)
+    segments = gpd.GeoDataFrame(
+        {"segment_id": ["a_p0", "b_p0", "c_p0"]},
+        geometry=[LineString([(285100, 1624900), (288000, 1622000)]),
+                  LineString([(290000, 1620000), (292500, 1620050)]),
+                  LineString([(280000, 1620000), (281000, 1621000)])],     # off the raster
+        crs="EPSG:32651",
+    )
+
+    runs = {}
+    for tile in (0, 100):
+        out = tmp_path / f"tile{tile}"
+        runs[tile] = (run_hydrology(dem_path, segments, out_dir=out, abbr="t", tile_cells=tile), out)
+    (whole, whole_dir), (tiled, tiled_dir) = runs[0], runs[100]
+
+    for name in ("dem_filled", "depression_depth", "flow_dir", "upstream_area"):
+        with rasterio.open(whole_dir / f"t_{name}.tif") as a, rasterio.open(tiled_dir / f"t_{name}.tif") as b:
+            np.testing.assert_array_equal(b.read(1), a.read(1))
+    assert sorted(p.name for p in tiled_dir.iterdir()) == sorted(p.name for p in whole_dir.iterdir())
+    assert whole["segment_id"].tolist() == ["a_p0", "b_p0", "c_p0"]
+    assert whole["upstream_area_m2"][:2].notna().all() and whole["upstream_area_m2"][2:].isna().all()
+    pd.testing.assert_frame_equal(tiled, whole)
@@ -0,0 +1,72 @@
+"""IMERG extraction on small synthetic granules (rainfall_pipeline + rainfall_grid)."""
+import numpy as np
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("netCDF4")
+
+from pipeline.modules.rainfall_grid import build_rain_grid
+from pipeline.modules.rainfall_pipeline import extract_daily_grid, extract_rainfall, extract_rainfall_grid
+
+BBOX = (120.8, 14.45, 121.2, 14.75)                 # lon_min, lat_min, lon_max, lat_max
+LON = np.round(120.55 + 0.1 * np.arange(9), 2)      # 120.55 … 121.35
+LAT = np.round(14.30 + 0.1 * np.arange(7), 2)       # 14.30 … 14.90
+AOI_LON = (LON > BBOX[0]) & (LON < BBOX[2])         # 120.85 … 121.15
+AOI_LAT = (LAT > BBOX[1]) & (LAT < BBOX[3])         # 14.50 … 14.70
+
+
+def _write_granule(directory, day: str, precip: np.ndarray, lat_descending: bool = False) -> str:
+    """IMERG-like daily granule: precipitation(time, lon, lat) in mm/day."""
+    lat = LAT[::-1] if lat_descending else LAT
+    values = precip[:, ::-1] if lat_descending else precip
+    ds = xr.Dataset(
+        {"precipitation": (("time", "lon", "lat"), values[None].astype(np.float32))},
+        coords={"time": [np.datetime64(f"{day[:4]}-{day[4:6]}-{day[6:]}")], "lon": LON, "lat": lat},
+    )
+    path = directory / f"3B-DAY.MS.MRG.3IMERG.{day}-S000000-E235959.V07B.nc4"
+    ds.to_netcdf(path, engine="netcdf4")
+    return str(path)
+
+
+@pytest.fixture
+def granules(tmp_path):
+    rng = np.random.default_rng(7)
+    days = ["20250601", "20250602", "20250603"]
+    precip = [rng.uniform(0, 40, size=(len(LON), len(LAT))) for _ in days]
+    precip[1][np.flatnonzero(AOI_LON)[0], np.flatnonzero(AOI_LAT)[0]] = np.nan    # one missing AOI cell
+    files = [_write_granule(tmp_path, d, p, lat_descending=(i == 2)) for i, (d, p) in enumerate(zip(days, precip))]
+    # expected AOI windows as (lat × lon), float32 like the extracted grid
+    aoi = [p[np.ix_(AOI_LON, AOI_LAT)].T.astype(np.float32) for p in precip]
+    return files, aoi
+
+
+def test_extract_daily_grid_reads_only_the_aoi_window(granules):
+    files, aoi = granules
+    for path, expected in zip(files, aoi):
+        g = extract_daily_grid(path, bbox=BBOX)
+        assert g["precip"].shape == (AOI_LAT.sum(), AOI_LON.sum())
+        np.testing.assert_allclose(np.sort(g["lon"]), LON[AOI_LON])
+        np.testing.assert_allclose(np.sort(g["lat"]), LAT[AOI_LAT])
+        # descending-latitude files come back in storage order
+        precip = g["precip"] if g["lat"][0] < g["lat"][-1] else g["precip"][::-1]
+        np.testing.assert_array_equal(precip, expected)
+
+
+def test_extract_rainfall_grid_per_cell_totals(granules):
+    files, aoi = granules
+    dates, lat, lon, cube = extract_rainfall_grid(files[:2], bbox=BBOX, max_workers=1)
+    assert [d.strftime("%Y%m%d") for d in dates] == ["20250601", "20250602"]
+    assert cube.shape == (2, AOI_LAT.sum(), AOI_LON.sum())
+
+    grid = build_rain_grid(dates, lat, lon, cube)
+    totals = grid.rolling["r_30d"][-1].reshape(len(lat), len(lon))
+    np.testing.assert_allclose(totals, np.nansum(aoi[:2], axis=0), rtol=1e-6)
+    # the missing cell is NaN on its day but does not blank the window
+    assert np.isnan(grid.daily[1, 0]) and totals[0, 0] == pytest.approx(aoi[0][0, 0])
+
+
+def test_extract_rainfall_daily_means(granules):
+    files, aoi = granules
+    df = extract_rainfall(files, bbox=BBOX, max_workers=1)
+    assert df["date"].dt.strftime("%Y%m%d").tolist() == ["20250601", "20250602", "20250603"]
+    np.testing.assert_allclose(df["rain_intensity_mmday"], [np.nanmean(a) for a in aoi], rtol=1e-6)
@@ -0,0 +1,75 @@
+"""Rule-based flood-risk scoring (risk_scoring.RuleScorer + score_segments)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.modules.risk_scoring import RISK_COLS, RuleScorer, score_segments
+
+INDICATORS = [
+    {"driver": "Low Elevation", "feature": "elev_mean", "transform": "below", "ref": 10.0, "scale": 10.0, "weight": 0.5},
+    {"driver": "Minimal Slope", "feature": "grade_robust_pct", "transform": "flat", "scale": 2.0, "weight": 0.3},
+    {"driver": "Road Class", "feature": "highway", "transform": "map", "values": {"primary": 1.0}, "weight": 0.2},
+    {"driver": "Canal Proximity", "feature": "canal_dist_m", "transform": "below", "ref": 150.0, "scale": 150.0, "weight": 0.25},
+]
+BANDS = {"med": 40, "high": 70}
+DESIGN = 30.0
+
+
+@pytest.fixture
+def features():
+    return pd.DataFrame({
+        "segment_id": ["a_p0", "b_p0", "c_p0", "d_p0"],
+        "elev_mean": [0.0, 20.0, 5.0, np.nan],
+        "grade_robust_pct": [0.0, 4.0, 1.0, 0.0],
+        "highway": ["primary", "residential", "primary", None],
+    })
+
+
+def _scorer():
+    return RuleScorer([dict(ind) for ind in INDICATORS], rain_min_mmhr=10, rain_max_mmhr=150, steepness=0.08)
+
+
+def test_rule_thresholds_follow_weighted_indicators(features):
+    scorer = _scorer().fit(features)
+    assert scorer.drivers == ["Low Elevation", "Minimal Slope", "Road Class"]      # no canal_dist_m column
+    # S = 1, 0, (0.25 + 0.15 + 0.2), 0.3 (missing elevation / class carry no evidence)
+    np.testing.assert_allclose(scorer.thresholds(features), [10.0, 150.0, 150 - 140 * 0.6, 150 - 140 * 0.3])
+    scores = scorer.scores(features, np.array([10.0, 150.0, 66.0, 108.0], dtype=np.float32))
+    np.testing.assert_allclose(np.diag(scores), 50.0, atol=1e-3)
+
+
+def test_score_segments_fields(features):
+    rain = np.linspace(5, 150, 30, dtype=np.float32)
+    risk, matrix = score_segments(features, scorer=_scorer(), scenarios=rain, design_mmhr=DESIGN,
+                                  bands=BANDS, chunk_rows=3)
+    assert list(risk.columns) == RISK_COLS
+    assert matrix.shape == (4, 30) and matrix.dtype == np.uint8
+    assert (np.diff(matrix.astype(int), axis=1) >= 0).all()                          # monotone in rain
+
+    thr = np.array([10.0, 150.0, 66.0, 108.0])
+    expected = np.rint(100 / (1 + np.exp(-0.08 * (DESIGN - thr))))
+    np.testing.assert_array_equal(risk["risk_score"], expected)
+    assert risk["risk_band"].tolist() == ["high", "low", "low", "low"]
+    np.testing.assert_allclose(risk["rain_threshold_mmhr"], thr)
+
+    assert risk["drivers_top"][0] == ["Low Elevation", "Minimal Slope", "Road Class"]
+    assert risk["drivers_top"][1] == []                                               # no evidence, no drivers
+    assert risk["drivers_top"][2] == ["Low Elevation", "Road Class", "Minimal Slope"]
+    assert risk["drivers_top"][3] == ["Minimal Slope"]
+    for contrib in risk["drivers_contrib"][[0, 2, 3]]:
+        assert sum(contrib.values()) == pytest.approx(1.0, abs=2e-3)
+    assert risk["drivers_contrib"][2]["Road Class"] == pytest.approx(0.2 / 0.6, abs=1e-3)
+
+    # chunking does not change the result
+    whole, whole_matrix = score_segments(features, scorer=_scorer(), scenarios=rain, design_mmhr=DESIGN,
+                                         bands=BANDS, chunk_rows=100)
+    np.testing.assert_array_equal(matrix, whole_matrix)
+    pd.testing.assert_frame_equal(risk, whole)
+
+
+def test_refit_uses_the_configured_indicators(features):
+    scorer = _scorer().fit(features)
+    assert "Canal Proximity" not in scorer.drivers
+    scorer.fit(features.assign(canal_dist_m=[0.0, 300.0, 75.0, np.nan]))
+    assert scorer.drivers == ["Low Elevation", "Minimal Slope", "Road Class", "Canal Proximity"]
+    assert len(scorer.indicators) == len(INDICATORS)
@@ -0,0 +1,69 @@
+"""Vectorized segment splitting (street_define + segment_table) against a per-edge reference."""
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+import shapely
+from shapely.geometry import LineString
+
+from pipeline.modules.street_define import make_segment_table, make_segments
+
+METRIC_CRS = "EPSG:32651"
+
+
+def _reference_parts(line: LineString, max_len):
+    """Row-wise splitting as make_segments did before the SegmentTable: equal straight chords."""
+    if not max_len or line.length <= max_len:
+        return [line]
+    n = int(np.ceil(line.length / max_len))
+    pts = [line.interpolate(f, normalized=True) for f in np.linspace(0, 1, n + 1)]
+    return [LineString([pts[i], pts[i + 1]]) for i in range(n)]
+
+
+@pytest.fixture
+def edges():
+    # metric geometries around Manila: short, curved multi-vertex, long straight, exactly one split length
+    lines = [
+        LineString([(285000, 1620000), (285012, 1620005)]),
+        LineString([(285100, 1620000), (285130, 1620040), (285170, 1620050), (285200, 1620110)]),
+        LineString([(285300, 1620000), (285300, 1620250)]),
+        LineString([(285400, 1620000), (285430, 1620000)]),
+    ]
+    gdf = gpd.GeoDataFrame(
+        {
+            "u": [1, 2, 3, 4], "v": [2, 3, 4, 5], "key": [0, 0, 1, 0],
+            "name": [["Rizal Ave", None], None, "Taft Ave", None],
+            "ref": [None, "R-9", None, None],
+            "highway": ["primary", ["secondary", "tertiary"], "primary", "residential"],
+            "lanes": ["2", None, ["3", "4"], None],
+        },
+        geometry=lines, crs=METRIC_CRS,
+    ).to_crs(4326)
+    return gdf.set_index(["u", "v", "key"])
+
+
+@pytest.mark.parametrize("split_len_m", [30, 7.5, None])
+def test_segment_table_matches_per_edge_split(edges, split_len_m):
+    table = make_segment_table(edges, split_len_m=split_len_m, metric_crs=METRIC_CRS)
+    metric = edges.to_crs(METRIC_CRS).geometry.to_numpy()
+    ref = [(i, j, part) for i, line in enumerate(metric) for j, part in enumerate(_reference_parts(line, split_len_m))]
+
+    assert len(table) == len(ref)
+    np.testing.assert_array_equal(table.edge, [i for i, _, _ in ref])
+    np.testing.assert_array_equal(table.part, [j for _, j, _ in ref])
+    geoms = table.geometry()
+    for g, (_, _, part) in zip(geoms, ref):
+        assert shapely.equals_exact(g, part, tolerance=1e-6)
+    np.testing.assert_allclose(table.length_m, [p.length for _, _, p in ref], rtol=1e-6)
+
+
+def test_make_segments_export_layout(edges):
+    segs = make_segments(edges, split_len_m=30, metric_crs=METRIC_CRS)
+    assert list(segs.columns) == ["segment_id", "parent_u", "parent_v", "parent_key",
+                                  "street_label", "highway", "lanes", "length_m", "geometry"]
+    assert segs.crs.to_epsg() == 4326
+    assert segs["segment_id"].tolist()[:2] == ["1_2_0_p0", "2_3_0_p0"]
+    assert segs["segment_id"].str.startswith("3_4_1_p").sum() == 9       # 250 m / 30 m → 9 chords
+    assert segs["parent_key"].dtype.name.lower() == "int64"
+    labels = segs.drop_duplicates("parent_u").set_index("parent_u")["street_label"].astype(str)
+    assert labels.to_dict() == {1: "Rizal Ave", 2: "R-9", 3: "Taft Ave", 4: "residential"}